@@ -1,8 +1,14 @@
 import json
 import logging
 from django.conf import settings
+from django.db import close_old_connections
 from django.http import JsonResponse
+from generation.events import publish
 from generation.services.mermaid_service import MermaidService
+from generation.services.scheduler import BACKGROUND
+from generation.tasks import get_executor
+from plot import tracing
+from plot.tracing import span
 from .models import Conversation, Message
 
 logger = logging.getLogger(__name__)
@@ -16,14 +22,14 @@ class ConversationMermaidMiddleware:
 
     def __init__(self, get_response):
         self.get_response = get_response
-        self.mermaid_service = None
 
     def __call__(self, request):
         # Check if this is an audio processing request BEFORE processing
         if (request.path == '/api/conversation/process-audio/' and
             request.method == 'POST'):
 
-            self._check_conversation_before_processing(request)
+            with span('middleware.conversation_mermaid'):
+                self._check_conversation_before_processing(request)
 
         response = self.get_response(request)
         return response
@@ -52,7 +58,14 @@ class ConversationMermaidMiddleware:
                 # If we're about to create the 10th message (or any subsequent), generate mermaid
                 if current_message_count >= 9:  # 9 because we're about to add the 10th
                     logger.info(f"Triggering mermaid generation for conversation {conversation_id} (will have {current_message_count + 1} messages)")
-                    self._generate_conversation_mermaid(conversation)
+                    # Runs on the generation workers so the turn being processed
+                    # doesn't wait behind background-priority Gemini calls
+                    user = getattr(request, 'user', None)
+                    get_executor().submit(
+                        self._generate_conversation_mermaid, conversation.id,
+                        user.pk if user is not None and user.is_authenticated else None,
+                        tracing.current_context()
+                    )
 
             except Conversation.DoesNotExist:
                 logger.warning(f"Conversation {conversation_id} not found")
@@ -61,35 +74,52 @@ class ConversationMermaidMiddleware:
         except Exception as e:
             logger.error(f"Error in ConversationMermaidMiddleware._check_conversation_before_processing: {e}")
 
-    def _generate_conversation_mermaid(self, conversation):
-        """Generate mermaid flowcharts for the conversation"""
+    def _generate_conversation_mermaid(self, conversation_id, user_id=None, trace_context=None):
+        """
+        Generate mermaid flowcharts for the conversation (on a generation worker).
+        Each flowchart is published to ``user_id``'s event stream as it finishes.
+        """
+        close_old_connections()
         try:
-            # Initialize mermaid service if needed
-            if not self.mermaid_service:
-                self.mermaid_service = MermaidService()
+            with tracing.span('conversation.mermaid', parent=trace_context, conversation_id=str(conversation_id)):
+                conversation = Conversation.objects.get(id=conversation_id)
+
+                # Regeneration is background work and must not starve conversation turns
+                mermaid_service = MermaidService(
+                    user_key=f'conversation:{conversation.id}',
+                    priority=BACKGROUND
+                )
+
+                # Build conversation text from all existing messages
+                messages = conversation.messages.all().order_by('created_at')
+                conversation_text = self._build_conversation_text(messages)
 
-            # Build conversation text from all existing messages
-            messages = conversation.messages.all().order_by('created_at')
-            conversation_text = self._build_conversation_text(messages)
+                # Extract character names from conversation for multiple flowcharts
+                character_names = self._extract_character_names(messages)
 
-            # Extract character names from conversation for multiple flowcharts
-            character_names = self._extract_character_names(messages)
+                logger.info(f"Generating mermaid flowcharts for conversation {conversation.id}")
 
-            logger.info(f"Generating mermaid flowcharts for conversation {conversation.id}")
+                def on_flowchart(key, flowchart):
+                    publish(user_id, 'conversation_flowchart', {
+                        'conversation_id': conversation.id, 'key': key, **flowchart
+                    })
 
-            # Generate multiple flowcharts (ensemble + character-specific)
-            mermaid_result = self.mermaid_service.generate_multiple_flowcharts(
-                description=conversation_text,
-                character_names=character_names
-            )
+                # Generate multiple flowcharts (ensemble + character-specific)
+                mermaid_result = mermaid_service.generate_multiple_flowcharts(
+                    description=conversation_text,
+                    character_names=character_names,
+                    on_flowchart=on_flowchart if user_id is not None else None
+                )
 
-            # Store the generated mermaid data
-            self._store_mermaid_data(conversation, mermaid_result)
+                # Store the generated mermaid data
+                self._store_mermaid_data(conversation, mermaid_result)
 
-            logger.info(f"Successfully generated {mermaid_result['total_flowcharts']} flowcharts for conversation {conversation.id}")
+                logger.info(f"Successfully generated {mermaid_result['total_flowcharts']} flowcharts for conversation {conversation.id}")
 
         except Exception as e:
-            logger.error(f"Error generating mermaid for conversation {conversation.id}: {e}")
+            logger.error(f"Error generating mermaid for conversation {conversation_id}: {e}")
+        finally:
+            close_old_connections()
 
     def _build_conversation_text(self, messages):
         """Build a narrative text from conversation messages"""
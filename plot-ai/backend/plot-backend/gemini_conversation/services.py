@@ -5,13 +5,32 @@ from django.conf import settings
 from dotenv import load_dotenv
 from google import genai
 from google.genai import types
+from generation.services.resilience import get_gemini_guard
+from generation.services.scheduler import INTERACTIVE
+from plot.metrics import timed
+from plot.tracing import span
 
 load_dotenv()
 
 class GeminiService:
-    def __init__(self):
+    def __init__(self, user_key=None, priority=INTERACTIVE):
         self.gemini_key = os.getenv("GEMINI_API_KEY")
-        self.client = genai.Client()
+        # GEMINI_API_BASE can point at a local fake server for offline runs
+        self.client = genai.Client(
+            api_key=self.gemini_key,
+            http_options=types.HttpOptions(base_url=settings.GEMINI_API_BASE)
+        )
+        # Who the work is for and how urgent it is, for the Gemini scheduler
+        self.user_key = user_key
+        self.priority = priority
+
+    def _generate_content(self, **kwargs):
+        """Call Gemini through the shared scheduler, rate limiter and retries"""
+        return get_gemini_guard().call(
+            lambda: self.client.models.generate_content(**kwargs),
+            self.priority,
+            self.user_key
+        )
 
     def get_system_prompt(self):
         """Load system prompt from file"""
@@ -24,6 +43,7 @@ class GeminiService:
         with open(prompt_file, "r") as f:
             return f.read()
 
+    @timed('gemini_text')
     def generate_text_response(self, user_input, conversation_history=None):
         """Generate text response from Gemini"""
         system_prompt = self.get_system_prompt()
@@ -33,16 +53,17 @@ class GeminiService:
         current_question_number = 1
         max_questions = 10
 
-        if conversation_history and conversation_history.exists():
-            context_parts = []
-            for msg in conversation_history:
-                context_parts.append(f"User: {msg.user_text}")
-                context_parts.append(f"Assistant: {msg.gemini_response}")
+        with span('db.conversation_history'):
+            if conversation_history and conversation_history.exists():
+                context_parts = []
+                for msg in conversation_history:
+                    context_parts.append(f"User: {msg.user_text}")
+                    context_parts.append(f"Assistant: {msg.gemini_response}")
 
-            conversation_context = f"Previous conversation history:\n{chr(10).join(context_parts)}\n"
-            current_question_number = conversation_history.count() + 1
-        else:
-            conversation_context = "This is the beginning of your conversation with the user.\n"
+                conversation_context = f"Previous conversation history:\n{chr(10).join(context_parts)}\n"
+                current_question_number = conversation_history.count() + 1
+            else:
+                conversation_context = "This is the beginning of your conversation with the user.\n"
 
         # Generate pacing guidance based on current question number
         if current_question_number <= 3:
@@ -63,15 +84,16 @@ class GeminiService:
             user_input=user_input
         )
 
-        response = self.client.models.generate_content(
+        response = self._generate_content(
             model='gemini-2.5-flash',
             contents=full_prompt,
         )
         return response.text
 
+    @timed('gemini_tts')
     def generate_audio_response(self, text_response, output_path="out.wav"):
         """Generate audio from text using Gemini TTS"""
-        response = self.client.models.generate_content(
+        response = self._generate_content(
             model="gemini-2.5-flash-preview-tts",
             contents=text_response,
             config=types.GenerateContentConfig(
@@ -102,6 +124,7 @@ class WhisperService:
     def __init__(self):
         self.model = whisper.load_model("tiny")
 
+    @timed('whisper_transcribe')
     def transcribe_audio(self, audio_file_path):
         """Transcribe audio file to text"""
         result = self.model.transcribe(audio_file_path)
@@ -9,6 +9,7 @@ from django.http import FileResponse, Http404
 from django.conf import settings
 from pydub import AudioSegment
 from pydub.playback import play
+from plot.tracing import span
 
 from .models import Conversation, Message
 from .services import GeminiService, WhisperService
@@ -60,18 +61,19 @@ class ProcessAudioView(APIView):
             conversation_history = conversation.messages.all()
 
             # Generate Gemini response
-            gemini_service = GeminiService()
+            gemini_service = GeminiService(user_key=f'conversation:{conversation.id}')
             gemini_response = gemini_service.generate_text_response(
                 user_text,
                 conversation_history
             )
 
             # Save message to database
-            message = Message.objects.create(
-                conversation=conversation,
-                user_text=user_text,
-                gemini_response=gemini_response
-            )
+            with span('db.save_message'):
+                message = Message.objects.create(
+                    conversation=conversation,
+                    user_text=user_text,
+                    gemini_response=gemini_response
+                )
 
             # Generate audio response
             audio_output_path = os.path.join(
@@ -88,8 +90,9 @@ class ProcessAudioView(APIView):
 
             # Play the audio response locally (for testing)
             try:
-                audio = AudioSegment.from_file(audio_output_path)
-                play(audio)
+                with span('audio.local_playback'):
+                    audio = AudioSegment.from_file(audio_output_path)
+                    play(audio)
             except Exception as e:
                 print(f"Audio playback failed: {e}")
 
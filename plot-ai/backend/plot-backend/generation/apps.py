@@ -4,3 +4,10 @@ from django.apps import AppConfig
 class GenerationConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'generation'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from plot.metrics import registry
+        from .services import resilience, scheduler
+        registry.register_collector(scheduler.collect_metrics)
+        registry.register_collector(resilience.collect_metrics)
@@ -0,0 +1,226 @@
+"""
+End-to-end benchmarks for the generation and voice pipelines.
+
+Each stage is a callable run ``requests`` times at several concurrency levels
+against the local fake Gemini server; results are summarized as throughput and
+latency percentiles and written as JSON so runs can be diffed across commits.
+Driven by ``python manage.py benchmark``.
+"""
+import math
+import os
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.db import close_old_connections
+
+from story.models import Story
+from .services.mermaid_service import MermaidService
+
+SAMPLE_STORY = """
+Mara, a lighthouse keeper on a dying island, finds a message in a bottle written in her own hand.
+She must decide whether to trust it and leave the island, or stay and keep the light burning.
+Her brother Tomas wants to sell the lighthouse; the ferry captain Ilse knows more than she says.
+A storm forces the choice: Mara follows the message across the strait and finds the island's past.
+"""
+
+SAMPLE_MERMAID = """flowchart TD
+    A((Start)) --> B[Mara finds the message]
+    B --> C{Trust it?}
+    C -->|Yes| D[Cross the strait]
+    C -->|No| E[Keep the light]
+    D --> F[Discover the past]
+    E --> G[Storm hits]
+    G --> D
+    F --> H((End))"""
+
+
+class SkipStage(Exception):
+    """The stage cannot run in this environment (missing binary or dependency)"""
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+def summarize(latencies, errors, wall_seconds):
+    latencies = sorted(latencies)
+    to_ms = lambda value: round(value * 1000, 3) if value is not None else None
+    return {
+        'requests': len(latencies) + errors,
+        'errors': errors,
+        'wall_seconds': round(wall_seconds, 4),
+        'throughput_rps': round(len(latencies) / wall_seconds, 3) if wall_seconds else None,
+        'mean_ms': to_ms(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': to_ms(percentile(latencies, 50)),
+        'p95_ms': to_ms(percentile(latencies, 95)),
+        'p99_ms': to_ms(percentile(latencies, 99)),
+        'max_ms': to_ms(latencies[-1]) if latencies else None,
+    }
+
+
+def run_stage(operation, concurrency, requests):
+    """Run ``operation(i)`` ``requests`` times with ``concurrency`` workers"""
+    def timed(i):
+        try:
+            started = time.perf_counter()
+            operation(i)
+            return time.perf_counter() - started
+        finally:
+            close_old_connections()
+
+    latencies = []
+    errors = []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench') as pool:
+        futures = [pool.submit(timed, i) for i in range(requests)]
+        for future in futures:
+            try:
+                latencies.append(future.result())
+            except Exception as e:
+                errors.append(repr(e))
+    wall = time.perf_counter() - started
+
+    result = summarize(latencies, len(errors), wall)
+    if errors:
+        result['sample_errors'] = sorted(set(errors))[:5]
+    return result
+
+
+def write_tone_wav(path, seconds=2.0, rate=16000):
+    """Write a short mono tone to stand in for a recorded voice turn"""
+    period = b''.join(
+        struct.pack('<h', int(4000 * math.sin(2 * math.pi * n / 80))) for n in range(80)
+    )
+    with wave.open(path, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(period * int(rate * seconds / 80))
+
+
+class BenchmarkContext:
+    """Fixtures shared by the stages: a user, a story and an audio sample"""
+
+    def __init__(self):
+        self.user, _ = User.objects.get_or_create(username='benchmark')
+        self.story = Story.objects.create(
+            user=self.user, title='The Lighthouse Letter', content=SAMPLE_STORY
+        )
+        self.tempdir = tempfile.mkdtemp(prefix='plot-bench-')
+        self.audio_path = os.path.join(self.tempdir, 'turn.wav')
+        write_tone_wav(self.audio_path)
+
+    def cleanup(self):
+        shutil.rmtree(self.tempdir, ignore_errors=True)
+
+
+def story_to_mermaid(context):
+    def operation(i):
+        MermaidService(user_key=f'bench-{i}').generate_mermaid_from_story(
+            context.story.content, context.story.title
+        )
+    return operation
+
+
+def mermaid_to_svg(context):
+    if shutil.which('mmdc') is None:
+        raise SkipStage('Mermaid CLI (mmdc) not installed')
+
+    def operation(i):
+        svg_path = MermaidService(user_key=f'bench-{i}').render_svg_from_mermaid(SAMPLE_MERMAID)
+        os.remove(svg_path)
+    return operation
+
+
+def visualization_create(context, poll_interval=0.01, timeout=60.0):
+    from rest_framework.test import APIClient
+
+    def operation(i):
+        client = APIClient()
+        client.force_authenticate(context.user)
+        response = client.post('/api/visualization-requests/', {
+            'story': str(context.story.id),
+            'visualization_type': 'flowchart',
+        }, format='json')
+        if response.status_code != 202:
+            raise RuntimeError(f'create returned {response.status_code}')
+        request_id = response.json()['id']
+
+        # Time to a finished visualization, as a polling client would see it
+        deadline = time.perf_counter() + timeout
+        while time.perf_counter() < deadline:
+            status = client.get(
+                '/api/visualization-requests/status/', {'ids': request_id}
+            ).json()['results'][0]['status']
+            if status == 'completed':
+                return
+            if status == 'failed':
+                raise RuntimeError('visualization failed')
+            time.sleep(poll_interval)
+        raise TimeoutError('visualization did not complete in time')
+    return operation
+
+
+def voice_turn(context):
+    try:
+        from gemini_conversation.models import Conversation
+        from gemini_conversation.services import GeminiService, WhisperService
+    except ImportError as e:
+        raise SkipStage(f'voice pipeline dependencies unavailable: {e}')
+
+    whisper_service = WhisperService()
+
+    def operation(i):
+        conversation = Conversation.objects.create()
+        user_text = whisper_service.transcribe_audio(context.audio_path)
+        gemini_service = GeminiService(user_key=f'conversation:{conversation.id}')
+        reply = gemini_service.generate_text_response(user_text, conversation.messages.all())
+        output = os.path.join(context.tempdir, f'reply_{i}.wav')
+        gemini_service.generate_audio_response(reply, output)
+        os.remove(output)
+    return operation
+
+
+STAGES = {
+    'story_to_mermaid': story_to_mermaid,
+    'mermaid_to_svg': mermaid_to_svg,
+    'visualization_create': visualization_create,
+    'voice_turn': voice_turn,
+}
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            check=True, capture_output=True, text=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare_results(base, current, metrics=('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms')):
+    """Yield ``(stage, concurrency, metric, base, current, change_pct)`` rows"""
+    for stage, levels in current.get('stages', {}).items():
+        base_levels = base.get('stages', {}).get(stage, {})
+        if not isinstance(levels, dict) or 'skipped' in levels:
+            continue
+        for concurrency, result in levels.items():
+            previous = base_levels.get(concurrency) if isinstance(base_levels, dict) else None
+            if not previous:
+                continue
+            for metric in metrics:
+                old, new = previous.get(metric), result.get(metric)
+                if old in (None, 0) or new is None:
+                    continue
+                yield stage, concurrency, metric, old, new, round((new - old) / old * 100, 1)
@@ -0,0 +1,136 @@
+"""
+In-process publish/subscribe for pushing job and visualization updates to clients.
+
+Each event is encoded to its Server-Sent Events wire format once and the same
+bytes are handed to every subscriber of that user, so fan-out cost is one queue
+put per connected client. A short per-user history lets reconnecting clients
+resume from ``Last-Event-ID`` without missing transitions.
+
+The broker lives in process memory: clients only see events published by the
+same server process they are connected to. Event IDs are ``<epoch>-<n>`` with
+an epoch drawn when the process starts, so an ID from before a restart or from
+another worker is recognised as such; a client resuming from one, or from an ID
+older than the history kept, is told to start over from a snapshot.
+"""
+import itertools
+import json
+import logging
+import queue
+import secrets
+import threading
+from collections import defaultdict, deque
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+logger = logging.getLogger(__name__)
+
+HISTORY_SIZE = 100
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+def encode_event(event_id, event, data):
+    """Encode an event in text/event-stream format"""
+    payload = json.dumps(data, cls=DjangoJSONEncoder, separators=(',', ':'))
+    id_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{id_line}event: {event}\ndata: {payload}\n\n".encode('utf-8')
+
+
+class Subscription:
+    """A single connected client's view of the broker"""
+
+    def __init__(self, broker, user_id):
+        self.broker = broker
+        self.user_id = user_id
+        self.queue = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self.overflowed = False
+        # Whether history covered every event since the client's Last-Event-ID
+        self.resumed = False
+
+    def put(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            # Slow consumer: stop feeding it rather than buffering without bound
+            self.overflowed = True
+
+    def get(self, timeout):
+        """Return the next encoded message, or None if nothing arrived in time"""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class EventBroker:
+    def __init__(self, history_size=HISTORY_SIZE):
+        self._lock = threading.Lock()
+        self.epoch = secrets.token_hex(4)
+        self._ids = itertools.count(1)
+        self._subscribers = defaultdict(set)
+        self._history = defaultdict(lambda: deque(maxlen=history_size))
+        # Per user, the sequence number of the newest event pushed out of history
+        self._evicted = {}
+
+    def parse_event_id(self, event_id):
+        """Sequence number of one of this broker's event IDs, or None"""
+        epoch, _, number = (event_id or '').partition('-')
+        if epoch != self.epoch or not number.isdigit():
+            return None
+        return int(number)
+
+    def publish(self, user_id, event, data):
+        """Send an event to every subscriber of ``user_id``"""
+        with self._lock:
+            number = next(self._ids)
+            event_id = f'{self.epoch}-{number}'
+            message = encode_event(event_id, event, data)
+            history = self._history[user_id]
+            if len(history) == history.maxlen:
+                self._evicted[user_id] = history[0][0]
+            history.append((number, message))
+            subscribers = list(self._subscribers.get(user_id, ()))
+
+        for subscription in subscribers:
+            subscription.put(message)
+        return event_id
+
+    def subscribe(self, user_id, last_event_id=None):
+        """
+        Register a subscriber, replaying history newer than ``last_event_id``.
+        ``subscription.resumed`` tells whether that replay is complete.
+        """
+        subscription = Subscription(self, user_id)
+        last = self.parse_event_id(last_event_id)
+        with self._lock:
+            self._subscribers[user_id].add(subscription)
+            if last is not None and last >= self._evicted.get(user_id, 0):
+                subscription.resumed = True
+                for number, message in self._history.get(user_id, ()):
+                    if number > last:
+                        subscription.put(message)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._subscribers[subscription.user_id]
+
+    def subscriber_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscribers.get(user_id, ()))
+            return sum(len(s) for s in self._subscribers.values())
+
+
+broker = EventBroker()
+
+
+def publish(user_id, event, data):
+    """Publish an event for a user on the shared broker"""
+    return broker.publish(user_id, event, data)
@@ -0,0 +1,326 @@
+"""
+A local stand-in for the subset of the Gemini REST API this backend uses.
+
+Serves ``GET /v1beta/models``, ``:generateContent``, ``:streamGenerateContent``
+(JSON array or ``?alt=sse``) and TTS requests answered with base64 PCM, with
+configurable latency and error injection. Point the backend at it with
+``GEMINI_API_BASE=http://127.0.0.1:8765`` (any ``GEMINI_API_KEY`` is accepted).
+
+Run it with ``python manage.py run_fake_gemini`` or, from code, ``start_fake_gemini()``.
+"""
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import struct
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+TEXT_MODELS = [
+    'models/gemini-2.5-flash',
+    'models/gemini-2.5-pro',
+    'models/gemini-2.0-flash',
+]
+TTS_MODELS = ['models/gemini-2.5-flash-preview-tts']
+
+PCM_RATE = 24000
+
+MERMAID_TEMPLATES = [
+    '''flowchart TD
+    A((Start)) --> B[{title}: Opening Scene]
+    B --> C[Introduce the Protagonist]
+    C --> D{{Accept the Call?}}
+    D -->|Yes| E[Journey Begins]
+    D -->|No| F[Refusal and Consequences]
+    F --> E
+    E --> G[Meet the Mentor]
+    G --> H{{Trust the Mentor?}}
+    H -->|Yes| I[Training]
+    H -->|No| J[Go It Alone]
+    I --> K[Climax: Final Confrontation]
+    J --> K
+    K --> L[Resolution]
+    L --> M((End))''',
+    '''flowchart TD
+    A[Opening Scene] --> B[Setup: {title}]
+    B --> C[Inciting Incident]
+    C --> D{{Critical Decision}}
+    D --Main Path--> E[Rising Action]
+    D --Alternative Path--> F[Unexpected Ally]
+    E --> G[Midpoint Reversal]
+    F --> G
+    G --> H{{Sacrifice?}}
+    H -->|Yes| I[Bittersweet Victory]
+    H -->|No| J[Pyrrhic Escape]
+    I --> K((Ending A))
+    J --> L((Ending B))''',
+    '''flowchart TD
+    A((Start)) --> B[Characters Meet]
+    B --> C{{Major Conflict}}
+    C -->|Path 1| D[Heist Planning]
+    C -->|Path 2| E[Betrayal Revealed]
+    D --> F[The Heist]
+    E --> F
+    F --> G{{Escape Succeeds?}}
+    G -->|Success| H[Freedom]
+    G -->|Fails| I[Captured]
+    I --> J[Prison Break]
+    J --> H
+    H --> K((End))''',
+]
+
+CONVERSATION_REPLIES = [
+    "That's a compelling premise. Who is your main character, and what do they want most at the start?",
+    "Interesting. What stands in their way, and how does that obstacle reflect their inner flaw?",
+    "Great detail. How should the audience feel in the final scene: triumphant, uneasy, or heartbroken?",
+]
+
+
+class FakeGeminiConfig:
+    """Latency and failure behaviour of the fake server"""
+
+    def __init__(self, latency_ms=150.0, latency_jitter_ms=50.0, tts_latency_ms=400.0,
+                 error_rate=0.0, rate_limit_rate=0.0, retry_after=1,
+                 mermaid_nodes=0, stream_chunks=4, seed=None):
+        self.latency_ms = latency_ms
+        self.latency_jitter_ms = latency_jitter_ms
+        self.tts_latency_ms = tts_latency_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        # 0 uses the canned templates; N > 0 synthesizes an N-node branching graph
+        self.mermaid_nodes = mermaid_nodes
+        self.stream_chunks = stream_chunks
+        self.random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample_latency(self, base_ms):
+        # Log-normal jitter gives the long right tail real upstream calls have
+        with self._lock:
+            jitter = self.random.lognormvariate(0, 0.5) * self.latency_jitter_ms
+        return max(0.0, base_ms + jitter - self.latency_jitter_ms) / 1000.0
+
+    def sample_failure(self):
+        """Return an injected HTTP status code, or None to answer normally"""
+        with self._lock:
+            roll = self.random.random()
+        if roll < self.rate_limit_rate:
+            return 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return 503
+        return None
+
+
+def synthetic_mermaid(node_count, seed):
+    """A deterministic branching narrative with roughly ``node_count`` nodes"""
+    rng = random.Random(seed)
+    lines = ['flowchart TD', '    N0((Start))']
+    for i in range(1, node_count):
+        parent = rng.randrange(max(0, i - 4), i)
+        if i % 5 == 0:
+            lines.append(f'    N{parent} -->|Choice {i}| N{i}{{{{Decision {i}?}}}}')
+        else:
+            lines.append(f'    N{parent} --> N{i}[Act {i // 10 + 1}: Scene {i}]')
+    return '\n'.join(lines)
+
+
+def _prompt_text(body):
+    parts = []
+    for content in body.get('contents', []) or []:
+        if isinstance(content, str):
+            parts.append(content)
+            continue
+        for part in content.get('parts', []) or []:
+            if isinstance(part, dict) and part.get('text'):
+                parts.append(part['text'])
+    return '\n'.join(parts)
+
+
+def _is_audio_request(model, body):
+    config = body.get('generationConfig') or {}
+    modalities = config.get('responseModalities') or []
+    return 'tts' in model or 'AUDIO' in modalities
+
+
+# One period of a 200 Hz tone at PCM_RATE, 16-bit little-endian mono
+_TONE_PERIOD = b''.join(
+    struct.pack('<h', int(3000 * math.sin(2 * math.pi * n / 120))) for n in range(120)
+)
+
+
+def _pcm_tone(text):
+    """16-bit mono PCM whose duration scales with the text, like real speech"""
+    seconds = min(10.0, 0.5 + len(text) / 15.0)
+    periods = int(PCM_RATE * seconds) // 120
+    return _TONE_PERIOD * periods
+
+
+class FakeGeminiHandler(BaseHTTPRequestHandler):
+    server_version = 'FakeGemini/1.0'
+    protocol_version = 'HTTP/1.1'
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def _send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_failure(self, status):
+        headers = {'Retry-After': str(self.config.retry_after)} if status == 429 else None
+        message = 'Resource has been exhausted' if status == 429 else 'The model is overloaded'
+        self._send_json(status, {'error': {
+            'code': status,
+            'message': message,
+            'status': 'RESOURCE_EXHAUSTED' if status == 429 else 'UNAVAILABLE',
+        }}, headers)
+
+    def do_GET(self):
+        path = urlparse(self.path).path.rstrip('/')
+        if path.endswith('/models'):
+            time.sleep(self.config.sample_latency(self.config.latency_ms / 3))
+            self._send_json(200, {'models': [
+                {
+                    'name': name,
+                    'displayName': name.split('/', 1)[1],
+                    'supportedGenerationMethods': ['generateContent', 'streamGenerateContent'],
+                }
+                for name in TEXT_MODELS + TTS_MODELS
+            ]})
+            return
+        self._send_json(404, {'error': {'code': 404, 'message': f'Unknown path {path}'}})
+
+    def do_POST(self):
+        parsed = urlparse(self.path)
+        match = re.search(r'/models/([^/:]+):(generateContent|streamGenerateContent)$', parsed.path)
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if not match:
+            self._send_json(404, {'error': {'code': 404, 'message': f'Unknown path {parsed.path}'}})
+            return
+
+        try:
+            body = json.loads(raw or b'{}')
+        except ValueError:
+            self._send_json(400, {'error': {'code': 400, 'message': 'Invalid JSON payload'}})
+            return
+
+        model, method = match.groups()
+        audio = _is_audio_request(model, body)
+        time.sleep(self.config.sample_latency(
+            self.config.tts_latency_ms if audio else self.config.latency_ms
+        ))
+
+        failure = self.config.sample_failure()
+        if failure:
+            self._send_failure(failure)
+            return
+
+        prompt = _prompt_text(body)
+        if audio:
+            self._send_json(200, self._audio_response(prompt))
+        elif method == 'streamGenerateContent':
+            self._send_stream(self._text_for(prompt), 'sse' in parse_qs(parsed.query).get('alt', []))
+        else:
+            self._send_json(200, self._text_response(self._text_for(prompt)))
+
+    def _text_for(self, prompt):
+        digest = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest(), 16)
+        if 'mermaid' in prompt.lower():
+            if self.config.mermaid_nodes:
+                return synthetic_mermaid(self.config.mermaid_nodes, digest)
+            title_match = re.search(r'Title:\s*(.+)', prompt)
+            title = title_match.group(1).strip()[:40] if title_match else 'Story'
+            template = MERMAID_TEMPLATES[digest % len(MERMAID_TEMPLATES)]
+            return '```mermaid\n' + template.format(title=title) + '\n```'
+        return CONVERSATION_REPLIES[digest % len(CONVERSATION_REPLIES)]
+
+    def _text_response(self, text, finish_reason='STOP'):
+        candidate = {
+            'content': {'role': 'model', 'parts': [{'text': text}]},
+            'index': 0,
+        }
+        if finish_reason:
+            candidate['finishReason'] = finish_reason
+        return {
+            'candidates': [candidate],
+            'usageMetadata': {
+                'promptTokenCount': 0,
+                'candidatesTokenCount': max(1, len(text) // 4),
+            },
+            'modelVersion': 'fake-gemini',
+        }
+
+    def _audio_response(self, text):
+        return {
+            'candidates': [{
+                'content': {'role': 'model', 'parts': [{'inlineData': {
+                    'mimeType': f'audio/L16;codec=pcm;rate={PCM_RATE}',
+                    'data': base64.b64encode(_pcm_tone(text)).decode('ascii'),
+                }}]},
+                'finishReason': 'STOP',
+                'index': 0,
+            }],
+            'modelVersion': 'fake-gemini-tts',
+        }
+
+    def _send_stream(self, text, sse):
+        chunk_count = max(1, self.config.stream_chunks)
+        size = math.ceil(len(text) / chunk_count) or 1
+        pieces = [text[i:i + size] for i in range(0, len(text), size)] or ['']
+        chunks = [
+            self._text_response(piece, 'STOP' if i == len(pieces) - 1 else None)
+            for i, piece in enumerate(pieces)
+        ]
+
+        if not sse:
+            self._send_json(200, chunks)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        inter_chunk = self.config.latency_ms / 1000.0 / chunk_count
+        for chunk in chunks:
+            self.wfile.write(f'data: {json.dumps(chunk)}\r\n\r\n'.encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(inter_chunk)
+
+
+class FakeGeminiServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, config=None, verbose=False):
+        super().__init__(address, FakeGeminiHandler)
+        self.config = config or FakeGeminiConfig()
+        self.verbose = verbose
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+
+def start_fake_gemini(config=None, host='127.0.0.1', port=0):
+    """Start a fake server on a background thread; ``port=0`` picks a free port"""
+    server = FakeGeminiServer((host, port), config)
+    thread = threading.Thread(target=server.serve_forever, name='fake-gemini', daemon=True)
+    thread.start()
+    return server
@@ -0,0 +1,22 @@
+"""
+Server-side flowchart graphs: Mermaid text parsed into a compact node/edge IR,
+layered layouts of that IR for ReactFlow, structural diffs between versions,
+branching-narrative analytics, character projections and story graphs
+merged from per-chapter fragments.
+"""
+from .mermaid import parse_mermaid, graph_for, extract_mermaid, act_number, clean_label, to_mermaid, IR_VERSION
+from .layout import (
+    compute_layout, incremental_layout, layout_disruption, get_layout, stored_layout, graph_hash, to_reactflow
+)
+from .diff import diff_graphs, apply_patch, normalize_label
+from .analytics import analyze, to_csr, strongly_connected_components
+from .projection import project_character
+from .merge import merge_chapters
+
+__all__ = [
+    'parse_mermaid', 'graph_for', 'extract_mermaid', 'act_number', 'clean_label', 'to_mermaid', 'IR_VERSION',
+    'compute_layout', 'incremental_layout', 'layout_disruption', 'get_layout', 'stored_layout', 'graph_hash',
+    'to_reactflow', 'diff_graphs', 'apply_patch', 'normalize_label',
+    'analyze', 'to_csr', 'strongly_connected_components', 'project_character',
+    'merge_chapters',
+]
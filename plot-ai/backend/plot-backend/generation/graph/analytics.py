@@ -0,0 +1,228 @@
+"""
+Branching-narrative analytics for parsed flowchart graphs.
+
+The graph is converted to compressed sparse row form (``offsets`` and
+``targets`` lists, node ``v``'s successors being
+``targets[offsets[v]:offsets[v + 1]]``) and every pass over it is iterative,
+so deep stories cannot hit the recursion limit:
+
+1. strongly connected components (Tarjan), which are the story's loops;
+2. reachability and shortest routes from the start by breadth-first search;
+3. playthrough counts and longest routes by dynamic programming over the
+   condensation (each loop collapsed to a single step), in topological order.
+
+The start is the first declared node nothing leads to, endings are nodes with
+no way out. Playthroughs are distinct routes through the condensation, so a
+loop contributes one route however many times it could be repeated. Counts
+grow exponentially with branching, so they saturate: anything above
+``MAX_SAFE_INTEGER`` is reported as the string ``'>9007199254740991'``.
+"""
+from collections import deque
+
+# Largest count JavaScript clients can hold exactly; larger ones saturate
+MAX_SAFE_INTEGER = 2 ** 53 - 1
+SATURATED = MAX_SAFE_INTEGER + 1
+# Loops listed individually in the response; all of them are counted
+MAX_REPORTED_CYCLES = 50
+
+
+def to_csr(graph):
+    """``(offsets, targets)`` adjacency arrays of a graph IR, duplicate edges dropped"""
+    n = len(graph['nodes'])
+    # Edges as source * n + target integers: cheap to deduplicate
+    keys = {edge['source'] * n + edge['target'] for edge in graph['edges']}
+    offsets = [0] * (n + 1)
+    for key in keys:
+        offsets[key // n + 1] += 1
+    for v in range(n):
+        offsets[v + 1] += offsets[v]
+    fill = offsets[:-1]
+    targets = [0] * len(keys)
+    for key in keys:
+        source, target = divmod(key, n)
+        targets[fill[source]] = target
+        fill[source] += 1
+    return offsets, targets
+
+
+def strongly_connected_components(offsets, targets):
+    """Component index of every node; components are numbered in reverse topological order"""
+    n = len(offsets) - 1
+    index = [-1] * n
+    low = [0] * n
+    component = [-1] * n
+    on_stack = [False] * n
+    stack = []
+    counter = 0
+    count = 0
+
+    for root in range(n):
+        if index[root] != -1:
+            continue
+        # Each frame is (node, position of the next successor to visit)
+        frames = [(root, offsets[root])]
+        index[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        while frames:
+            v, i = frames[-1]
+            end = offsets[v + 1]
+            while i < end:
+                w = targets[i]
+                i += 1
+                if index[w] == -1:
+                    break
+                if on_stack[w] and index[w] < low[v]:
+                    low[v] = index[w]
+            else:
+                frames.pop()
+                if low[v] == index[v]:
+                    while True:
+                        w = stack.pop()
+                        on_stack[w] = False
+                        component[w] = count
+                        if w == v:
+                            break
+                    count += 1
+                if frames:
+                    parent = frames[-1][0]
+                    if low[v] < low[parent]:
+                        low[parent] = low[v]
+                continue
+            frames[-1] = (v, i)
+            index[w] = low[w] = counter
+            counter += 1
+            stack.append(w)
+            on_stack[w] = True
+            frames.append((w, offsets[w]))
+    return component, count
+
+
+def start_node(offsets, targets):
+    """First declared node without incoming edges (self-loops aside), else the first node"""
+    n = len(offsets) - 1
+    has_incoming = [False] * n
+    for v in range(n):
+        for w in targets[offsets[v]:offsets[v + 1]]:
+            if w != v:
+                has_incoming[w] = True
+    return next((v for v in range(n) if not has_incoming[v]), 0)
+
+
+def _bfs(offsets, targets, start):
+    """Hop distance from ``start`` (-1 if unreachable) and BFS parents"""
+    n = len(offsets) - 1
+    distance = [-1] * n
+    parent = [-1] * n
+    distance[start] = 0
+    queue = deque([start])
+    while queue:
+        v = queue.popleft()
+        for w in targets[offsets[v]:offsets[v + 1]]:
+            if distance[w] == -1:
+                distance[w] = distance[v] + 1
+                parent[w] = v
+                queue.append(w)
+    return distance, parent
+
+
+def _json_int(value):
+    return value if value <= MAX_SAFE_INTEGER else f'>{MAX_SAFE_INTEGER}'
+
+
+def analyze(graph, start=None):
+    """
+    Endings, playthroughs, shortest/longest routes, unreachable nodes and loops
+    of a graph IR. ``start`` is a node ID; by default the first declared node
+    without incoming edges.
+    """
+    nodes = graph['nodes']
+    n = len(nodes)
+    if n == 0:
+        return {
+            'node_count': 0, 'edge_count': 0, 'start': None, 'playthroughs': 0,
+            'endings': [], 'unreachable': [], 'cycle_count': 0, 'cycles': [],
+        }
+    ids = [node['id'] for node in nodes]
+    offsets, targets = to_csr(graph)
+    if start is None:
+        start_index = start_node(offsets, targets)
+    else:
+        start_index = ids.index(start)
+
+    component, count = strongly_connected_components(offsets, targets)
+    members = [[] for _ in range(count)]
+    for v in range(n):
+        members[component[v]].append(v)
+    self_loop = [False] * count
+    successors = [set() for _ in range(count)]
+    for v in range(n):
+        c = component[v]
+        for w in targets[offsets[v]:offsets[v + 1]]:
+            d = component[w]
+            if d != c:
+                successors[c].add(d)
+            elif w == v:
+                self_loop[c] = True
+
+    # Tarjan numbers components in reverse topological order
+    start_component = component[start_index]
+    paths = [0] * count
+    longest = [-1] * count
+    paths[start_component] = 1
+    longest[start_component] = 0
+    for c in range(start_component, -1, -1):
+        if not paths[c]:
+            continue
+        for d in successors[c]:
+            paths[d] = min(paths[d] + paths[c], SATURATED)
+            if longest[c] + 1 > longest[d]:
+                longest[d] = longest[c] + 1
+
+    distance, parent = _bfs(offsets, targets, start_index)
+
+    endings = []
+    playthroughs = 0
+    for v in range(n):
+        if offsets[v] != offsets[v + 1]:
+            continue
+        c = component[v]
+        ending = {'id': ids[v], 'label': nodes[v]['label'], 'reachable': distance[v] != -1}
+        if ending['reachable']:
+            route = []
+            w = v
+            while w != -1:
+                route.append(ids[w])
+                w = parent[w]
+            route.reverse()
+            playthroughs = min(playthroughs + paths[c], SATURATED)
+            ending.update({
+                'playthroughs': _json_int(paths[c]),
+                'shortest': distance[v],
+                'shortest_route': route,
+                'longest': longest[c],
+            })
+        endings.append(ending)
+
+    cycles = []
+    for c in range(count - 1, -1, -1):
+        if len(members[c]) > 1 or self_loop[c]:
+            cycles.append({
+                'nodes': [ids[v] for v in members[c]],
+                'size': len(members[c]),
+                'reachable': distance[members[c][0]] != -1,
+                'escapable': bool(successors[c]),
+            })
+    cycles.sort(key=lambda cycle: -cycle['size'])
+
+    return {
+        'node_count': n,
+        'edge_count': len(targets),
+        'start': ids[start_index],
+        'playthroughs': _json_int(playthroughs),
+        'endings': endings,
+        'unreachable': [ids[v] for v in range(n) if distance[v] == -1],
+        'cycle_count': len(cycles),
+        'cycles': cycles[:MAX_REPORTED_CYCLES],
+    }
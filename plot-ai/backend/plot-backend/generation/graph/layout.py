@@ -0,0 +1,551 @@
+"""
+Layered (Sugiyama-style) layout for parsed flowchart graphs.
+
+1. break cycles by reversing DFS back edges;
+2. assign layers by longest path from the sources;
+3. split edges spanning several layers with dummy vertices;
+4. order each layer with barycenter sweeps, keeping the order with the fewest
+   crossings;
+5. place vertices at the mean of their neighbours without overlapping,
+   alternating downward and upward passes.
+
+Full layouts depend only on the direction, node IDs and edges (every node has
+the same size), so they are cached by ``graph_hash`` and reused until the graph
+structure changes. When an earlier version of the graph and the layout it was
+shown with are known, small edits are laid out incrementally instead
+(``incremental_layout``): shared nodes stay pinned and only inserted nodes are
+placed. Those results depend on the earlier layout too, so they are cached
+under both. ``to_reactflow`` combines a layout with the graph's labels into
+the payload the frontend feeds to ReactFlow.
+"""
+import hashlib
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+
+LAYOUT_VERSION = 3
+
+# Matches the node box drawn by the frontend (flowchart.tsx) and its spacing
+NODE_WIDTH = 240
+NODE_HEIGHT = 80
+NODE_SEP = 140
+RANK_SEP = 70
+DUMMY_SEP = 40
+
+ORDER_SWEEPS = 8
+PLACEMENT_SWEEPS = 4
+# Above this many vertices (dummies included) only one pass of each sweep runs
+LARGE_LAYOUT_VERTICES = 50000
+
+
+def graph_hash(graph):
+    """Stable hash of everything that affects a graph's layout"""
+    payload = {
+        'v': LAYOUT_VERSION,
+        'direction': graph.get('direction', 'TD'),
+        'nodes': [node['id'] for node in graph['nodes']],
+        'edges': [[edge['source'], edge['target']] for edge in graph['edges']],
+    }
+    return hashlib.sha256(json.dumps(payload, separators=(',', ':')).encode()).hexdigest()[:32]
+
+
+def _skeleton(graph):
+    """Node IDs and edges of a graph: all ``layout_disruption`` needs"""
+    return {
+        'nodes': [{'id': node['id']} for node in graph['nodes']],
+        'edges': [{'source': edge['source'], 'target': edge['target']} for edge in graph['edges']],
+    }
+
+
+def _break_cycles(n, edges):
+    """Indices of edges to reverse so the graph becomes acyclic"""
+    out = [[] for _ in range(n)]
+    indegree = [0] * n
+    for i, (s, t) in enumerate(edges):
+        out[s].append((t, i))
+        indegree[t] += 1
+
+    # Visit from the sources first so the edges reversed are genuine back edges
+    roots = [v for v in range(n) if indegree[v] == 0] + list(range(n))
+    state = [0] * n  # 0 unvisited, 1 on stack, 2 done
+    reversed_edges = set()
+    for root in roots:
+        if state[root]:
+            continue
+        state[root] = 1
+        stack = [(root, iter(out[root]))]
+        while stack:
+            node, children = stack[-1]
+            for target, i in children:
+                if state[target] == 0:
+                    state[target] = 1
+                    stack.append((target, iter(out[target])))
+                    break
+                if state[target] == 1:
+                    reversed_edges.add(i)
+            else:
+                state[node] = 2
+                stack.pop()
+    return reversed_edges
+
+
+def _assign_layers(n, dag_edges):
+    """Longest-path layering over an acyclic edge list"""
+    out = [[] for _ in range(n)]
+    indegree = [0] * n
+    for s, t in dag_edges:
+        out[s].append(t)
+        indegree[t] += 1
+    layer = [0] * n
+    ready = [v for v in range(n) if indegree[v] == 0]
+    while ready:
+        v = ready.pop()
+        for t in out[v]:
+            layer[t] = max(layer[t], layer[v] + 1)
+            indegree[t] -= 1
+            if indegree[t] == 0:
+                ready.append(t)
+    return layer
+
+
+def _count_crossings(upper, lower, down, position):
+    """Crossings between two adjacent layers (inversion count with a Fenwick tree)"""
+    pairs = sorted((i, position[w]) for i, v in enumerate(upper) for w in down[v])
+    size = len(lower)
+    tree = [0] * (size + 1)
+    crossings = 0
+    for seen, (_, p) in enumerate(pairs):
+        # Edges already seen that end to the right of p cross this one
+        i, below = p + 1, 0
+        while i > 0:
+            below += tree[i]
+            i -= i & -i
+        crossings += seen - below
+        i = p + 1
+        while i <= size:
+            tree[i] += 1
+            i += i & -i
+    return crossings
+
+
+def _total_crossings(layers, down, position):
+    return sum(_count_crossings(layers[i], layers[i + 1], down, position) for i in range(len(layers) - 1))
+
+
+def _order_layers(layers, up, down, sweeps):
+    """Barycenter ordering; returns the layer orders with the fewest crossings seen"""
+    # Index of each vertex within its layer; edges only join adjacent layers
+    position = [0] * len(up)
+    for layer in layers:
+        for p, v in enumerate(layer):
+            position[v] = p
+
+    best = [list(layer) for layer in layers]
+    best_crossings = _total_crossings(best, down, position)
+    current = [list(layer) for layer in layers]
+    for sweep in range(sweeps):
+        if best_crossings == 0:
+            break
+        downward = sweep % 2 == 0
+        neighbours = up if downward else down
+        indices = range(1, len(current)) if downward else range(len(current) - 2, -1, -1)
+        for i in indices:
+            keyed = []
+            for p, v in enumerate(current[i]):
+                linked = neighbours[v]
+                keyed.append((sum(position[w] for w in linked) / len(linked) if linked else p, p, v))
+            keyed.sort()
+            current[i] = [v for _, _, v in keyed]
+            for p, v in enumerate(current[i]):
+                position[v] = p
+        crossings = _total_crossings(current, down, position)
+        if crossings < best_crossings:
+            best, best_crossings = [list(layer) for layer in current], crossings
+    return best
+
+
+def _place(layers, up, down, breadth, n, sweeps):
+    """Centre coordinates along each layer, pulled towards neighbours without overlap"""
+    x = [0.0] * len(up)
+    # gaps[i][j]: minimum centre distance between vertices j and j + 1 of layer i
+    # (vertices from n upwards are dummies with no width)
+    gaps = []
+    for layer in layers:
+        layer_gaps = []
+        for a, b in zip(layer, layer[1:]):
+            if a >= n or b >= n:
+                layer_gaps.append((0 if a >= n else breadth / 2) + (0 if b >= n else breadth / 2) + DUMMY_SEP)
+            else:
+                layer_gaps.append(breadth + NODE_SEP)
+        gaps.append(layer_gaps)
+        cursor = 0.0
+        for j, v in enumerate(layer):
+            if j:
+                cursor += layer_gaps[j - 1]
+            x[v] = cursor
+
+    for sweep in range(sweeps * 2):
+        downward = sweep % 2 == 0
+        neighbours = up if downward else down
+        order = range(len(layers)) if downward else range(len(layers) - 1, -1, -1)
+        for i in order:
+            layer, layer_gaps = layers[i], gaps[i]
+            desired = []
+            for v in layer:
+                linked = neighbours[v]
+                desired.append(sum(x[w] for w in linked) / len(linked) if linked else x[v])
+            # Push right from the left and left from the right, then average:
+            # both satisfy the spacing constraints, so their mean does too
+            left = list(desired)
+            for j in range(1, len(layer)):
+                left[j] = max(left[j], left[j - 1] + layer_gaps[j - 1])
+            right = desired
+            for j in range(len(layer) - 2, -1, -1):
+                right[j] = min(right[j], right[j + 1] - layer_gaps[j])
+            for j, v in enumerate(layer):
+                x[v] = (left[j] + right[j]) / 2
+    return x
+
+
+def compute_layout(graph, digest=None):
+    """
+    Lay out a graph IR; returns ``{hash, direction, width, height, positions,
+    edge_points}``. ``digest`` is the graph's ``graph_hash`` if already known.
+    """
+    nodes = graph['nodes']
+    n = len(nodes)
+    direction = graph.get('direction', 'TD')
+    horizontal = direction in ('LR', 'RL')
+    breadth, depth = (NODE_HEIGHT, NODE_WIDTH) if horizontal else (NODE_WIDTH, NODE_HEIGHT)
+
+    edges = [(e['source'], e['target']) for e in graph['edges']]
+    unique = sorted({(s, t) for s, t in edges if s != t})
+    reversed_edges = _break_cycles(n, unique)
+    dag = [(t, s) if i in reversed_edges else (s, t) for i, (s, t) in enumerate(unique)]
+    layer = _assign_layers(n, dag)
+
+    # Chains of vertices per DAG edge, with dummies for every skipped layer
+    up = [[] for _ in range(n)]
+    down = [[] for _ in range(n)]
+    chains = {}
+    for i, (s, t) in enumerate(dag):
+        chain = [s]
+        for rank in range(layer[s] + 1, layer[t]):
+            dummy = len(layer)
+            layer.append(rank)
+            up.append([])
+            down.append([])
+            chain.append(dummy)
+        chain.append(t)
+        for a, b in zip(chain, chain[1:]):
+            down[a].append(b)
+            up[b].append(a)
+        chains[unique[i]] = chain if i not in reversed_edges else chain[::-1]
+
+    layers = [[] for _ in range(max(layer, default=-1) + 1)]
+    # Initial order: depth-first from the sources, which keeps subtrees together
+    seen = [False] * len(layer)
+    for root in [v for v in range(n) if not up[v]] + list(range(n)):
+        stack = [root]
+        while stack:
+            v = stack.pop()
+            if seen[v]:
+                continue
+            seen[v] = True
+            layers[layer[v]].append(v)
+            stack.extend(reversed(down[v]))
+
+    large = len(up) > LARGE_LAYOUT_VERTICES
+    layers = _order_layers(layers, up, down, 2 if large else ORDER_SWEEPS)
+    across = _place(layers, up, down, breadth, n, 1 if large else PLACEMENT_SWEEPS)
+    along = {v: layer[v] * (depth + RANK_SEP) + depth / 2 for v in range(len(layer))}
+
+    min_across = min((across[v] - (0 if v >= n else breadth / 2) for v in range(len(across))), default=0)
+    extent_across = max((across[v] - min_across + breadth / 2 for v in range(n)), default=0)
+    extent_along = len(layers) * (depth + RANK_SEP) - RANK_SEP if layers else 0
+
+    def centre(v):
+        a = across[v] - min_across
+        b = along[v]
+        if direction in ('BT', 'RL'):
+            b = extent_along - b
+        return (b, a) if horizontal else (a, b)
+
+    positions = {}
+    for v, node in enumerate(nodes):
+        cx, cy = centre(v)
+        positions[node['id']] = [round(cx - NODE_WIDTH / 2, 1), round(cy - NODE_HEIGHT / 2, 1)]
+
+    edge_points = []
+    for s, t in edges:
+        chain = chains.get((s, t))
+        edge_points.append([[round(c, 1) for c in centre(v)] for v in chain] if chain else [])
+
+    width, height = (extent_along, extent_across) if horizontal else (extent_across, extent_along)
+    digest = digest or graph_hash(graph)
+    return {
+        'hash': digest,
+        'key': digest,
+        'direction': direction,
+        'width': round(width, 1),
+        'height': round(height, 1),
+        'positions': positions,
+        'edge_points': edge_points,
+        'mode': 'full',
+    }
+
+
+def _centre(position):
+    return [round(position[0] + NODE_WIDTH / 2, 1), round(position[1] + NODE_HEIGHT / 2, 1)]
+
+
+def _extent(positions):
+    if not positions:
+        return 0, 0
+    xs = [p[0] for p in positions.values()]
+    ys = [p[1] for p in positions.values()]
+    return round(max(xs) - min(xs) + NODE_WIDTH, 1), round(max(ys) - min(ys) + NODE_HEIGHT, 1)
+
+
+class _Occupancy:
+    """Grid of placed node boxes for overlap checks"""
+    CELL = NODE_WIDTH + NODE_SEP
+
+    def __init__(self, positions):
+        self._cells = {}
+        for position in positions:
+            self.add(position)
+
+    def _key(self, x, y):
+        return int(x // self.CELL), int(y // self.CELL)
+
+    def add(self, position):
+        self._cells.setdefault(self._key(*position), []).append(position)
+
+    def collides(self, x, y):
+        cx, cy = self._key(x, y)
+        for gx in (cx - 1, cx, cx + 1):
+            for gy in (cy - 1, cy, cy + 1):
+                for ox, oy in self._cells.get((gx, gy), ()):
+                    if abs(ox - x) < NODE_WIDTH + DUMMY_SEP and abs(oy - y) < NODE_HEIGHT + DUMMY_SEP:
+                        return True
+        return False
+
+
+def layout_disruption(old_graph, new_graph):
+    """Jaccard distance between the node and edge sets of two graph versions (0 same, 1 disjoint)"""
+    old_nodes = {node['id'] for node in old_graph['nodes']}
+    new_nodes = {node['id'] for node in new_graph['nodes']}
+
+    def edge_keys(graph):
+        ids = [node['id'] for node in graph['nodes']]
+        return {(ids[e['source']], ids[e['target']]) for e in graph['edges']}
+
+    old_edges, new_edges = edge_keys(old_graph), edge_keys(new_graph)
+    changed = len(old_nodes ^ new_nodes) + len(old_edges ^ new_edges)
+    return changed / max(1, len(old_nodes | new_nodes) + len(old_edges | new_edges))
+
+
+def incremental_layout(old_graph, old_layout, new_graph, digest=None):
+    """
+    Lay out ``new_graph`` keeping every node it shares with ``old_graph`` where
+    it was. Inserted nodes go one rank past their placed predecessors (or before
+    their successors) at their neighbours' mean, then slide sideways until they
+    don't overlap anything. Edges between pinned nodes keep their old routes;
+    new or rewired edges are drawn straight. The result remembers the graph of
+    the last full layout it derives from (``base``). ``digest`` is
+    ``new_graph``'s ``graph_hash`` if already known.
+    """
+    direction = new_graph.get('direction', 'TD')
+    horizontal = direction in ('LR', 'RL')
+    sign = -1 if direction in ('BT', 'RL') else 1
+    step = sign * ((NODE_WIDTH if horizontal else NODE_HEIGHT) + RANK_SEP)
+    slide = (NODE_HEIGHT if horizontal else NODE_WIDTH) + NODE_SEP
+
+    def along(p):
+        return p[0] if horizontal else p[1]
+
+    def across(p):
+        return p[1] if horizontal else p[0]
+
+    def point(along_value, across_value):
+        return [across_value, along_value][::-1] if horizontal else [across_value, along_value]
+
+    ids = [node['id'] for node in new_graph['nodes']]
+    preds = [[] for _ in ids]
+    succs = [[] for _ in ids]
+    for edge in new_graph['edges']:
+        if edge['source'] != edge['target']:
+            succs[edge['source']].append(edge['target'])
+            preds[edge['target']].append(edge['source'])
+
+    positions = {i: list(old_layout['positions'][node_id]) for i, node_id in enumerate(ids)
+                 if node_id in old_layout['positions']}
+    pinned = len(positions)
+    occupancy = _Occupancy(positions.values())
+
+    def settle(index, along_value, across_value):
+        # Nearest free slot on either side of the desired spot
+        offset, candidate = 0, across_value
+        while occupancy.collides(*point(along_value, candidate)):
+            offset = -offset if offset > 0 else -offset + slide / 2
+            candidate = across_value + offset
+        positions[index] = [round(c, 1) for c in point(along_value, candidate)]
+        occupancy.add(positions[index])
+
+    pending = [i for i in range(len(ids)) if i not in positions]
+    while pending:
+        deferred = []
+        for i in pending:
+            placed_preds = [positions[p] for p in preds[i] if p in positions]
+            placed_succs = [positions[s] for s in succs[i] if s in positions]
+            anchors = placed_preds or placed_succs
+            if not anchors:
+                deferred.append(i)
+                continue
+            if placed_preds:
+                rank = max(along(p) * sign for p in placed_preds) * sign + step
+            else:
+                rank = min(along(p) * sign for p in placed_succs) * sign - step
+            settle(i, rank, sum(across(p) for p in anchors) / len(anchors))
+        if len(deferred) == len(pending):
+            # Nothing connects these to placed nodes: start a new row past the drawing
+            placed = list(positions.values())
+            rank = (max(along(p) * sign for p in placed) * sign + step) if placed else 0
+            settle(deferred[0], rank, min((across(p) for p in placed), default=0))
+            deferred = deferred[1:]
+        pending = deferred
+
+    old_ids = [node['id'] for node in old_graph['nodes']]
+    old_points = {}
+    for edge, points in zip(old_graph['edges'], old_layout['edge_points']):
+        old_points.setdefault((old_ids[edge['source']], old_ids[edge['target']]), points)
+    pinned_ids = set(old_layout['positions'])
+
+    edge_points = []
+    for edge in new_graph['edges']:
+        source, target = ids[edge['source']], ids[edge['target']]
+        key = (source, target)
+        if key in old_points and source in pinned_ids and target in pinned_ids:
+            edge_points.append(old_points[key])
+        elif source == target:
+            edge_points.append([])
+        else:
+            edge_points.append([_centre(positions[edge['source']]), _centre(positions[edge['target']])])
+
+    by_id = {ids[i]: position for i, position in positions.items()}
+    width, height = _extent(by_id)
+    new_hash = digest or graph_hash(new_graph)
+    return {
+        'hash': new_hash,
+        # Identifies this layout among the incremental ones of the same graph
+        'key': hashlib.sha256(f"{new_hash}:{old_layout['key']}".encode()).hexdigest()[:32],
+        'base': old_layout.get('base') or _skeleton(old_graph),
+        'direction': direction,
+        'width': width,
+        'height': height,
+        'positions': by_id,
+        'edge_points': edge_points,
+        'mode': 'incremental',
+        'pinned': pinned,
+        'placed': len(ids) - pinned,
+    }
+
+
+def _full_layout(graph, digest=None):
+    digest = digest or graph_hash(graph)
+    key = f'graph-layout:{digest}'
+    layout = cache.get(key)
+    if layout is None:
+        layout = compute_layout(graph, digest)
+        cache.set(key, layout, getattr(settings, 'LAYOUT_CACHE_SECONDS', 24 * 60 * 60))
+    return layout
+
+
+def get_layout(graph, previous=None, previous_layout=None):
+    """
+    Layout for a graph: on its own, the full layout, computed once per graph
+    structure. Given the ``previous`` version of the graph and the layout it
+    was shown with (``previous_layout``, by default its full layout), small
+    edits are laid out incrementally around that layout. Disruption is
+    measured against the graph of the last full layout the previous one
+    derives from, so a series of small edits is laid out again in full once
+    together they pass LAYOUT_DISRUPTION_THRESHOLD (as is a direction change).
+    """
+    digest = graph_hash(graph)
+    if previous is None or previous.get('direction', 'TD') != graph.get('direction', 'TD'):
+        return _full_layout(graph, digest)
+    previous_digest = graph_hash(previous)
+    if previous_layout is None or previous_layout.get('hash') != previous_digest:
+        previous_layout = _full_layout(previous, previous_digest)
+
+    threshold = getattr(settings, 'LAYOUT_DISRUPTION_THRESHOLD', 0.25)
+    if layout_disruption(previous_layout.get('base') or previous, graph) > threshold:
+        return _full_layout(graph, digest)
+    key = f"graph-layout:{digest}:{previous_layout['key']}"
+    layout = cache.get(key)
+    if layout is None:
+        layout = incremental_layout(previous, previous_layout, graph, digest)
+        cache.set(key, layout, getattr(settings, 'LAYOUT_CACHE_SECONDS', 24 * 60 * 60))
+    return layout
+
+
+def stored_layout(data, graph):
+    """Layout saved in a visualization's ``data`` if it is still the graph's, else its full layout"""
+    layout = (data or {}).get('layout')
+    digest = graph_hash(graph)
+    if layout and layout.get('hash') == digest:
+        return layout
+    return _full_layout(graph, digest)
+
+
+def to_reactflow(graph, layout):
+    """``{nodes, edges, layout}`` payload with ReactFlow node and edge objects"""
+    nodes = graph['nodes']
+    rf_nodes = [
+        {
+            'id': node['id'],
+            'type': 'default',
+            'position': {'x': layout['positions'][node['id']][0], 'y': layout['positions'][node['id']][1]},
+            'width': NODE_WIDTH,
+            'height': NODE_HEIGHT,
+            'data': {
+                'label': node['label'],
+                'text': node['text'],
+                'shape': node['shape'],
+                'act': node['act'],
+            },
+        }
+        for node in nodes
+    ]
+
+    rf_edges = []
+    used_ids = set()
+    for i, edge in enumerate(graph['edges']):
+        source, target = nodes[edge['source']]['id'], nodes[edge['target']]['id']
+        edge_id = f'e{source}-{target}'
+        if edge_id in used_ids:
+            edge_id = f'{edge_id}-{i}'
+        used_ids.add(edge_id)
+        rf_edge = {
+            'id': edge_id,
+            'source': source,
+            'target': target,
+            'type': 'smoothstep',
+            'animated': edge['style'] == 'dotted',
+            'data': {
+                'style': edge['style'],
+                'arrow': edge['arrow'],
+                'points': layout['edge_points'][i],
+            },
+        }
+        if edge['label']:
+            rf_edge['label'] = edge['label']
+        rf_edges.append(rf_edge)
+
+    return {
+        'nodes': rf_nodes,
+        'edges': rf_edges,
+        'layout': {key: layout[key] for key in ('hash', 'direction', 'width', 'height', 'mode')},
+    }
@@ -0,0 +1,53 @@
+"""
+Story flowcharts assembled from per-chapter fragments.
+
+``merge_chapters(fragments)`` takes the parsed flowchart of each chapter, in
+reading order, and joins them into one graph IR. Each chapter becomes a
+subgraph (its own subgraphs are flattened into it), node IDs are prefixed with
+the chapter number so fragments cannot collide, and every ending of a chapter
+(a node with no way out) is linked to the opening of the next one.
+"""
+from .analytics import to_csr, start_node
+from .mermaid import IR_VERSION
+
+
+def chapter_ends(graph):
+    """``(start, endings)`` node indices of a fragment; its last node stands in if nothing ends"""
+    offsets, targets = to_csr(graph)
+    n = len(graph['nodes'])
+    endings = [v for v in range(n) if offsets[v] == offsets[v + 1]]
+    return start_node(offsets, targets), endings or [n - 1]
+
+
+def merge_chapters(fragments, direction='TD'):
+    """One graph IR from ``[(chapter title, fragment graph), ...]``; empty fragments are skipped"""
+    nodes = []
+    edges = []
+    subgraphs = []
+    previous_endings = []
+    for number, (title, graph) in enumerate(fragments, 1):
+        if not graph['nodes']:
+            continue
+        sub_id = f'chapter_{number}'
+        subgraphs.append({'id': sub_id, 'label': title or f'Chapter {number}'})
+        base = len(nodes)
+        for node in graph['nodes']:
+            nodes.append({**node, 'id': f"c{number}_{node['id']}", 'subgraph': sub_id})
+        for edge in graph['edges']:
+            edges.append({**edge, 'source': base + edge['source'], 'target': base + edge['target']})
+
+        start, endings = chapter_ends(graph)
+        for ending in previous_endings:
+            edges.append({
+                'source': ending, 'target': base + start,
+                'label': None, 'style': 'solid', 'arrow': 'arrow',
+            })
+        previous_endings = [base + ending for ending in endings]
+
+    return {
+        'version': IR_VERSION,
+        'direction': direction,
+        'nodes': nodes,
+        'edges': edges,
+        'subgraphs': subgraphs,
+    }
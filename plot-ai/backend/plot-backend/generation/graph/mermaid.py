@@ -0,0 +1,380 @@
+"""
+Mermaid flowchart parser.
+
+``parse_mermaid(code)`` turns flowchart text into the graph IR stored in
+``GeneratedVisualization.data['graph']`` and returned by ``?format=graph``::
+
+    {
+        'version': 1,
+        'direction': 'TD',
+        'nodes': [{'id': 'A', 'label': 'Opening', 'text': 'Act 1: Opening',
+                   'shape': 'rect', 'act': 1, 'subgraph': None}, ...],
+        'edges': [{'source': 0, 'target': 1, 'label': 'Yes',
+                   'style': 'solid', 'arrow': 'arrow'}, ...],
+        'subgraphs': [{'id': 'S1', 'label': 'Flashback'}],
+    }
+
+Node IDs are interned in order of first appearance and edges refer to nodes by
+index. ``text`` is the label as written; ``label`` is cleaned the same way the
+frontend cleans it (act prefix and ``Start:``-style prefixes removed). Nodes
+that only appear in edges get their ID as label, as Mermaid draws them.
+Statements that cannot be parsed in full (LLM output is not always valid
+Mermaid) are skipped, adding no nodes or edges, rather than failing the whole
+diagram. ``to_mermaid(graph)`` writes an
+IR back out as flowchart text.
+"""
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+IR_VERSION = 1
+
+# (opener, closer, shape), longest openers first so '((' wins over '('
+SHAPES = (
+    ('(((', ')))', 'double_circle'),
+    ('((', '))', 'circle'),
+    ('([', '])', 'stadium'),
+    ('[[', ']]', 'subroutine'),
+    ('[(', ')]', 'cylinder'),
+    ('[/', '/]', 'parallelogram'),
+    ('[/', '\\]', 'trapezoid'),
+    ('[\\', '\\]', 'parallelogram_alt'),
+    ('[\\', '/]', 'trapezoid_alt'),
+    ('{{', '}}', 'hexagon'),
+    ('[', ']', 'rect'),
+    ('(', ')', 'round'),
+    ('{', '}', 'rhombus'),
+    ('>', ']', 'asymmetric'),
+)
+
+HEADER_RE = re.compile(r'^(?:flowchart|graph)(?:\s+(TB|TD|BT|RL|LR))?\s*;?\s*$', re.IGNORECASE)
+SUBGRAPH_RE = re.compile(r'^subgraph\s+(?:(\w+)\s*\[(.*)\]|"?(.*?)"?)\s*$')
+SKIP_RE = re.compile(r'^(?:classDef|class|style|linkStyle|click|direction|accTitle|accDescr)\b')
+ID_RE = re.compile(r'\w+')
+CLASS_SUFFIX_RE = re.compile(r':::\w+')
+
+# ``A -- text --> B``, ``A -. text .-> B``, ``A == text ==> B``
+INLINE_LINK_RE = re.compile(
+    r'(?P<head><)?(?P<open>--|==|-\.)(?![-=.>]|[ox](?:\s|$))\s*(?P<text>[^|]+?)\s*'
+    r'(?P<close>-{2,}[>ox]?|={2,}[>ox]?|\.+-[>ox]?)(?=[\s\w"]|$)'
+)
+# ``-->``, ``---``, ``-.->``, ``==>``, ``--o``, ``<-->``, ``~~~`` ...
+LINK_RE = re.compile(r'(?P<head><)?(?P<body>-{2,}|={2,}|-\.+-|~{3,})(?P<tail>[>ox])?')
+PIPE_LABEL_RE = re.compile(r'\s*\|(?P<text>[^|]*)\|')
+
+ACT_RE = re.compile(r'Act\s*(III|II|I|[123])(?:\s*:|\s|$)', re.IGNORECASE)
+ACT_PREFIX_RE = re.compile(r'^Act\s*(?:III|II|I|[123])(?:\s*:\s*|\s+)', re.IGNORECASE)
+STEP_PREFIX_RE = re.compile(r'^(?:Start:|End:|Complete:|Process:)\s*', re.IGNORECASE)
+ACT_NUMBERS = {'I': 1, '1': 1, 'II': 2, '2': 2, 'III': 3, '3': 3}
+
+ENTITY_RE = re.compile(r'#(quot|amp|lt|gt|\d+);')
+ENTITIES = {'quot': '"', 'amp': '&', 'lt': '<', 'gt': '>'}
+BREAK_RE = re.compile(r'<br\s*/?>', re.IGNORECASE)
+
+
+def _decode(text):
+    text = ENTITY_RE.sub(lambda m: ENTITIES.get(m.group(1)) or chr(int(m.group(1))), text)
+    return ' '.join(BREAK_RE.sub(' ', text).split())
+
+
+def act_number(text):
+    """Act 1-3 named in a label (``Act II: ...``), or None"""
+    match = ACT_RE.search(text)
+    return ACT_NUMBERS[match.group(1).upper()] if match else None
+
+
+def clean_label(text):
+    """Display label: act prefix, ``Start:``-style prefixes and trailing text after '...' removed"""
+    label = ACT_PREFIX_RE.sub('', text)
+    if '...' in label:
+        label = label[:label.index('...')].strip()
+        if label:
+            label += '...'
+    label = STEP_PREFIX_RE.sub('', label)
+    return label or text
+
+
+def extract_mermaid(text):
+    """First Mermaid diagram in an LLM response (fenced, HTML or bare), or None"""
+    if not text:
+        return None
+    match = re.search(r'```\s*mermaid\s*([\s\S]*?)```', text, re.IGNORECASE)
+    if match:
+        return match.group(1).strip()
+    match = re.search(r'```([\s\S]*?)```', text)
+    if match and re.search(r'flowchart|graph', match.group(1)):
+        return match.group(1).strip()
+    match = re.search(r'<code[^>]*class=[\'"]?language-mermaid[\'"]?[^>]*>([\s\S]*?)</code>', text, re.IGNORECASE)
+    if match:
+        return match.group(1).strip()
+    if re.search(r'flowchart|graph', text):
+        return text.strip()
+    return None
+
+
+class _Builder:
+    def __init__(self):
+        self.direction = 'TD'
+        self.nodes = []
+        self.index = {}
+        self.edges = []
+        self.subgraphs = []
+        self.subgraph_stack = []
+
+    def node(self, node_id, text=None, shape=None):
+        idx = self.index.get(node_id)
+        if idx is None:
+            idx = self.index[node_id] = len(self.nodes)
+            self.nodes.append({
+                'id': node_id,
+                'label': node_id,
+                'text': node_id,
+                'shape': 'rect',
+                'act': None,
+                'subgraph': self.subgraph_stack[-1] if self.subgraph_stack else None,
+            })
+        if text is not None:
+            node = self.nodes[idx]
+            text = _decode(text)
+            node['text'] = text
+            node['label'] = clean_label(text)
+            node['shape'] = shape
+            node['act'] = act_number(text)
+        return idx
+
+    def to_ir(self):
+        return {
+            'version': IR_VERSION,
+            'direction': self.direction,
+            'nodes': self.nodes,
+            'edges': self.edges,
+            'subgraphs': self.subgraphs,
+        }
+
+
+def _skip_space(stmt, pos):
+    while pos < len(stmt) and stmt[pos].isspace():
+        pos += 1
+    return pos
+
+
+def _parse_node(stmt, pos):
+    """Parse ``id[shape label]:::class`` at ``pos``; returns ((id, text, shape), new pos) or (None, pos)"""
+    match = ID_RE.match(stmt, pos)
+    if not match:
+        return None, pos
+    node_id = match.group()
+    pos = match.end()
+
+    for opener, closer, shape in SHAPES:
+        if not stmt.startswith(opener, pos):
+            continue
+        start = pos + len(opener)
+        if stmt.startswith('"', start):
+            quote_end = stmt.find('"', start + 1)
+            if quote_end == -1 or not stmt.startswith(closer, quote_end + 1):
+                continue
+            text, end = stmt[start + 1:quote_end], quote_end + 1 + len(closer)
+        else:
+            close = stmt.find(closer, start)
+            if close == -1:
+                continue
+            text, end = stmt[start:close], close + len(closer)
+        node = (node_id, text, shape)
+        pos = end
+        break
+    else:
+        node = (node_id, None, None)
+
+    suffix = CLASS_SUFFIX_RE.match(stmt, pos)
+    if suffix:
+        pos = suffix.end()
+    return node, pos
+
+
+def _parse_group(stmt, pos):
+    """Parse ``A & B & C``; returns (nodes, new pos)"""
+    nodes = []
+    while True:
+        pos = _skip_space(stmt, pos)
+        node, pos = _parse_node(stmt, pos)
+        if node is None:
+            return nodes, pos
+        nodes.append(node)
+        after = _skip_space(stmt, pos)
+        if not stmt.startswith('&', after):
+            return nodes, pos
+        pos = after + 1
+
+
+def _link_kind(head, body, tail):
+    style = {'-': 'solid', '=': 'thick', '~': 'invisible'}[body[0]]
+    if '.' in body:
+        style = 'dotted'
+    arrow = {'>': 'arrow', 'o': 'circle', 'x': 'cross'}.get(tail, 'none')
+    if head and arrow == 'arrow':
+        arrow = 'both'
+    return style, arrow
+
+
+def _parse_link(stmt, pos):
+    """Parse an edge operator with optional label; returns (edge fields, new pos) or (None, pos)"""
+    pos = _skip_space(stmt, pos)
+    match = INLINE_LINK_RE.match(stmt, pos)
+    if match:
+        close = match.group('close')
+        body, tail = (close[:-1], close[-1]) if close[-1] in '>ox' else (close, None)
+        style, arrow = _link_kind(match.group('head'), match.group('open') + body, tail)
+        label = match.group('text')
+    else:
+        match = LINK_RE.match(stmt, pos)
+        if not match:
+            return None, pos
+        style, arrow = _link_kind(match.group('head'), match.group('body'), match.group('tail'))
+        label = None
+    pos = match.end()
+
+    pipe = PIPE_LABEL_RE.match(stmt, pos)
+    if pipe:
+        label = pipe.group('text')
+        pos = pipe.end()
+    label = _decode(label.strip('"')) if label else None
+    return {'label': label or None, 'style': style, 'arrow': arrow}, pos
+
+
+def _parse_statement(stmt, builder):
+    """Add a statement's nodes and edges; nothing is added unless all of it parses"""
+    group, pos = _parse_group(stmt, 0)
+    if not group:
+        return False
+    groups, links = [group], []
+    while True:
+        link, link_end = _parse_link(stmt, pos)
+        if link is None:
+            break
+        group, pos = _parse_group(stmt, link_end)
+        if not group:
+            return False
+        groups.append(group)
+        links.append(link)
+    if _skip_space(stmt, pos) != len(stmt):
+        return False
+
+    indices = [[builder.node(*node) for node in group] for group in groups]
+    for link, sources, targets in zip(links, indices, indices[1:]):
+        for source in sources:
+            for target in targets:
+                builder.edges.append({'source': source, 'target': target, **link})
+    return True
+
+
+def _statements(code):
+    """Split on newlines and on semicolons outside quotes and brackets"""
+    for line in code.splitlines():
+        line = line.strip()
+        if not line or line.startswith('%%'):
+            continue
+        depth, quoted, start = 0, False, 0
+        for i, char in enumerate(line):
+            if char == '"':
+                quoted = not quoted
+            elif quoted:
+                continue
+            elif char in '[({':
+                depth += 1
+            elif char in '])}':
+                depth = max(0, depth - 1)
+            elif char == ';' and depth == 0:
+                if line[start:i].strip():
+                    yield line[start:i].strip()
+                start = i + 1
+        if line[start:].strip():
+            yield line[start:].strip()
+
+
+def parse_mermaid(code):
+    """Parse Mermaid flowchart text (fenced or bare) into the graph IR"""
+    builder = _Builder()
+    code = extract_mermaid(code) or ''
+    for stmt in _statements(code):
+        header = HEADER_RE.match(stmt)
+        if header:
+            builder.direction = (header.group(1) or 'TD').upper()
+            continue
+        subgraph = SUBGRAPH_RE.match(stmt)
+        if subgraph:
+            sub_id = subgraph.group(1) or subgraph.group(3) or f'subgraph_{len(builder.subgraphs) + 1}'
+            builder.subgraphs.append({'id': sub_id, 'label': _decode(subgraph.group(2) or sub_id)})
+            builder.subgraph_stack.append(sub_id)
+            continue
+        if stmt == 'end':
+            if builder.subgraph_stack:
+                builder.subgraph_stack.pop()
+            continue
+        if SKIP_RE.match(stmt):
+            continue
+        if not _parse_statement(stmt, builder):
+            logger.debug(f"Skipping unparseable Mermaid statement: {stmt!r}")
+    return builder.to_ir()
+
+
+def graph_for(data):
+    """The stored graph IR of a visualization payload, parsing its Mermaid code if missing or outdated"""
+    graph = data.get('graph') if isinstance(data, dict) else None
+    if graph and graph.get('version') == IR_VERSION:
+        return graph
+    code = data.get('mermaid_code') if isinstance(data, dict) else None
+    return parse_mermaid(code) if code else None
+
+
+# Inverse of _link_kind: operator by (style, arrow); 'both' adds a leading '<'
+LINK_OPERATORS = {
+    ('solid', 'arrow'): '-->', ('solid', 'none'): '---', ('solid', 'circle'): '--o', ('solid', 'cross'): '--x',
+    ('dotted', 'arrow'): '-.->', ('dotted', 'none'): '-.-', ('dotted', 'circle'): '-.-o', ('dotted', 'cross'): '-.-x',
+    ('thick', 'arrow'): '==>', ('thick', 'none'): '===', ('thick', 'circle'): '==o', ('thick', 'cross'): '==x',
+}
+
+
+def _quote(text):
+    return '"' + text.replace('&', '#amp;').replace('"', '#quot;') + '"'
+
+
+def _link_operator(style, arrow):
+    if style == 'invisible':
+        return '~~~'
+    if arrow == 'both':
+        return '<' + LINK_OPERATORS.get((style, 'arrow'), '-->')
+    return LINK_OPERATORS.get((style, arrow), '-->')
+
+
+def to_mermaid(graph):
+    """
+    Mermaid flowchart text for a graph IR. ``parse_mermaid`` reads back the
+    same nodes and edges, with subgraph members moved after the other nodes.
+    """
+    lines = [f"flowchart {graph.get('direction', 'TD')}"]
+    by_subgraph = {}
+    for node in graph['nodes']:
+        by_subgraph.setdefault(node.get('subgraph'), []).append(node)
+
+    def node_line(node):
+        opener, closer = next(
+            ((o, c) for o, c, shape in SHAPES if shape == node['shape']), ('[', ']')
+        )
+        return f"    {node['id']}{opener}{_quote(node['text'])}{closer}"
+
+    lines.extend(node_line(node) for node in by_subgraph.pop(None, []))
+    labels = {subgraph['id']: subgraph['label'] for subgraph in graph.get('subgraphs', [])}
+    for sub_id, nodes in by_subgraph.items():
+        label = labels.get(sub_id, sub_id)
+        lines.append(f"    subgraph {sub_id} [{label}]" if label != sub_id else f"    subgraph {sub_id}")
+        lines.extend('    ' + node_line(node) for node in nodes)
+        lines.append('    end')
+
+    ids = [node['id'] for node in graph['nodes']]
+    for edge in graph['edges']:
+        operator = _link_operator(edge['style'], edge['arrow'])
+        label = f"|{_quote(edge['label'])}|" if edge.get('label') else ''
+        lines.append(f"    {ids[edge['source']]} {operator}{label} {ids[edge['target']]}")
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,118 @@
+"""
+Character-journey flowcharts projected from the ensemble flowchart.
+
+``project_character(graph, name, cast)`` keeps the story's opening, every node
+that mentions the character, every node on a path between two such nodes
+(reachable from a mention and leading to one, decisions included) and the
+endings their journey leads to. Everything else is elided. Elided nodes never
+break reachability: when a kept node reached another kept node only through
+elided ones, the two are joined by a dotted edge carrying the label of the
+first step.
+"""
+import re
+
+from .analytics import to_csr, start_node
+
+# Name parts too generic to identify a character on their own
+GENERIC_NAME_PARTS = {'the', 'character', 'protagonist', 'antagonist', 'supporting', 'mr', 'mrs', 'ms', 'dr'}
+
+
+def name_pattern(name, cast=()):
+    """
+    Regex matching a character in node text: the full name, or any part of it
+    that no other cast member's name shares. Single-letter parts (``Character
+    A``) only match as a capitalised possessive (``A's``).
+    """
+    others = {part.lower() for other in cast if other != name for part in other.split()}
+    alternatives = [re.escape(name)]
+    for part in name.split():
+        if part.lower() in others or part.lower() in GENERIC_NAME_PARTS:
+            continue
+        if len(part) > 1:
+            alternatives.append(re.escape(part))
+        elif part.isupper():
+            alternatives.append(f"(?-i:{re.escape(part)}'s)")
+    return re.compile(r'\b(?:' + '|'.join(alternatives) + r')\b', re.IGNORECASE)
+
+
+def _reachable(sources, neighbours):
+    """Nodes reachable from any of ``sources`` (a flag per node), themselves included"""
+    reached = sources[:]
+    stack = [v for v, flag in enumerate(sources) if flag]
+    while stack:
+        v = stack.pop()
+        for w in neighbours(v):
+            if not reached[w]:
+                reached[w] = True
+                stack.append(w)
+    return reached
+
+
+def project_character(graph, name, cast=()):
+    """Journey of ``name`` as a graph IR, or None if no node mentions them"""
+    nodes = graph['nodes']
+    n = len(nodes)
+    pattern = name_pattern(name, cast)
+    mentioned = [bool(pattern.search(node['text'])) for node in nodes]
+    if not any(mentioned):
+        return None
+    offsets, targets = to_csr(graph)
+    predecessors = [[] for _ in range(n)]
+    for v in range(n):
+        for w in targets[offsets[v]:offsets[v + 1]]:
+            predecessors[w].append(v)
+
+    downstream = _reachable(mentioned, lambda v: targets[offsets[v]:offsets[v + 1]])
+    upstream = _reachable(mentioned, lambda v: predecessors[v])
+
+    # Between two mentions, or an ending after one
+    keep = [
+        mentioned[v] or (downstream[v] and (upstream[v] or offsets[v] == offsets[v + 1]))
+        for v in range(n)
+    ]
+    keep[start_node(offsets, targets)] = True
+
+    # First edge of each (source, target) pair, for labels and styles of direct links
+    first_edge = {}
+    for edge in graph['edges']:
+        first_edge.setdefault((edge['source'], edge['target']), edge)
+
+    kept = [v for v in range(n) if keep[v]]
+    position = {v: i for i, v in enumerate(kept)}
+    edges = []
+    for v in kept:
+        successors = targets[offsets[v]:offsets[v + 1]]
+        linked = set()
+        for w in successors:
+            if keep[w]:
+                linked.add(w)
+                edges.append({**first_edge[(v, w)], 'source': position[v], 'target': position[w]})
+        # Walk through elided successors to the kept nodes they lead to
+        for w in successors:
+            if keep[w]:
+                continue
+            label = first_edge[(v, w)]['label']
+            seen = {w}
+            frontier = [w]
+            while frontier:
+                u = frontier.pop()
+                for x in targets[offsets[u]:offsets[u + 1]]:
+                    if x in seen:
+                        continue
+                    seen.add(x)
+                    if not keep[x]:
+                        frontier.append(x)
+                    elif x not in linked:
+                        linked.add(x)
+                        edges.append({
+                            'source': position[v], 'target': position[x],
+                            'label': label, 'style': 'dotted', 'arrow': 'arrow',
+                        })
+
+    subgraphs = {nodes[v]['subgraph'] for v in kept}
+    return {
+        **graph,
+        'nodes': [dict(nodes[v]) for v in kept],
+        'edges': edges,
+        'subgraphs': [subgraph for subgraph in graph.get('subgraphs', []) if subgraph['id'] in subgraphs],
+    }
@@ -0,0 +1,129 @@
+import json
+import os
+import platform
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from generation.benchmarks import STAGES, SkipStage, run_stage, git_revision, compare_results, BenchmarkContext
+from generation.fake_gemini import FakeGeminiConfig, start_fake_gemini
+
+
+class Command(BaseCommand):
+    help = ('Benchmark story->Mermaid, Mermaid->SVG, visualization creation and the voice '
+            'pipeline against a local fake Gemini, writing results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stages', default=','.join(STAGES),
+                            help=f'Comma-separated subset of: {", ".join(STAGES)}')
+        parser.add_argument('--concurrency', default='1,4,16',
+                            help='Comma-separated concurrency levels')
+        parser.add_argument('--requests', type=int, default=40,
+                            help='Requests per stage and concurrency level')
+        parser.add_argument('--latency-ms', type=float, default=50.0,
+                            help='Median latency of the fake Gemini')
+        parser.add_argument('--tts-latency-ms', type=float, default=100.0)
+        parser.add_argument('--error-rate', type=float, default=0.0)
+        parser.add_argument('--seed', type=int, default=1234)
+        parser.add_argument('--output', default=None,
+                            help='Result file (default: benchmarks/<git revision>.json)')
+        parser.add_argument('--compare', default=None,
+                            help='Earlier result file to diff this run against')
+
+    def handle(self, *args, **options):
+        stages = [s for s in options['stages'].split(',') if s]
+        unknown = set(stages) - set(STAGES)
+        if unknown:
+            raise CommandError(f'Unknown stages: {", ".join(sorted(unknown))}')
+        try:
+            levels = [int(c) for c in options['concurrency'].split(',') if c]
+        except ValueError:
+            raise CommandError('--concurrency must be comma-separated integers')
+
+        fake_config = FakeGeminiConfig(
+            latency_ms=options['latency_ms'],
+            tts_latency_ms=options['tts_latency_ms'],
+            error_rate=options['error_rate'],
+            seed=options['seed'],
+        )
+        server = start_fake_gemini(fake_config)
+        self._configure(server.base_url, max(levels))
+
+        if connection.vendor == 'sqlite':
+            # A file database lets worker threads wait on locks instead of failing
+            # like they do on the shared-cache in-memory test database
+            connection.settings_dict['TEST']['NAME'] = str(
+                Path(settings.BASE_DIR) / 'benchmarks' / 'bench.sqlite3'
+            )
+            (Path(settings.BASE_DIR) / 'benchmarks').mkdir(exist_ok=True)
+        old_db_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        context = BenchmarkContext()
+        try:
+            results = {
+                'revision': git_revision(),
+                'created_at': datetime.now(timezone.utc).isoformat(),
+                'python': platform.python_version(),
+                'requests_per_level': options['requests'],
+                'fake_gemini': {
+                    'latency_ms': fake_config.latency_ms,
+                    'latency_jitter_ms': fake_config.latency_jitter_ms,
+                    'tts_latency_ms': fake_config.tts_latency_ms,
+                    'error_rate': fake_config.error_rate,
+                    'seed': options['seed'],
+                },
+                'stages': {},
+            }
+            for stage in stages:
+                results['stages'][stage] = self._run_stage(stage, context, levels, options['requests'])
+        finally:
+            context.cleanup()
+            connection.creation.destroy_test_db(old_db_name, verbosity=0)
+            server.shutdown()
+            server.server_close()
+
+        output = Path(options['output'] or Path(settings.BASE_DIR) / 'benchmarks' / f"{results['revision']}.json")
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2) + '\n')
+        self.stdout.write(self.style.SUCCESS(f'Results written to {output}'))
+
+        if options['compare']:
+            self._print_comparison(json.loads(Path(options['compare']).read_text()), results)
+
+    def _configure(self, base_url, max_concurrency):
+        # Must run before the Gemini guard, scheduler and executor are first built
+        os.environ['GEMINI_API_KEY'] = 'benchmark'
+        settings.GEMINI_API_BASE = base_url
+        settings.GEMINI_MAX_CONCURRENCY = max_concurrency
+        settings.GEMINI_REQUESTS_PER_MINUTE = 10 ** 6
+        settings.GEMINI_BURST = 10 ** 6
+        settings.GENERATION_WORKERS = max_concurrency
+        if 'testserver' not in settings.ALLOWED_HOSTS:
+            settings.ALLOWED_HOSTS = list(settings.ALLOWED_HOSTS) + ['testserver']
+
+    def _run_stage(self, stage, context, levels, requests):
+        try:
+            operation = STAGES[stage](context)
+            # Warm caches (model list, Whisper weights) outside the measurement
+            operation(-1)
+        except SkipStage as e:
+            self.stdout.write(self.style.WARNING(f'{stage}: skipped ({e})'))
+            return {'skipped': str(e)}
+
+        stage_results = {}
+        for concurrency in levels:
+            result = run_stage(operation, concurrency, requests)
+            stage_results[str(concurrency)] = result
+            self.stdout.write(
+                f"{stage:<22} c={concurrency:<4} {result['throughput_rps'] or 0:>9.2f} req/s  "
+                f"p50={result['p50_ms']}ms p95={result['p95_ms']}ms p99={result['p99_ms']}ms "
+                f"errors={result['errors']}"
+            )
+        return stage_results
+
+    def _print_comparison(self, base, current):
+        self.stdout.write(f"\nChange vs {base.get('revision', 'baseline')}:")
+        for stage, concurrency, metric, old, new, change in compare_results(base, current):
+            self.stdout.write(f'{stage:<22} c={concurrency:<4} {metric:<15} {old:>10} -> {new:<10} ({change:+}%)')
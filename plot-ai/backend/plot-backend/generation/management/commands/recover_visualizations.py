@@ -0,0 +1,22 @@
+from concurrent.futures import wait
+
+from django.core.management.base import BaseCommand
+
+from generation.tasks import recover_visualizations
+
+
+class Command(BaseCommand):
+    help = ('Generate visualization requests left pending by a restart and fail the ones '
+            'whose processing was interrupted')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=None,
+                            help='Seconds without an update after which a processing request '
+                                 'counts as interrupted (default: GENERATION_STALE_SECONDS)')
+
+    def handle(self, *args, **options):
+        futures, failed = recover_visualizations(options['stale_after'])
+        wait(futures)
+        self.stdout.write(self.style.SUCCESS(
+            f'Resubmitted {len(futures)} pending requests, failed {failed} interrupted ones'
+        ))
@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+
+from generation.fake_gemini import FakeGeminiConfig, FakeGeminiServer
+
+
+class Command(BaseCommand):
+    help = 'Run a local fake Gemini API for offline development and load testing'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=150.0,
+                            help='Median latency of text generation calls')
+        parser.add_argument('--latency-jitter-ms', type=float, default=50.0,
+                            help='Scale of the log-normal latency tail')
+        parser.add_argument('--tts-latency-ms', type=float, default=400.0,
+                            help='Median latency of TTS calls')
+        parser.add_argument('--error-rate', type=float, default=0.0,
+                            help='Fraction of calls answered with 503')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0,
+                            help='Fraction of calls answered with 429 and Retry-After')
+        parser.add_argument('--retry-after', type=int, default=1,
+                            help='Retry-After seconds sent with 429 responses')
+        parser.add_argument('--mermaid-nodes', type=int, default=0,
+                            help='Synthesize flowcharts with this many nodes instead of canned ones')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--verbose', action='store_true', help='Log every request')
+
+    def handle(self, *args, **options):
+        config = FakeGeminiConfig(
+            latency_ms=options['latency_ms'],
+            latency_jitter_ms=options['latency_jitter_ms'],
+            tts_latency_ms=options['tts_latency_ms'],
+            error_rate=options['error_rate'],
+            rate_limit_rate=options['rate_limit_rate'],
+            retry_after=options['retry_after'],
+            mermaid_nodes=options['mermaid_nodes'],
+            seed=options['seed'],
+        )
+        server = FakeGeminiServer((options['host'], options['port']), config, verbose=options['verbose'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Fake Gemini listening on {server.base_url} '
+            f'(set GEMINI_API_BASE={server.base_url})'
+        ))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('generation', '0002_alter_visualizationrequest_visualization_type'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='generatedvisualization',
+            index=models.Index(fields=['-created_at', '-id'], name='viz_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='processingjob',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='job_user_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='visualizationrequest',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='vizreq_user_created_idx'),
+        ),
+    ]
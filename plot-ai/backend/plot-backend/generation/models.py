@@ -32,6 +32,8 @@ class VisualizationRequest(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        # Keyset pagination of a user's rows (see plot/pagination.py)
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='vizreq_user_created_idx')]
 
     def __str__(self):
         return f"{self.visualization_type} for {self.story.title}"
@@ -45,6 +47,9 @@ class GeneratedVisualization(models.Model):
     image_url = models.URLField(blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['-created_at', '-id'], name='viz_created_idx')]
+
     def __str__(self):
         return f"Visualization: {self.title}"
 
@@ -78,6 +83,7 @@ class ProcessingJob(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='job_user_created_idx')]
 
     def __str__(self):
         return f"{self.job_type} - {self.status}"
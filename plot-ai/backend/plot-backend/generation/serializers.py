@@ -1,5 +1,11 @@
 from rest_framework import serializers
 from .models import VisualizationRequest, GeneratedVisualization, ProcessingJob
+from .graph import graph_for
+
+
+def wants_graph(request):
+    """``?format=graph`` asks for the parsed node/edge graph instead of raw Mermaid"""
+    return request is not None and request.query_params.get('format') == 'graph'
 
 class VisualizationRequestSerializer(serializers.ModelSerializer):
     class Meta:
@@ -33,6 +39,16 @@ class GeneratedVisualizationSerializer(serializers.ModelSerializer):
             'story_title': obj.request.story.title
         }
 
+    def to_representation(self, instance):
+        ret = super().to_representation(instance)
+        if wants_graph(self.context.get('request')):
+            # Only flowcharts have a graph; other visualizations keep their data
+            graph = graph_for(ret['data'])
+            if graph is not None:
+                ret.pop('data')
+                ret['graph'] = graph
+        return ret
+
 class ProcessingJobSerializer(serializers.ModelSerializer):
     story_title = serializers.CharField(source='story.title', read_only=True)
 
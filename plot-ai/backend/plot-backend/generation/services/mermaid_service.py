@@ -4,11 +4,24 @@ import urllib3
 
 # Disable SSL warnings for development
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+import contextvars
+import hashlib
 import json
 import subprocess
 import tempfile
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from django.conf import settings
+from django.core.cache import cache
+from plot.metrics import timed
+from ..graph import parse_mermaid, to_mermaid, project_character, merge_chapters
+from .prompting import compact
+from .resilience import get_gemini_guard
+from .scheduler import ON_DEMAND
+
+# Bump when the chapter fragment prompt changes, so cached fragments are regenerated
+CHAPTER_PROMPT_VERSION = 1
 
 # Try to load environment variables from .env file
 try:
@@ -25,22 +38,47 @@ except ImportError:
                     os.environ[key] = value
 
 class MermaidService:
-    def __init__(self):
+    # (fetched_at, model names) shared by all instances
+    _models_cache = None
+
+    def __init__(self, user_key=None, priority=ON_DEMAND):
         self.api_key = os.getenv("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("GEMINI_API_KEY environment variable is required")
+        # GEMINI_API_BASE can point at a local fake server for offline runs
+        self.api_base = getattr(settings, 'GEMINI_API_BASE', 'https://generativelanguage.googleapis.com').rstrip('/')
+        # Who the work is for and how urgent it is, for the Gemini scheduler
+        self.user_key = user_key
+        self.priority = priority
+
+    def _request(self, method, url, **kwargs):
+        """Send a Gemini HTTP request through the shared scheduler, rate limiter and retries"""
+        def send():
+            response = requests.request(method, url, verify=False, **kwargs)
+            response.raise_for_status()
+            return response
+        return get_gemini_guard().call(send, self.priority, self.user_key)
 
     def get_available_models(self):
         """Get available Gemini models"""
-        url = f"https://generativelanguage.googleapis.com/v1beta/models?key={self.api_key}"
+        # The model list rarely changes; don't spend quota on it for every generation
+        cache_seconds = getattr(settings, 'GEMINI_MODELS_CACHE_SECONDS', 300)
+        cached = MermaidService._models_cache
+        if cached and time.monotonic() - cached[0] < cache_seconds:
+            return cached[1]
+
+        url = f"{self.api_base}/v1beta/models?key={self.api_key}"
         try:
-            response = requests.get(url, verify=False)
-            response.raise_for_status()
+            response = self._request('GET', url)
             data = response.json()
-            return [m['name'] for m in data.get('models', [])]
+            models = [m['name'] for m in data.get('models', [])]
         except requests.exceptions.RequestException as e:
             raise Exception(f"Failed to fetch models: {e}")
 
+        if models:
+            MermaidService._models_cache = (time.monotonic(), models)
+        return models
+
     def pick_text_model(self, models):
         """Select the best text generation model"""
         # Filter out embedding models and other non-text-generation models
@@ -69,6 +107,8 @@ class MermaidService:
 
     def generate_mermaid_from_story(self, story_content, story_title="Story"):
         """Generate Mermaid flowchart from story content"""
+        # Long stories are compacted to the prompt token budget
+        story_content = compact(story_content)
         prompt = f"""
 Generate a Mermaid.js flowchart diagram that represents the plot structure of this story:
 
@@ -99,8 +139,81 @@ flowchart TD
 """
         return self.generate_mermaid(prompt)
 
+    def generate_chapter_fragment(self, chapter_content, chapter_title, story_title="Story"):
+        """
+        Flowchart of one chapter, cached by a hash of the chapter's title and
+        text (so renaming the story reuses every chapter's fragment)
+        """
+        digest = hashlib.sha256(f'{chapter_title}\0{chapter_content}'.encode('utf-8')).hexdigest()[:32]
+        key = f'chapter-flowchart:{CHAPTER_PROMPT_VERSION}:{digest}'
+        code = cache.get(key)
+        if code is not None:
+            return code, True
+
+        chapter_content = compact(chapter_content)
+        prompt = f"""
+Generate a Mermaid.js flowchart of the events in one chapter of the story "{story_title}":
+
+Chapter: {chapter_title}
+Content: {chapter_content}
+
+Create a flowchart that shows:
+1. The event the chapter opens with
+2. Key decision points or conflicts within the chapter
+3. The event(s) the chapter closes on
+
+The chapter will be joined to the ones before and after it, so do not add
+generic Start or End nodes. Use proper Mermaid.js flowchart syntax starting with
+'flowchart TD' and use [Text] for events and {{Text}} for decision points.
+
+Return ONLY the Mermaid code without any explanation.
+"""
+        code = self.generate_mermaid(prompt)
+        cache.set(key, code, getattr(settings, 'CHAPTER_FLOWCHART_CACHE_SECONDS', 7 * 24 * 60 * 60))
+        return code, False
+
+    def generate_mermaid_from_chapters(self, chapters, story_title="Story"):
+        """
+        Story flowchart generated a chapter at a time: one fragment per chapter,
+        requested in parallel and cached by chapter text, merged in reading
+        order with each chapter's endings leading into the next chapter.
+        Returns the Mermaid code and, per chapter, whether its fragment was cached.
+        """
+        def fragment(chapter, context):
+            return context.run(self.generate_chapter_fragment, chapter.content, chapter.title, story_title)
+
+        workers = min(len(chapters), getattr(settings, 'CHAPTER_FLOWCHART_WORKERS', 4)) or 1
+        # A copy of the caller's context per chapter keeps each worker's Gemini
+        # spans in the request's trace
+        contexts = [contextvars.copy_context() for _ in chapters]
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='chapter-flowchart') as pool:
+            results = list(pool.map(fragment, chapters, contexts))
+
+        graph = merge_chapters(
+            [(chapter.title, parse_mermaid(code)) for chapter, (code, _) in zip(chapters, results)]
+        )
+        report = [
+            {'id': str(chapter.id), 'title': chapter.title, 'cached': cached}
+            for chapter, (_, cached) in zip(chapters, results)
+        ]
+        return to_mermaid(graph), report
+
+    def generate_story_mermaid(self, story, mode=None):
+        """
+        Mermaid code for a story and how it was made. In ``mode='chapters'``
+        (default from STORY_FLOWCHART_MODE) stories with chapters are generated
+        chapter by chapter; otherwise, or without chapters, from the whole text.
+        """
+        mode = mode or getattr(settings, 'STORY_FLOWCHART_MODE', 'chapters')
+        chapters = list(story.chapters.all()) if mode == 'chapters' else []
+        if chapters:
+            mermaid_code, report = self.generate_mermaid_from_chapters(chapters, story.title)
+            return mermaid_code, {'mode': 'chapters', 'chapters': report}
+        return self.generate_mermaid_from_story(story.content, story.title), {'mode': 'story'}
+
     def generate_mermaid_from_description(self, description, flowchart_type="main_story"):
         """Generate a specific story variation flowchart based on type: main_story, alternative_1, alternative_2, or alternative_3"""
+        description = compact(description)
 
         if flowchart_type == "main_story":
             prompt = f"""
@@ -217,6 +330,7 @@ flowchart TD
 
         return self.generate_mermaid(prompt)
 
+    @timed('mermaid_generate')
     def generate_mermaid(self, prompt_text):
         """Generate Mermaid code using Gemini API"""
         # Get available models
@@ -234,7 +348,7 @@ flowchart TD
 
         # Use the newer generateContent endpoint for Gemini models
         if "gemini" in model.lower():
-            api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateContent?key={self.api_key}"
+            api_url = f"{self.api_base}/v1beta/models/{model_name}:generateContent?key={self.api_key}"
             payload = {
                 "contents": [{
                     "parts": [{"text": prompt_text}]
@@ -246,7 +360,7 @@ flowchart TD
             }
         else:
             # Fallback to older generateText endpoint
-            api_url = f"https://generativelanguage.googleapis.com/v1beta/models/{model_name}:generateText?key={self.api_key}"
+            api_url = f"{self.api_base}/v1beta/models/{model_name}:generateText?key={self.api_key}"
             payload = {
                 "prompt": {"text": prompt_text},
                 "temperature": 0.2,
@@ -254,8 +368,7 @@ flowchart TD
             }
 
         try:
-            response = requests.post(api_url, json=payload, verify=False)
-            response.raise_for_status()
+            response = self._request('POST', api_url, json=payload)
         except requests.exceptions.RequestException as e:
             raise Exception(f"HTTP Error: {e}")
 
@@ -276,6 +389,7 @@ flowchart TD
         except (KeyError, IndexError):
             raise Exception("Unexpected response format from Gemini API")
 
+    @timed('mermaid_render_svg')
     def render_svg_from_mermaid(self, mermaid_code):
         """Render Mermaid code to SVG and return the file path"""
         # Create temporary files
@@ -301,8 +415,18 @@ flowchart TD
             if os.path.exists(mmd_file):
                 os.remove(mmd_file)
 
-    def generate_multiple_flowcharts(self, description, character_names=None):
-        """Generate multiple flowcharts: one ensemble + individual character flowcharts"""
+    def generate_multiple_flowcharts(self, description, character_names=None, on_flowchart=None, mode=None):
+        """Generate multiple flowcharts: one ensemble + individual character flowcharts
+
+        ``on_flowchart(key, flowchart)`` is called as each flowchart finishes so
+        callers can stream partial results. In ``mode='local'`` (default from
+        CHARACTER_FLOWCHART_MODE) character journeys are projected from the
+        ensemble flowchart instead of generated, falling back to Gemini for
+        characters the ensemble never mentions.
+        """
+        mode = mode or getattr(settings, 'CHARACTER_FLOWCHART_MODE', 'llm')
+        # The response echoes the description as given; prompts get it compacted
+        context = compact(description)
         try:
             if not character_names:
                 # Extract character names from description or use defaults
@@ -314,7 +438,7 @@ flowchart TD
             ensemble_prompt = f"""
 Generate a Mermaid.js flowchart that shows the main story flow and ensemble interactions:
 
-{description}
+{context}
 
 Create a comprehensive flowchart that shows:
 1. The overall plot progression
@@ -344,13 +468,22 @@ flowchart TD
                 'description': 'Overall story structure and character interactions',
                 'type': 'ensemble'
             }
+            if on_flowchart:
+                on_flowchart('ensemble', flowcharts['ensemble'])
 
-            # 2. Generate individual character flowcharts
+            # 2. Generate individual character flowcharts, or project them from the ensemble
+            ensemble_graph = parse_mermaid(ensemble_code) if mode == 'local' else None
             for i, character_name in enumerate(character_names):
-                character_prompt = f"""
+                character_code = None
+                if mode == 'local':
+                    projected = project_character(ensemble_graph, character_name, character_names)
+                    character_code = to_mermaid(projected) if projected else None
+                generated_by = 'local' if character_code else 'llm'
+                if character_code is None:
+                    character_prompt = f"""
 Generate a Mermaid.js flowchart focused specifically on {character_name}'s journey in this story:
 
-Story Context: {description}
+Story Context: {context}
 
 Create a flowchart that shows:
 1. {character_name}'s introduction and initial state
@@ -375,14 +508,17 @@ flowchart TD
     G --> H[Final State]
 """
 
-                character_code = self.generate_mermaid(character_prompt)
+                    character_code = self.generate_mermaid(character_prompt)
                 flowcharts[f'character_{i+1}'] = {
                     'title': f'{character_name} - Character Journey',
                     'mermaid_code': character_code,
                     'description': f'Individual character arc and development for {character_name}',
                     'type': 'character',
-                    'character_name': character_name
+                    'character_name': character_name,
+                    'generated_by': generated_by
                 }
+                if on_flowchart:
+                    on_flowchart(f'character_{i+1}', flowcharts[f'character_{i+1}'])
 
             return {
                 'success': True,
@@ -393,6 +529,7 @@ flowchart TD
                 'generation_method': 'Gemini AI Multi-Flowchart',
                 'metadata': {
                     'generated_by': 'Gemini AI',
+                    'character_mode': mode,
                     'flowchart_types': ['ensemble'] + [f'character_{i+1}' for i in range(len(character_names))]
                 }
             }
@@ -403,11 +540,8 @@ flowchart TD
     def generate_story_flowchart_data(self, story):
         """Generate complete flowchart data structure for a story"""
         try:
-            # Generate Mermaid code from story content
-            mermaid_code = self.generate_mermaid_from_story(
-                story.content,
-                story.title
-            )
+            # Generate Mermaid code from the story's chapters or its whole content
+            mermaid_code, generation = self.generate_story_mermaid(story)
 
             # Create data structure compatible with your existing format
             data = {
@@ -418,7 +552,8 @@ flowchart TD
                 'metadata': {
                     'generated_by': 'Gemini AI',
                     'story_id': str(story.id),
-                    'story_title': story.title
+                    'story_title': story.title,
+                    **generation
                 }
             }
 
@@ -0,0 +1,232 @@
+"""
+Token budgets for story text interpolated into Gemini prompts.
+
+``compact(text)`` returns text that fits ``PROMPT_CONTENT_TOKEN_BUDGET``
+estimated tokens unchanged; longer text goes through the strategies named in
+``PROMPT_COMPACTION_STRATEGIES``, in order, until it fits:
+
+- ``whitespace``: collapse runs of spaces and blank lines;
+- ``dialogue``: drop paragraphs that are only dialogue (quoted speech or a
+  screenplay cue and its lines) and shorten long quotes inside narration;
+- ``summarize``: extractive summary of each section (chapter or scene): its
+  first sentence and its highest-scoring sentences by frequency of content
+  words, in a share of the budget proportional to the section's length;
+- ``truncate``: the beginning and end of the text, as a last resort.
+
+Scene and chapter headings (``INT.``/``EXT.``, ``Chapter 3``, Markdown
+headings) survive every strategy but ``truncate``, so the model still sees
+the structure. When the headings alone exceed the budget, ``summarize`` drops
+all section text and keeps an evenly spaced selection of the headings that
+fits, so ``truncate`` is not needed after it.
+Compacted text is cached by a hash of the text, budget and strategies.
+"""
+import hashlib
+import logging
+import re
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from plot.metrics import counter
+
+# Rough size of a Gemini token in characters of English prose
+CHARS_PER_TOKEN = 4
+DEFAULT_STRATEGIES = ('whitespace', 'dialogue', 'summarize', 'truncate')
+# Quotes in narration longer than this many characters are shortened
+MAX_QUOTE_CHARS = 60
+
+NUMBER_WORDS = (
+    'one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|thirteen|fourteen|fifteen|'
+    'sixteen|seventeen|eighteen|nineteen|twenty|thirty|forty|fifty|sixty|seventy|eighty|ninety|hundred'
+)
+# A keyword heading is the keyword and a number (digits, Roman or spelled
+# out), alone or followed by a separator and a title: "Chapter 3",
+# "Act II: The Fall", but not "Part of me wanted to leave." or "Act now."
+HEADING_RE = re.compile(
+    r'^\s*(?:#{1,6}\s+\S|(?:INT|EXT|EST|INT\./EXT|I/E)[.\s]'
+    r'|(?:(?:chapter|part|scene|act|book)\s+(?:\d+[a-z]?|[ivxlcdm]+|(?:' + NUMBER_WORDS + r')(?:[\s-]+(?:'
+    + NUMBER_WORDS + r'))*)|prologue|epilogue)\s*(?:[:.\-–—]\s*\S.*)?$)',
+    re.IGNORECASE
+)
+# Screenplay character cue: an upper-case name, optionally with (V.O.) etc.
+CUE_RE = re.compile(r"^\s*[A-Z][A-Z0-9 .'\-]*[A-Z](?:\s*\([^)]*\))?\s*$")
+QUOTE_RE = re.compile(r'"[^"\n]*"|“[^”\n]*”')
+SENTENCE_RE = re.compile(r'(?<=[.!?…])["”’)]*\s+')
+WORD_RE = re.compile(r"[a-z][a-z'’]+")
+BLANK_LINES_RE = re.compile(r'\n\s*\n\s*')
+SPACES_RE = re.compile(r'[ \t]+')
+STOP_WORDS = frozenset("""
+    a about after all also an and any are as at be been before but by can could did do does
+    for from had has have he her him his how i if in into is it its just like me more my no
+    not now of on one only or our out over said she so some than that the their them then
+    there these they this to too up upon was we were what when where which while who will
+    with would you your
+""".split())
+
+logger = logging.getLogger(__name__)
+
+COMPACTIONS = counter(
+    'plot_prompt_compactions_total',
+    'Prompt content compacted to fit the token budget, by the last strategy needed '
+    '(over_budget when the strategies could not make it fit)',
+    ('strategy',)
+)
+
+
+def estimate_tokens(text):
+    """Approximate token count of ``text`` (no tokenizer round-trip)"""
+    return (len(text or '') + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def is_heading(line):
+    return len(line) <= 120 and bool(HEADING_RE.match(line))
+
+
+def _paragraphs(text):
+    return [paragraph for paragraph in BLANK_LINES_RE.split(text.strip()) if paragraph.strip()]
+
+
+def collapse_whitespace(text, budget):
+    return '\n\n'.join(
+        '\n'.join(SPACES_RE.sub(' ', line).strip() for line in paragraph.splitlines() if line.strip())
+        for paragraph in _paragraphs(text)
+    )
+
+
+def _is_dialogue(paragraph):
+    lines = paragraph.splitlines()
+    if is_heading(lines[0]):
+        return False
+    if len(lines) > 1 and CUE_RE.match(lines[0]):
+        return True
+    stripped = paragraph.strip()
+    quoted = sum(len(match) for match in QUOTE_RE.findall(stripped))
+    return stripped[:1] in '"“' and quoted >= 0.6 * len(stripped)
+
+
+def drop_dialogue(text, budget):
+    def shorten(match):
+        quote = match.group(0)
+        return quote if len(quote) <= MAX_QUOTE_CHARS else quote[0] + '…' + quote[-1]
+
+    return '\n\n'.join(
+        QUOTE_RE.sub(shorten, paragraph)
+        for paragraph in _paragraphs(text) if not _is_dialogue(paragraph)
+    )
+
+
+def _sections(text):
+    """``[(heading or None, body), ...]`` split at heading lines"""
+    sections = [[None, []]]
+    for line in text.splitlines():
+        if is_heading(line):
+            sections.append([line.strip(), []])
+        else:
+            sections[-1][1].append(line)
+    return [(heading, '\n'.join(body).strip()) for heading, body in sections if heading or ''.join(body).strip()]
+
+
+def _spread_headings(headings, budget):
+    """Evenly spaced headings, first and last included, that fit ``budget``"""
+    costs = [estimate_tokens(heading) + 1 for heading in headings]
+    count = min(len(headings), budget * len(headings) // sum(costs))
+    while count:
+        if count == 1:
+            chosen = [0]
+        else:
+            chosen = sorted({round(i * (len(headings) - 1) / (count - 1)) for i in range(count)})
+        if sum(costs[i] for i in chosen) <= budget:
+            return [headings[i] for i in chosen]
+        count -= 1
+    return []
+
+
+def summarize(text, budget):
+    sections = _sections(text)
+    headings = [heading for heading, _ in sections if heading]
+    cost = sum(estimate_tokens(heading) + 1 for heading in headings)
+    if cost > budget:
+        # Not even the outline fits: keep as much of it as does, no section text
+        return '\n\n'.join(_spread_headings(headings, budget))
+
+    frequency = Counter(
+        word for word in WORD_RE.findall(text.lower()) if word not in STOP_WORDS
+    )
+    available = budget - cost
+    total = sum(len(body) for _, body in sections) or 1
+
+    parts = []
+    for heading, body in sections:
+        if heading:
+            parts.append(heading)
+        sentences = [s.strip() for s in SENTENCE_RE.split(' '.join(body.split())) if s.strip()]
+        if not sentences:
+            continue
+        share = available * len(body) // total
+
+        def score(i):
+            words = [w for w in WORD_RE.findall(sentences[i].lower()) if w not in STOP_WORDS]
+            return sum(frequency[w] for w in set(words)) / (len(words) ** 0.5 if words else 1)
+
+        # The opening sentence sets the scene; the rest compete on score. A
+        # section whose share can't hold the opening sentence is left out
+        if estimate_tokens(sentences[0]) + 1 > share:
+            continue
+        chosen = {0}
+        used = estimate_tokens(sentences[0]) + 1
+        for i in sorted(range(1, len(sentences)), key=score, reverse=True):
+            sentence_cost = estimate_tokens(sentences[i]) + 1
+            if used + sentence_cost <= share:
+                chosen.add(i)
+                used += sentence_cost
+        parts.append(' '.join(sentences[i] for i in sorted(chosen)))
+    return '\n\n'.join(parts)
+
+
+def truncate(text, budget):
+    limit = budget * CHARS_PER_TOKEN
+    if len(text) <= limit:
+        return text
+    head = limit * 2 // 3
+    tail = max(limit - head - 5, 0)
+    return text[:head].rstrip() + '\n\n…\n\n' + (text[-tail:].lstrip() if tail else '')
+
+
+STRATEGIES = {
+    'whitespace': collapse_whitespace,
+    'dialogue': drop_dialogue,
+    'summarize': summarize,
+    'truncate': truncate,
+}
+
+
+def compact(text, budget=None, strategies=None):
+    """``text`` reduced to about ``budget`` estimated tokens (PROMPT_CONTENT_TOKEN_BUDGET by default)"""
+    text = text or ''
+    budget = budget or getattr(settings, 'PROMPT_CONTENT_TOKEN_BUDGET', 8000)
+    if estimate_tokens(text) <= budget:
+        return text
+    strategies = tuple(strategies or getattr(settings, 'PROMPT_COMPACTION_STRATEGIES', DEFAULT_STRATEGIES))
+    unknown = [name for name in strategies if name not in STRATEGIES]
+    if unknown:
+        raise ValueError(f"Unknown compaction strategies: {', '.join(unknown)}")
+
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:32]
+    key = f"prompt-compact:{digest}:{budget}:{','.join(strategies)}"
+    compacted = cache.get(key)
+    if compacted is not None:
+        return compacted
+
+    compacted = text
+    outcome = 'over_budget'
+    for name in strategies:
+        compacted = STRATEGIES[name](compacted, budget)
+        if estimate_tokens(compacted) <= budget:
+            outcome = name
+            break
+    if outcome == 'over_budget':
+        logger.warning(f"Prompt content is still {estimate_tokens(compacted)} tokens, over a budget of {budget}, "
+                       f"after compaction ({', '.join(strategies)})")
+    COMPACTIONS.inc(labelvalues=(outcome,))
+    cache.set(key, compacted, getattr(settings, 'PROMPT_COMPACTION_CACHE_SECONDS', 24 * 60 * 60))
+    return compacted
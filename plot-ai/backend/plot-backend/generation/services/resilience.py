@@ -0,0 +1,304 @@
+"""
+Shared protection around upstream Gemini calls.
+
+``get_gemini_guard().call(fn, priority, user_key)`` is the single entry point used
+by both ``MermaidService`` and ``GeminiService``. For each attempt it:
+
+1. fails fast if the circuit breaker is open;
+2. waits for its turn in the scheduler (see ``scheduler.py``), which then takes
+   a token from a bucket sized to our Gemini quota and hands out a slot;
+3. runs ``fn`` and, on 429/5xx/connection errors, backs off with full jitter,
+   honouring ``Retry-After`` and pausing the bucket when upstream asks us to.
+
+Only 5xx responses and transport errors count towards opening the breaker: a
+429 means we are over quota, not that Gemini is unhealthy, and the bucket pause
+already deals with it.
+"""
+import email.utils
+import logging
+import random
+import threading
+import time
+
+import requests
+from django.conf import settings
+from plot.tracing import span
+
+from .scheduler import get_scheduler, ON_DEMAND, PRIORITY_NAMES
+
+try:
+    import httpx
+    _TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout, httpx.TransportError,
+                         ConnectionError, TimeoutError)
+except ImportError:
+    _TRANSPORT_ERRORS = (requests.ConnectionError, requests.Timeout, ConnectionError, TimeoutError)
+
+logger = logging.getLogger(__name__)
+
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class CircuitOpenError(Exception):
+    """Raised without calling upstream while Gemini is considered unhealthy"""
+
+
+class TokenBucket:
+    """Blocking token bucket refilled at ``rate`` tokens per second"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+        self.throttled_seconds = 0.0
+
+    def try_acquire(self):
+        """Take a token and return 0.0, or return the seconds until one is due"""
+        with self._lock:
+            now = time.monotonic()
+            if now < self._paused_until:
+                return self._paused_until - now
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return 0.0
+            return (1 - self._tokens) / self.rate
+
+    def acquire(self):
+        waited = 0.0
+        while True:
+            delay = self.try_acquire()
+            if not delay:
+                self.record_throttled(waited)
+                return waited
+            time.sleep(delay)
+            waited += delay
+
+    def record_throttled(self, seconds):
+        with self._lock:
+            self.throttled_seconds += seconds
+
+    def pause(self, seconds):
+        """Stop handing out tokens for ``seconds`` (upstream told us we are over quota)"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._updated = self._paused_until
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self.transitions = {}
+
+    def _transition(self, state):
+        key = f'{self.state}->{state}'
+        self.transitions[key] = self.transitions.get(key, 0) + 1
+        logger.warning(f"Gemini circuit breaker {key}")
+        self.state = state
+
+    def allow(self):
+        """Whether a call may go upstream now"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self._transition(self.HALF_OPEN)
+            if self.state == self.HALF_OPEN:
+                # Exactly one trial call probes whether upstream has recovered
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self.state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == self.HALF_OPEN or (
+                self.state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+                self._transition(self.OPEN)
+
+    def release(self):
+        """End a call that said nothing about upstream health (e.g. a 400)"""
+        with self._lock:
+            self._trial_in_flight = False
+
+
+def parse_retry_after(value):
+    """Parse a Retry-After header given as seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        parsed = email.utils.parsedate_to_datetime(value)
+        if parsed is None:
+            return None
+        return max(0.0, parsed.timestamp() - time.time())
+
+
+def classify_error(exc):
+    """Return ``(retryable, status_code, retry_after_seconds)`` for an upstream failure"""
+    response = getattr(exc, 'response', None)
+    status_code = getattr(response, 'status_code', None) or getattr(exc, 'code', None)
+    if isinstance(status_code, int):
+        headers = getattr(response, 'headers', None) or {}
+        try:
+            retry_after = parse_retry_after(headers.get('Retry-After'))
+        except (TypeError, ValueError):
+            retry_after = None
+        return status_code in RETRYABLE_STATUS_CODES, status_code, retry_after
+    if isinstance(exc, _TRANSPORT_ERRORS):
+        return True, None, None
+    return False, None, None
+
+
+class GeminiGuard:
+    def __init__(self, requests_per_minute=60, burst=10, max_retries=3,
+                 backoff_base=0.5, backoff_max=20.0,
+                 failure_threshold=5, reset_timeout=30.0):
+        self.bucket = TokenBucket(requests_per_minute / 60.0, burst)
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._lock = threading.Lock()
+        self._counters = {
+            'calls': 0,
+            'successes': 0,
+            'failures': 0,
+            'retries': 0,
+            'rate_limited': 0,
+            'rejected_open': 0,
+        }
+
+    def _count(self, name, amount=1):
+        with self._lock:
+            self._counters[name] += amount
+
+    def backoff(self, attempt, retry_after=None):
+        """Full-jitter exponential backoff, never shorter than Retry-After"""
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max))
+        return delay
+
+    def call(self, fn, priority=ON_DEMAND, user_key=None):
+        """Run ``fn`` against Gemini with admission control, limiting and retries"""
+        self._count('calls')
+        attempt = 0
+        while True:
+            if not self.breaker.allow():
+                self._count('rejected_open')
+                raise CircuitOpenError("Gemini is temporarily unavailable (circuit open)")
+
+            try:
+                # The attempt span includes queueing; the request span is the upstream call alone
+                with span('gemini.attempt', attempt=attempt, priority=PRIORITY_NAMES.get(priority, priority)) as attempt_span:
+                    try:
+                        # Tokens go out in the scheduler's priority and fair-share
+                        # order; waiting for one (up to a whole Retry-After) holds no slot
+                        with get_scheduler().slot(priority, user_key, bucket=self.bucket):
+                            with span('gemini.request'):
+                                result = fn()
+                    except Exception as exc:
+                        if attempt_span is not None:
+                            attempt_span.set_attribute('http.status_code', classify_error(exc)[1] or 0)
+                        raise
+            except Exception as exc:
+                retryable, status_code, retry_after = classify_error(exc)
+                if not retryable:
+                    self.breaker.release()
+                    raise
+                if status_code == 429:
+                    # Over quota, not unhealthy: slow down without tripping the breaker
+                    self.breaker.release()
+                    self._count('rate_limited')
+                    if retry_after:
+                        self.bucket.pause(retry_after)
+                else:
+                    self.breaker.record_failure()
+                if attempt >= self.max_retries or self.breaker.state == CircuitBreaker.OPEN:
+                    self._count('failures')
+                    raise
+                delay = self.backoff(attempt, retry_after)
+                logger.info(f"Gemini call failed ({status_code or type(exc).__name__}); "
+                            f"retry {attempt + 1}/{self.max_retries} in {delay:.2f}s")
+                self._count('retries')
+                attempt += 1
+                time.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            self._count('successes')
+            return result
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self._counters)
+        return {
+            'circuit_state': self.breaker.state,
+            'circuit_transitions': dict(self.breaker.transitions),
+            'throttled_seconds_total': self.bucket.throttled_seconds,
+            **counters,
+        }
+
+
+_guard = None
+_guard_lock = threading.Lock()
+
+
+def get_gemini_guard():
+    """Return the process-wide guard configured from settings"""
+    global _guard
+    if _guard is None:
+        with _guard_lock:
+            if _guard is None:
+                _guard = GeminiGuard(
+                    requests_per_minute=getattr(settings, 'GEMINI_REQUESTS_PER_MINUTE', 60),
+                    burst=getattr(settings, 'GEMINI_BURST', 10),
+                    max_retries=getattr(settings, 'GEMINI_MAX_RETRIES', 3),
+                    backoff_base=getattr(settings, 'GEMINI_BACKOFF_BASE', 0.5),
+                    backoff_max=getattr(settings, 'GEMINI_BACKOFF_MAX', 20.0),
+                    failure_threshold=getattr(settings, 'GEMINI_BREAKER_THRESHOLD', 5),
+                    reset_timeout=getattr(settings, 'GEMINI_BREAKER_RESET', 30.0),
+                )
+    return _guard
+
+
+def collect_metrics():
+    """Rate limiter, retry and circuit breaker figures for /metrics"""
+    snapshot = get_gemini_guard().snapshot()
+    yield ('plot_gemini_guard_events_total', 'counter', 'Gemini guard outcomes by kind',
+           [({'kind': kind}, snapshot[kind]) for kind in
+            ('calls', 'successes', 'failures', 'retries', 'rate_limited', 'rejected_open')])
+    yield ('plot_gemini_throttled_seconds_total', 'counter', 'Time spent waiting on the token bucket',
+           [({}, snapshot['throttled_seconds_total'])])
+    yield ('plot_gemini_circuit_state', 'gauge', 'Circuit breaker state (1 for the current state)',
+           [({'state': state}, int(snapshot['circuit_state'] == state))
+            for state in (CircuitBreaker.CLOSED, CircuitBreaker.OPEN, CircuitBreaker.HALF_OPEN)])
+    yield ('plot_gemini_circuit_transitions_total', 'counter', 'Circuit breaker state transitions',
+           [({'transition': key}, count) for key, count in snapshot['circuit_transitions'].items()])
@@ -0,0 +1,225 @@
+"""
+Admission control for Gemini-bound work.
+
+Every upstream Gemini call runs inside ``get_scheduler().slot(priority, user_key)``.
+The scheduler caps how many calls are in flight at once (``GEMINI_MAX_CONCURRENCY``)
+and, when that cap is reached, decides who goes next:
+
+* strictly by priority class: interactive conversation turns, then on-demand
+  flowcharts, then background regeneration;
+* within a class, round-robin across users, so one user bulk-generating only
+  ever holds one place in line per turn.
+
+Given a rate-limit ``bucket``, only the call at the head of that order takes
+tokens, right before its slot, so under quota pressure tokens are handed out in
+the same order instead of to whichever sleeping caller wakes first. Waiting for
+a token holds no slot.
+"""
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+from plot.metrics import histogram
+
+INTERACTIVE = 0
+ON_DEMAND = 1
+BACKGROUND = 2
+
+PRIORITY_NAMES = {
+    INTERACTIVE: 'interactive',
+    ON_DEMAND: 'on_demand',
+    BACKGROUND: 'background',
+}
+
+
+QUEUE_WAIT = histogram(
+    'plot_gemini_queue_wait_seconds',
+    'Time Gemini calls waited for a scheduler slot',
+    ('priority',)
+)
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a call waited longer than allowed for a Gemini slot"""
+
+
+class _Ticket:
+    __slots__ = ('priority', 'user_key', 'event', 'enqueued_at')
+
+    def __init__(self, priority, user_key):
+        self.priority = priority
+        self.user_key = user_key
+        self.event = threading.Event()
+        self.enqueued_at = time.monotonic()
+
+
+class GeminiScheduler:
+    def __init__(self, max_concurrency=4, queue_timeout=None):
+        self.max_concurrency = max_concurrency
+        self.queue_timeout = queue_timeout
+        self._lock = threading.Lock()
+        self._active = 0
+        # One ordered map of user_key -> waiting tickets per priority class;
+        # the first user in the map is the next to be served in that class.
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._stats = {
+            priority: {'granted': 0, 'timeouts': 0, 'wait_seconds_total': 0.0, 'wait_seconds_max': 0.0}
+            for priority in PRIORITY_NAMES
+        }
+
+    @contextmanager
+    def slot(self, priority=ON_DEMAND, user_key=None, timeout=None, bucket=None):
+        """
+        Block until this call may proceed, then hold a slot for its duration.
+        With a ``bucket`` (see ``resilience.TokenBucket``), also take one of its
+        tokens when this call's turn comes.
+        """
+        self._acquire(priority, user_key, self.queue_timeout if timeout is None else timeout, bucket)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _acquire(self, priority, user_key, timeout, bucket):
+        if priority not in PRIORITY_NAMES:
+            raise ValueError(f"Unknown priority class: {priority}")
+
+        ticket = _Ticket(priority, user_key if user_key is not None else 'anonymous')
+        deadline = None if timeout is None else ticket.enqueued_at + timeout
+        throttled = 0.0
+        with self._lock:
+            self._queues[priority].setdefault(ticket.user_key, deque()).append(ticket)
+
+        while True:
+            with self._lock:
+                delay = None
+                if self._active < self.max_concurrency and self._head() is ticket:
+                    delay = bucket.try_acquire() if bucket is not None else 0.0
+                    if not delay:
+                        self._pop_head()
+                        self._active += 1
+                        # The next in line may fit in another free slot
+                        self._wake_head()
+                        break
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    self._discard(ticket)
+                    self._wake_head()
+                    self._stats[priority]['timeouts'] += 1
+                    raise SchedulerTimeout(
+                        f"Timed out after {timeout}s waiting for a Gemini slot"
+                    )
+                ticket.event.clear()
+            # Waiting for a token holds no slot; anyone who gets ahead in line
+            # meanwhile wakes us when their turn is over
+            waits = [t for t in (delay, remaining) if t]
+            started = time.monotonic()
+            ticket.event.wait(min(waits) if waits else None)
+            if delay:
+                throttled += time.monotonic() - started
+
+        if bucket is not None and throttled:
+            bucket.record_throttled(throttled)
+        self._record_wait(ticket, time.monotonic() - ticket.enqueued_at)
+
+    def _release(self):
+        with self._lock:
+            self._active -= 1
+            self._wake_head()
+
+    def _head(self):
+        """The ticket to be served next, without removing it"""
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if users:
+                return next(iter(users.values()))[0]
+        return None
+
+    def _wake_head(self):
+        ticket = self._head()
+        if ticket is not None:
+            ticket.event.set()
+
+    def _pop_head(self):
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if not users:
+                continue
+            user_key, tickets = users.popitem(last=False)
+            tickets.popleft()
+            if tickets:
+                # Back of the line for this user's remaining work
+                users[user_key] = tickets
+            return
+
+    def _discard(self, ticket):
+        users = self._queues[ticket.priority]
+        tickets = users.get(ticket.user_key)
+        if tickets is None:
+            return
+        try:
+            tickets.remove(ticket)
+        except ValueError:
+            return
+        if not tickets:
+            del users[ticket.user_key]
+
+    def _record_wait(self, ticket, waited):
+        with self._lock:
+            stats = self._stats[ticket.priority]
+            stats['granted'] += 1
+            stats['wait_seconds_total'] += waited
+            stats['wait_seconds_max'] = max(stats['wait_seconds_max'], waited)
+        QUEUE_WAIT.observe(waited, (PRIORITY_NAMES[ticket.priority],))
+
+    def snapshot(self):
+        """Queue depth and wait-time figures for health checks and metrics"""
+        with self._lock:
+            return {
+                'max_concurrency': self.max_concurrency,
+                'active': self._active,
+                'queue_depth': {
+                    PRIORITY_NAMES[priority]: sum(len(t) for t in users.values())
+                    for priority, users in self._queues.items()
+                },
+                'queued_users': {
+                    PRIORITY_NAMES[priority]: len(users)
+                    for priority, users in self._queues.items()
+                },
+                'wait': {
+                    PRIORITY_NAMES[priority]: dict(stats)
+                    for priority, stats in self._stats.items()
+                },
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process-wide scheduler configured from settings"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                _scheduler = GeminiScheduler(
+                    max_concurrency=getattr(settings, 'GEMINI_MAX_CONCURRENCY', 4),
+                    queue_timeout=getattr(settings, 'GEMINI_QUEUE_TIMEOUT', 60),
+                )
+    return _scheduler
+
+
+def collect_metrics():
+    """Scheduler gauges for /metrics"""
+    snapshot = get_scheduler().snapshot()
+    yield ('plot_gemini_active_calls', 'gauge', 'Gemini calls currently holding a slot',
+           [({}, snapshot['active'])])
+    yield ('plot_gemini_max_concurrency', 'gauge', 'Configured cap on concurrent Gemini calls',
+           [({}, snapshot['max_concurrency'])])
+    yield ('plot_gemini_queue_depth', 'gauge', 'Gemini calls waiting for a slot',
+           [({'priority': name}, depth) for name, depth in snapshot['queue_depth'].items()])
+    yield ('plot_gemini_queue_timeouts_total', 'counter', 'Gemini calls that gave up waiting for a slot',
+           [({'priority': name}, stats['timeouts']) for name, stats in snapshot['wait'].items()])
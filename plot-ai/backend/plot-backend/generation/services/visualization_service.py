@@ -0,0 +1,68 @@
+import logging
+from ..graph import parse_mermaid
+from .mermaid_service import MermaidService
+
+logger = logging.getLogger(__name__)
+
+
+def build_visualization_data(request_obj):
+    """Build the data payload for a visualization request based on its type"""
+    viz_type = request_obj.visualization_type
+    story = request_obj.story
+
+    # Generate AI-powered Mermaid flowchart
+    if viz_type == 'flowchart':
+        try:
+            # Use Mermaid service to generate AI-powered flowchart
+            mermaid_service = MermaidService(user_key=request_obj.user_id)
+            data = mermaid_service.generate_story_flowchart_data(story)
+        except Exception as e:
+            # Fallback to generic flowchart if AI generation fails
+            logger.warning(f"Mermaid generation failed for request {request_obj.id}: {e}")
+            data = {
+                'type': 'flowchart',
+                'title': f'Story Flow: {story.title}',
+                'mermaid_code': f'''flowchart TD
+    A((Start)) --> B["{story.title}"]
+    B --> C[Character Introduction]
+    C --> D{{Conflict Arises?}}
+    D -->|Yes| E[Rising Action]
+    E --> F[Climax]
+    F --> G[Resolution]
+    G --> H((End))
+    D -->|No| I[Character Development]
+    I --> D''',
+                'description': f'Basic flowchart structure for "{story.title}"',
+                'metadata': {
+                    'generated_by': 'Fallback Template',
+                    'story_id': str(story.id),
+                    'story_title': story.title
+                }
+            }
+        # Store the parsed graph so clients can draw without parsing Mermaid
+        data['graph'] = parse_mermaid(data['mermaid_code'])
+        return data
+
+    # For any other type, default to flowchart
+    return {
+        'type': 'flowchart',
+        'title': f'Story Flow: {story.title}',
+        'steps': [
+            {
+                'type': 'start',
+                'title': 'Beginning',
+                'description': 'Story setup and character introduction'
+            },
+            {
+                'type': 'conflict',
+                'title': 'Middle',
+                'description': 'Conflict development and rising action'
+            },
+            {
+                'type': 'end',
+                'title': 'End',
+                'description': 'Resolution and conclusion'
+            }
+        ],
+        'themes': ['Narrative', 'Structure', 'Flow']
+    }
@@ -0,0 +1,82 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from plot.caching import invalidate_user, touch
+
+from .events import publish
+from .models import VisualizationRequest, GeneratedVisualization, ProcessingJob
+
+
+def _publish_on_commit(user_id, event, data):
+    # Only push state that other connections can actually read
+    transaction.on_commit(lambda: publish(user_id, event, data))
+
+
+def visualization_request_event(instance):
+    return {
+        'id': instance.id,
+        'story_id': instance.story_id,
+        'visualization_type': instance.visualization_type,
+        'status': instance.status,
+        'error_message': instance.error_message,
+        'updated_at': instance.updated_at,
+    }
+
+
+def processing_job_event(instance):
+    return {
+        'id': instance.id,
+        'story_id': instance.story_id,
+        'job_type': instance.job_type,
+        'status': instance.status,
+        'result': instance.result,
+        'error_message': instance.error_message,
+        'started_at': instance.started_at,
+        'completed_at': instance.completed_at,
+        'updated_at': instance.updated_at,
+    }
+
+
+@receiver(post_save, sender=VisualizationRequest)
+def visualization_request_saved(sender, instance, created, **kwargs):
+    _publish_on_commit(
+        instance.user_id,
+        'visualization_request',
+        visualization_request_event(instance)
+    )
+
+
+@receiver(post_save, sender=GeneratedVisualization)
+def visualization_generated(sender, instance, created, **kwargs):
+    if not created:
+        return
+    request_obj = instance.request
+    _publish_on_commit(request_obj.user_id, 'visualization', {
+        'id': instance.id,
+        'request_id': request_obj.id,
+        'title': instance.title,
+        'data': instance.data,
+    })
+
+
+@receiver(post_save, sender=ProcessingJob)
+def processing_job_saved(sender, instance, created, **kwargs):
+    _publish_on_commit(
+        instance.user_id,
+        'processing_job',
+        processing_job_event(instance)
+    )
+
+
+@receiver(post_save, sender=VisualizationRequest)
+@receiver(post_delete, sender=VisualizationRequest)
+def visualization_request_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=GeneratedVisualization)
+def visualization_changed(sender, instance, **kwargs):
+    # Visualizations have no updated_at of their own; their request dates them
+    touch(VisualizationRequest, instance.request_id)
+    invalidate_user(instance.request.user_id)
@@ -0,0 +1,134 @@
+"""
+Background execution of visualization generation.
+
+Requests are saved as ``pending`` and handed to a small thread pool once the
+creating transaction commits, so the API can answer immediately while the
+Gemini round-trip happens off the request thread.
+
+The pool's queue only lives in process memory. ``recover_visualizations``
+(run by the ``recover_visualizations`` management command, e.g. on deploy)
+picks up what a restart or crash left behind: ``pending`` requests are
+submitted again and ``processing`` ones that stopped moving are failed.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+from plot import tracing
+
+from .graph import get_layout, graph_for, stored_layout
+from .models import VisualizationRequest, GeneratedVisualization
+from .services.visualization_service import build_visualization_data
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """Return the shared executor, creating it on first use"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'GENERATION_WORKERS', 4),
+                    thread_name_prefix='generation'
+                )
+    return _executor
+
+
+def enqueue_visualization(request_id):
+    """Schedule generation for a saved request after the current transaction commits"""
+    # Carry the creating request's trace into the worker thread
+    trace_context = tracing.current_context()
+    transaction.on_commit(
+        lambda: get_executor().submit(run_visualization_request, request_id, trace_context)
+    )
+
+
+def run_visualization_request(request_id, trace_context=None):
+    """Move a request through processing -> completed/failed"""
+    close_old_connections()
+    try:
+        with tracing.span('visualization.generate', parent=trace_context, request_id=str(request_id)):
+            _run_visualization_request(request_id)
+    finally:
+        close_old_connections()
+
+
+def _run_visualization_request(request_id):
+    # Claim atomically: the same request may be queued by a recovery run too
+    claimed = VisualizationRequest.objects.filter(id=request_id, status='pending').update(
+        status='processing', updated_at=timezone.now()
+    )
+    if not claimed:
+        logger.info(f"Visualization request {request_id} is no longer pending")
+        return
+    request_obj = VisualizationRequest.objects.select_related('story').get(id=request_id)
+    # update() sends no post_save, which publishes the transition and
+    # invalidates cached responses
+    request_obj.save(update_fields=['status', 'updated_at'])
+
+    try:
+        data = build_visualization_data(request_obj)
+        if data.get('graph'):
+            # Lay out now so the first load doesn't pay for it, keeping the
+            # previous version's node positions if this is a regeneration
+            previous, previous_layout = _previous_layout(request_obj)
+            data['layout'] = get_layout(data['graph'], previous=previous, previous_layout=previous_layout)
+        with transaction.atomic():
+            GeneratedVisualization.objects.create(
+                request=request_obj,
+                title=data['title'],
+                description=f'Auto-generated {request_obj.visualization_type} visualization',
+                data=data
+            )
+            request_obj.status = 'completed'
+            request_obj.error_message = ''
+            request_obj.save(update_fields=['status', 'error_message', 'updated_at'])
+    except Exception as e:
+        logger.exception(f"Visualization request {request_id} failed")
+        request_obj.status = 'failed'
+        request_obj.error_message = str(e)
+        request_obj.save(update_fields=['status', 'error_message', 'updated_at'])
+
+
+def _previous_layout(request_obj):
+    """Graph and layout of the latest earlier visualization of the same story and type"""
+    previous = GeneratedVisualization.objects.filter(
+        request__story_id=request_obj.story_id,
+        request__visualization_type=request_obj.visualization_type
+    ).order_by('-created_at').values_list('data', flat=True).first()
+    graph = graph_for(previous) if previous else None
+    if graph is None:
+        return None, None
+    return graph, stored_layout(previous, graph)
+
+
+def recover_visualizations(stale_after=None):
+    """
+    Fail ``processing`` requests not updated for ``stale_after`` seconds
+    (GENERATION_STALE_SECONDS by default) and submit every ``pending`` one
+    again. Returns the futures of the submitted requests and the failed count.
+    """
+    if stale_after is None:
+        stale_after = getattr(settings, 'GENERATION_STALE_SECONDS', 30 * 60)
+    stale = VisualizationRequest.objects.filter(
+        status='processing', updated_at__lt=timezone.now() - timedelta(seconds=stale_after)
+    )
+    failed = 0
+    for request_obj in stale:
+        request_obj.status = 'failed'
+        request_obj.error_message = 'Generation was interrupted by a server restart; request it again.'
+        request_obj.save(update_fields=['status', 'error_message', 'updated_at'])
+        failed += 1
+
+    pending = VisualizationRequest.objects.filter(status='pending').values_list('id', flat=True)
+    futures = [get_executor().submit(run_visualization_request, request_id) for request_id in pending]
+    return futures, failed
@@ -1,3 +1,742 @@
-from django.test import TestCase
+import re
+import threading
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import SimpleTestCase
+from django.utils import timezone
+from rest_framework.test import APITestCase
+
+from plot import tracing
+from plot.testing import QueryBudgetMixin
+from story.models import Story, Chapter
+from .events import EventBroker
+from .graph import (
+    parse_mermaid, diff_graphs, apply_patch, analyze, project_character, get_layout, compute_layout, graph_hash,
+    to_reactflow,
+)
+from .graph.layout import NODE_WIDTH, NODE_HEIGHT
+from .graph.analytics import MAX_SAFE_INTEGER
+from .models import VisualizationRequest, GeneratedVisualization, ProcessingJob
+from .tasks import recover_visualizations, run_visualization_request
+from .services.mermaid_service import MermaidService
+from .services.prompting import compact, estimate_tokens, is_heading, summarize
+from .services.resilience import CircuitBreaker, GeminiGuard, TokenBucket
+from .services.scheduler import get_scheduler, GeminiScheduler, SchedulerTimeout, INTERACTIVE, ON_DEMAND, BACKGROUND
+
+
+@mock.patch('generation.signals.publish')
+class GenerationQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+        self.story = Story.objects.create(user=self.user, title='Story', content='...')
+
+    def add_visualization(self, i):
+        request = VisualizationRequest.objects.create(
+            story=self.story, user=self.user, visualization_type='flowchart', status='completed'
+        )
+        GeneratedVisualization.objects.create(
+            request=request, title=f'Flowchart {i}',
+            data={'mermaid_code': 'flowchart TD\n    A[Start] --> B[End]'}
+        )
+
+    def test_visualization_list(self, publish):
+        # validators (with the row count) + visualizations joined to their requests and stories
+        self.assertQueryBudget('/api/visualizations/', 2, self.add_visualization)
+
+    def test_visualization_list_as_graph(self, publish):
+        self.assertQueryBudget('/api/visualizations/?format=graph', 2, self.add_visualization)
+
+    def test_processing_job_list(self, publish):
+        def add_job(i):
+            ProcessingJob.objects.create(story=self.story, user=self.user, job_type='story_analysis')
+
+        # page count + jobs joined to their stories
+        self.assertQueryBudget('/api/processing-jobs/', 2, add_job)
+
+    def test_visualization_request_list(self, publish):
+        self.assertQueryBudget('/api/visualization-requests/', 2, self.add_visualization)
+
+
+@mock.patch('generation.signals.publish')
+class KeysetPaginationTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+        story = Story.objects.create(user=self.user, title='Story', content='...')
+        self.jobs = [
+            ProcessingJob.objects.create(story=story, user=self.user, job_type='story_analysis')
+            for _ in range(7)
+        ]
+
+    def ids(self, response):
+        return [row['id'] for row in response.data['results']]
+
+    def test_walks_forward_and_back_without_overlap(self, publish):
+        expected = [str(job.id) for job in sorted(self.jobs, key=lambda j: (j.created_at, j.id), reverse=True)]
+        first = self.client.get('/api/processing-jobs/', {'page_size': 3})
+        self.assertEqual(first.data['count'], 7)
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        third = self.client.get(second.data['next'])
+        self.assertEqual(self.ids(first) + self.ids(second) + self.ids(third), expected)
+        self.assertIsNone(third.data['next'])
+        self.assertEqual(self.ids(self.client.get(third.data['previous'])), self.ids(second))
+        self.assertEqual(self.ids(self.client.get(second.data['previous'])), self.ids(first))
+
+    def test_count_can_be_skipped(self, publish):
+        response = self.client.get('/api/processing-jobs/', {'count': 'false'})
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 7)
+
+    def test_page_numbers_still_work(self, publish):
+        response = self.client.get('/api/processing-jobs/', {'page': 1})
+        self.assertEqual(response.data['count'], 7)
+
+    def test_invalid_cursor(self, publish):
+        self.assertEqual(self.client.get('/api/processing-jobs/', {'cursor': 'nonsense'}).status_code, 404)
+
+
+class EventBrokerTests(SimpleTestCase):
+    def drain(self, subscription):
+        messages = []
+        while (message := subscription.get(timeout=0)) is not None:
+            messages.append(message)
+        return messages
+
+    def test_resume_replays_missed_events(self):
+        broker = EventBroker()
+        first = broker.publish(1, 'update', {'n': 1})
+        broker.publish(1, 'update', {'n': 2})
+        subscription = broker.subscribe(1, last_event_id=first)
+        self.assertTrue(subscription.resumed)
+        self.assertEqual(len(self.drain(subscription)), 1)
+
+    def test_ids_from_another_process_are_not_resumed(self):
+        earlier = EventBroker()
+        last = earlier.publish(1, 'update', {'n': 1})
+        restarted = EventBroker()
+        self.assertFalse(restarted.subscribe(1, last_event_id=last).resumed)
+        self.assertFalse(restarted.subscribe(1, last_event_id='500').resumed)
+        self.assertFalse(restarted.subscribe(1).resumed)
+
+    def test_ids_older_than_history_are_not_resumed(self):
+        broker = EventBroker(history_size=2)
+        first = broker.publish(1, 'update', {'n': 1})
+        second = broker.publish(1, 'update', {'n': 2})
+        self.assertTrue(broker.subscribe(1, last_event_id=first).resumed)
+        broker.publish(1, 'update', {'n': 3})
+        broker.publish(1, 'update', {'n': 4})
+        # Event 2 is gone from history, so it can't be replayed after event 1
+        self.assertFalse(broker.subscribe(1, last_event_id=first).resumed)
+        self.assertTrue(broker.subscribe(1, last_event_id=second).resumed)
+
+
+class InlineExecutor:
+    """Runs submitted work on the calling thread"""
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+@mock.patch('generation.signals.publish')
+@mock.patch('generation.tasks.get_executor', InlineExecutor)
+@mock.patch('generation.tasks.build_visualization_data', return_value={'title': 'Map', 'characters': []})
+class VisualizationRecoveryTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.story = Story.objects.create(user=self.user, title='Story', content='...')
+
+    def add_request(self, status, idle_seconds=0):
+        request = VisualizationRequest.objects.create(
+            story=self.story, user=self.user, visualization_type='character_map', status=status
+        )
+        VisualizationRequest.objects.filter(id=request.id).update(
+            updated_at=timezone.now() - timedelta(seconds=idle_seconds)
+        )
+        return request
+
+    def test_pending_requests_are_resubmitted(self, build, publish):
+        request = self.add_request('pending')
+        futures, failed = recover_visualizations(stale_after=60)
+        self.assertEqual((len(futures), failed), (1, 0))
+        request.refresh_from_db()
+        self.assertEqual(request.status, 'completed')
+        self.assertTrue(GeneratedVisualization.objects.filter(request=request).exists())
+
+    def test_only_stale_processing_requests_fail(self, build, publish):
+        stale = self.add_request('processing', idle_seconds=120)
+        running = self.add_request('processing', idle_seconds=10)
+        recover_visualizations(stale_after=60)
+        stale.refresh_from_db()
+        running.refresh_from_db()
+        self.assertEqual(stale.status, 'failed')
+        self.assertIn('interrupted', stale.error_message)
+        self.assertEqual(running.status, 'processing')
+        build.assert_not_called()
+
+    def test_a_request_is_generated_once(self, build, publish):
+        request = self.add_request('pending')
+        run_visualization_request(request.id)
+        run_visualization_request(request.id)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(GeneratedVisualization.objects.filter(request=request).count(), 1)
+
+
+@mock.patch.dict('os.environ', {'GEMINI_API_KEY': 'test'})
+class ChapterFlowchartTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create_user('writer', password='pw')
+        self.story = Story.objects.create(user=user, title='Story', content='...')
+        for order, title in enumerate(['Arrival', 'Departure'], 1):
+            Chapter.objects.create(story=self.story, title=title, content=f'{title} text', order=order)
+
+    def generate(self):
+        def fake(prompt):
+            chapter = 'Arrival' if 'Chapter: Arrival' in prompt else 'Departure'
+            return f'flowchart TD\n    A[{chapter}] --> B{{Stay?}}\n    B -->|Yes| C[Stays]\n    B -->|No| D[Leaves]'
+
+        service = MermaidService()
+        with mock.patch.object(service, 'generate_mermaid', side_effect=fake) as generate:
+            code, generation = service.generate_story_mermaid(self.story, mode='chapters')
+        return parse_mermaid(code), generation, generate.call_count
+
+    def test_fragments_are_merged_in_chapter_order(self):
+        graph, generation, calls = self.generate()
+        self.assertEqual(calls, 2)
+        self.assertEqual([s['label'] for s in graph['subgraphs']], ['Arrival', 'Departure'])
+        ids = [node['id'] for node in graph['nodes']]
+        links = {(ids[e['source']], ids[e['target']]) for e in graph['edges']}
+        # Both endings of the first chapter lead into the second
+        self.assertTrue({('c1_C', 'c2_A'), ('c1_D', 'c2_A')} <= links)
+        self.assertEqual(generation['mode'], 'chapters')
+
+    def test_only_edited_chapters_are_regenerated(self):
+        self.generate()
+        chapter = self.story.chapters.get(order=2)
+        chapter.content = 'Departure, rewritten'
+        chapter.save()
+        _, generation, calls = self.generate()
+        self.assertEqual(calls, 1)
+        self.assertEqual([c['cached'] for c in generation['chapters']], [True, False])
+
+    def test_story_rename_reuses_fragments(self):
+        self.generate()
+        self.story.title = 'Renamed'
+        self.story.save()
+        _, generation, calls = self.generate()
+        self.assertEqual(calls, 0)
+        self.assertEqual([c['cached'] for c in generation['chapters']], [True, True])
+
+    def test_chapter_spans_join_the_request_trace(self):
+        def fake(prompt):
+            with tracing.span('gemini.fake'):
+                return 'flowchart TD\n    A[Start] --> B[End]'
+
+        service = MermaidService()
+        with tracing.span('request', force=True) as root:
+            with mock.patch.object(service, 'generate_mermaid', side_effect=fake):
+                service.generate_story_mermaid(self.story, mode='chapters')
+        self.assertEqual([node.name for node in root.walk()].count('gemini.fake'), 2)
+
+
+class PromptCompactionTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        scene = (
+            'The caravan crossed the salt flats at dawn. Mara counted the water barrels twice. '
+            'The guide refused to say where the old well had gone.'
+        )
+        self.text = '\n\n'.join(
+            f'Chapter {n}\n\n{scene}\n\n"We turn back tonight," said Mara, "before the storm."'
+            for n in range(1, 201)
+        )
+
+    def test_fits_budget_and_keeps_headings(self):
+        compacted = compact(self.text, budget=3000)
+        self.assertLessEqual(estimate_tokens(compacted), 3000)
+        self.assertIn('Chapter 200', compacted)
+        self.assertNotIn('We turn back tonight', compacted)
+
+    def test_short_text_is_untouched(self):
+        self.assertEqual(compact('A short story.', budget=100), 'A short story.')
+
+    def test_compacted_text_is_cached(self):
+        compact(self.text, budget=3000)
+        with mock.patch.dict('generation.services.prompting.STRATEGIES', {}):
+            # A cache miss would fail on the now unknown strategies
+            self.assertLessEqual(estimate_tokens(compact(self.text, budget=3000)), 3000)
+
+    def test_over_budget_results_are_counted_apart(self):
+        with mock.patch('generation.services.prompting.COMPACTIONS') as compactions, \
+                self.assertLogs('generation.services.prompting', 'WARNING'):
+            compacted = compact(self.text, budget=100, strategies=('whitespace', 'dialogue'))
+        self.assertGreater(estimate_tokens(compacted), 100)
+        compactions.inc.assert_called_once_with(labelvalues=('over_budget',))
+
+    def test_headings_beyond_budget_are_spread_not_cut(self):
+        screenplay = '\n\n'.join(
+            f'INT. SAFE HOUSE - ROOM {n} - NIGHT\n\nMara checks the window. The street is empty.'
+            for n in range(1, 3001)
+        )
+        compacted = compact(screenplay, budget=2000)
+        self.assertLessEqual(estimate_tokens(compacted), 2000)
+        lines = compacted.split('\n\n')
+        self.assertTrue(all(is_heading(line) for line in lines))
+        self.assertEqual(lines[0], 'INT. SAFE HOUSE - ROOM 1 - NIGHT')
+        self.assertEqual(lines[-1], 'INT. SAFE HOUSE - ROOM 3000 - NIGHT')
+        self.assertGreater(len(lines), 100)
+
+    def test_sections_without_a_share_are_dropped(self):
+        text = '\n\n'.join(
+            f'Chapter {n}\n\nThe opening sentence of this chapter is deliberately rather long. It goes on.'
+            for n in range(1, 41)
+        )
+        # The headings leave a share too small for any opening sentence
+        summary = summarize(text, budget=200)
+        self.assertLessEqual(estimate_tokens(summary), 200)
+        self.assertIn('Chapter 40', summary)
+        self.assertNotIn('opening sentence', summary)
+
+    def test_keyword_headings_need_a_number(self):
+        for line in ('Chapter 3', 'CHAPTER TWENTY-ONE', 'Act II: The Fall', 'Part One', 'Scene 12A',
+                     'Prologue', 'Epilogue - Ten years later', 'INT. KITCHEN - NIGHT', '## The Storm'):
+            self.assertTrue(is_heading(line), line)
+        for line in ('Part of me wanted to leave.', 'Act now, she said.', 'Chapter and verse, he said.',
+                     'Scene of the crime was quiet.', 'Prologue to a disaster, really.'):
+            self.assertFalse(is_heading(line), line)
+
+
+class FlowchartAnalyticsTests(SimpleTestCase):
+    def test_routes_and_endings(self):
+        graph = parse_mermaid(
+            'flowchart TD\n'
+            '    A[Start] --> B{Choice}\n'
+            '    B --> C[Left]\n'
+            '    B --> D[Right]\n'
+            '    C --> E[Ending]\n'
+            '    D --> E\n'
+            '    X[Orphan] --> F[Lost ending]\n'
+        )
+        result = analyze(graph, start='A')
+        self.assertEqual(result['start'], 'A')
+        self.assertEqual(result['playthroughs'], 2)
+        endings = {ending['id']: ending for ending in result['endings']}
+        self.assertEqual(endings['E']['playthroughs'], 2)
+        self.assertEqual(endings['E']['shortest'], 3)
+        self.assertFalse(endings['F']['reachable'])
+        self.assertEqual(sorted(result['unreachable']), ['F', 'X'])
+
+    def test_explicit_start(self):
+        graph = parse_mermaid('flowchart TD\n    A --> B\n    B --> C\n')
+        result = analyze(graph, start='B')
+        self.assertEqual(result['start'], 'B')
+        self.assertEqual(result['unreachable'], ['A'])
+        self.assertEqual(result['endings'][0]['shortest_route'], ['B', 'C'])
+
+    def test_cycle_counts_once(self):
+        graph = parse_mermaid(
+            'flowchart TD\n    A --> B\n    B --> C\n    C --> B\n    C --> D\n'
+        )
+        result = analyze(graph)
+        self.assertEqual(result['cycle_count'], 1)
+        self.assertEqual(sorted(result['cycles'][0]['nodes']), ['B', 'C'])
+        self.assertTrue(result['cycles'][0]['escapable'])
+        self.assertEqual(result['playthroughs'], 1)
+
+    def test_playthrough_counts_saturate(self):
+        # Every node has two parents: the counts are Fibonacci numbers,
+        # far past what int-to-str conversion allows
+        n = 30000
+        graph = {
+            'nodes': [{'id': f'n{i}', 'label': f'Node {i}'} for i in range(n)],
+            'edges': [{'source': i - k, 'target': i} for i in range(1, n) for k in (1, 2) if i - k >= 0],
+        }
+        result = analyze(graph)
+        self.assertEqual(result['playthroughs'], f'>{MAX_SAFE_INTEGER}')
+        self.assertEqual(result['endings'][0]['longest'], n - 1)
+
+
+class CharacterProjectionTests(SimpleTestCase):
+    def ids(self, graph):
+        return [node['id'] for node in graph['nodes']]
+
+    def test_keeps_steps_between_mentions_and_endings(self):
+        graph = parse_mermaid(
+            'flowchart TD\n'
+            '    A[Start] --> B[Alice wakes]\n    B --> C[Road]\n    C --> D[Inn]\n'
+            '    D --> E[Bob sings]\n    E --> F[Night]\n    F --> G[Dawn]\n'
+            '    G --> H[Alice leaves]\n    H --> I[Bob stays]\n    I --> J[Years pass]\n'
+            '    J --> K[The end]\n'
+        )
+        journey = project_character(graph, 'Alice', ['Alice', 'Bob'])
+        self.assertEqual(self.ids(journey), ['A', 'B', 'C', 'D', 'E', 'F', 'G', 'H', 'K'])
+        last = journey['edges'][-1]
+        self.assertEqual((journey['nodes'][last['source']]['id'], journey['nodes'][last['target']]['id']), ('H', 'K'))
+        self.assertEqual(last['style'], 'dotted')
+
+    def test_side_branches_are_elided(self):
+        graph = parse_mermaid(
+            'flowchart TD\n'
+            '    A[Start] --> B{Alice chooses}\n'
+            '    B -->|stay| C[Alice settles]\n'
+            '    B -->|go| D[Bob travels]\n'
+            '    D --> E[Bob returns]\n'
+            '    E --> F[Bob ending]\n'
+            '    C --> G[Alice ending]\n'
+        )
+        journey = project_character(graph, 'Alice', ['Alice', 'Bob'])
+        self.assertEqual(self.ids(journey), ['A', 'B', 'C', 'F', 'G'])
+
+    def test_unmentioned_character(self):
+        graph = parse_mermaid('flowchart TD\n    A[Start] --> B[End]\n')
+        self.assertIsNone(project_character(graph, 'Alice', ['Alice']))
+
+
+class GeminiSchedulerTests(SimpleTestCase):
+    def grant_order(self, waiters):
+        """Order in which ``(priority, user)`` waiters, queued in turn behind a held slot, get it"""
+        scheduler = GeminiScheduler(max_concurrency=1, queue_timeout=5)
+        order = []
+
+        def wait(priority, user):
+            with scheduler.slot(priority, user):
+                order.append((priority, user))
+
+        threads = []
+        with scheduler.slot(INTERACTIVE, 'holder'):
+            for priority, user in waiters:
+                thread = threading.Thread(target=wait, args=(priority, user))
+                thread.start()
+                threads.append(thread)
+                while sum(scheduler.snapshot()['queue_depth'].values()) < len(threads):
+                    time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+        return order
+
+    def test_higher_priority_goes_first(self):
+        order = self.grant_order([(BACKGROUND, 'a'), (ON_DEMAND, 'b'), (INTERACTIVE, 'c')])
+        self.assertEqual(order, [(INTERACTIVE, 'c'), (ON_DEMAND, 'b'), (BACKGROUND, 'a')])
+
+    def test_round_robin_within_a_class(self):
+        order = self.grant_order([(ON_DEMAND, 'bulk')] * 3 + [(ON_DEMAND, 'other')])
+        self.assertEqual([user for _, user in order], ['bulk', 'other', 'bulk', 'bulk'])
+
+    def test_tokens_go_out_in_priority_order(self):
+        scheduler = GeminiScheduler(max_concurrency=4, queue_timeout=5)
+        bucket = TokenBucket(rate=5, capacity=1)
+        bucket.acquire()
+        order = []
+
+        def call(priority, user):
+            with scheduler.slot(priority, user, bucket=bucket):
+                order.append(user)
+
+        threads = []
+        for priority, user in [(BACKGROUND, 'bulk')] * 3 + [(INTERACTIVE, 'chat')]:
+            thread = threading.Thread(target=call, args=(priority, user))
+            thread.start()
+            threads.append(thread)
+            while sum(scheduler.snapshot()['queue_depth'].values()) < len(threads):
+                time.sleep(0.001)
+        for thread in threads:
+            thread.join()
+        # Slots were free throughout: the token order decided
+        self.assertEqual(order, ['chat', 'bulk', 'bulk', 'bulk'])
+
+    def test_queue_timeout(self):
+        scheduler = GeminiScheduler(max_concurrency=1)
+        with scheduler.slot(ON_DEMAND, 'a'):
+            with self.assertRaises(SchedulerTimeout):
+                with scheduler.slot(ON_DEMAND, 'b', timeout=0.01):
+                    pass
+        snapshot = scheduler.snapshot()
+        self.assertEqual(snapshot['wait']['on_demand']['timeouts'], 1)
+        self.assertEqual(snapshot['queue_depth']['on_demand'], 0)
+        self.assertEqual(snapshot['active'], 0)
+
+
+class GeminiGuardTests(SimpleTestCase):
+    def test_breaker_opens_and_lets_one_trial_through(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+        breaker.record_failure()
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+        self.assertTrue(breaker.allow())
+        self.assertEqual(breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(breaker.allow())
+        breaker.record_success()
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_bucket_waits_for_refill(self):
+        bucket = TokenBucket(rate=100, capacity=1)
+        self.assertEqual(bucket.acquire(), 0.0)
+        self.assertGreater(bucket.acquire(), 0.0)
+
+    @mock.patch('generation.services.resilience.time.sleep')
+    def test_retries_transient_failures_only(self, sleep):
+        guard = GeminiGuard(max_retries=2)
+        fn = mock.Mock(side_effect=[requests.ConnectionError(), 'ok'])
+        self.assertEqual(guard.call(fn), 'ok')
+        self.assertEqual(guard.snapshot()['retries'], 1)
+
+        fn = mock.Mock(side_effect=ValueError('bad prompt'))
+        with self.assertRaises(ValueError):
+            guard.call(fn)
+        self.assertEqual(fn.call_count, 1)
+
+    @mock.patch('generation.services.resilience.time.sleep')
+    def test_rate_limits_do_not_open_the_breaker(self, sleep):
+        def error(status_code):
+            return requests.HTTPError(response=mock.Mock(status_code=status_code, headers={}))
+
+        guard = GeminiGuard(max_retries=5, failure_threshold=2)
+        fn = mock.Mock(side_effect=[error(429)] * 3 + ['ok'])
+        self.assertEqual(guard.call(fn), 'ok')
+        self.assertEqual(guard.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(guard.snapshot()['rate_limited'], 3)
+
+        fn = mock.Mock(side_effect=[error(503)] * 2 + ['ok'])
+        with self.assertRaises(requests.HTTPError):
+            guard.call(fn)
+        self.assertEqual(guard.breaker.state, CircuitBreaker.OPEN)
+
+    def test_rate_limit_wait_holds_no_slot(self):
+        guard = GeminiGuard()
+        guard.bucket.pause(0.3)
+        thread = threading.Thread(target=guard.call, args=(lambda: None,))
+        thread.start()
+        time.sleep(0.1)
+        # Still waiting for a token, without a scheduler slot
+        self.assertTrue(thread.is_alive())
+        self.assertEqual(get_scheduler().snapshot()['active'], 0)
+        thread.join()
+
+
+def chain_mermaid(length, extra=()):
+    """Mermaid of a chain n0 --> n1 --> ... plus ``extra`` statements"""
+    lines = ['flowchart TD'] + [f'    n{i}[Step {i}] --> n{i + 1}[Step {i + 1}]' for i in range(length - 1)]
+    return '\n'.join(lines + [f'    {statement}' for statement in extra])
+
+
+class LayoutTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+
+    def assertNoOverlaps(self, layout):
+        boxes = list(layout['positions'].values())
+        for i, (x1, y1) in enumerate(boxes):
+            for x2, y2 in boxes[i + 1:]:
+                self.assertFalse(abs(x1 - x2) < NODE_WIDTH and abs(y1 - y2) < NODE_HEIGHT, (x1, y1, x2, y2))
+
+    def test_graph_is_hashed_once(self):
+        graph = parse_mermaid(chain_mermaid(5))
+        with mock.patch('generation.graph.layout.graph_hash', wraps=graph_hash) as hashed:
+            layout = get_layout(graph)
+        self.assertEqual(hashed.call_count, 1)
+        self.assertEqual(layout['hash'], layout['key'])
+
+    def test_full_layout_ranks_edges_downward_without_overlaps(self):
+        graph = parse_mermaid(
+            'flowchart TD\n    A --> B{Choice}\n    B --> C\n    B --> D\n    C --> E\n    D --> E\n'
+            '    A --> E\n    E --> B\n'
+        )
+        layout = compute_layout(graph)
+        y = {node_id: position[1] for node_id, position in layout['positions'].items()}
+        self.assertTrue(y['A'] < y['B'] < y['C'] < y['E'])
+        self.assertEqual(y['C'], y['D'])
+        self.assertNoOverlaps(layout)
+        # Edges spanning layers are routed through each layer they cross,
+        # including the loop back from E to B
+        edges = to_reactflow(graph, layout)['edges']
+        self.assertEqual(len(edges[5]['data']['points']), 4)
+        self.assertEqual(len(edges[6]['data']['points']), 3)
+
+    def test_horizontal_layout(self):
+        layout = compute_layout(parse_mermaid('flowchart LR\n    A --> B\n    B --> C\n'))
+        x = [layout['positions'][node_id][0] for node_id in 'ABC']
+        self.assertEqual(x, sorted(x))
+        self.assertEqual(len({layout['positions'][node_id][1] for node_id in 'ABC'}), 1)
+
+    def test_incremental_keeps_untouched_nodes_without_overlaps(self):
+        base = parse_mermaid(chain_mermaid(12, ['n3 --> b1[Branch]', 'n3 --> b2[Other branch]']))
+        edited = parse_mermaid(chain_mermaid(12, [
+            'n3 --> b1[Branch]', 'n3 --> b2[Other branch]', 'n3 --> b3[New branch]', 'b3 --> n5',
+        ]))
+        before = get_layout(base)
+        after = get_layout(edited, previous=base)
+        self.assertEqual(after['mode'], 'incremental')
+        for node_id, position in before['positions'].items():
+            self.assertEqual(after['positions'][node_id], position)
+        self.assertNoOverlaps(after)
+
+    def test_incremental_results_are_not_served_without_their_previous_version(self):
+        base = parse_mermaid(chain_mermaid(12))
+        edited = parse_mermaid(chain_mermaid(12, ['n2 --> x[Extra]']))
+        self.assertEqual(get_layout(edited, previous=base)['mode'], 'incremental')
+        self.assertEqual(get_layout(edited)['mode'], 'full')
+        # A cached full layout doesn't short-circuit the incremental one either
+        self.assertEqual(get_layout(edited, previous=base)['mode'], 'incremental')
+
+    def test_drift_is_measured_from_the_last_full_layout(self):
+        previous = parse_mermaid(chain_mermaid(10))
+        layout = get_layout(previous)
+        modes = []
+        for step in range(1, 5):
+            graph = parse_mermaid(chain_mermaid(10 + step))
+            layout = get_layout(graph, previous=previous, previous_layout=layout)
+            modes.append(layout['mode'])
+            previous = graph
+        # Each edit alone is small; together they pass the threshold
+        self.assertEqual(modes, ['incremental', 'incremental', 'incremental', 'full'])
+
+
+class FlowchartDiffTests(SimpleTestCase):
+    def comparable(self, graph):
+        """Direction, nodes by ID and parallel edges in order per endpoint pair"""
+        ids = [node['id'] for node in graph['nodes']]
+        edges = {}
+        for edge in graph['edges']:
+            attrs = {key: value for key, value in edge.items() if key not in ('source', 'target')}
+            edges.setdefault((ids[edge['source']], ids[edge['target']]), []).append(attrs)
+        return graph['direction'], {node['id']: node for node in graph['nodes']}, edges
+
+    def assertRoundTrip(self, old_code, new_code):
+        old, new = parse_mermaid(old_code), parse_mermaid(new_code)
+        patch = diff_graphs(old, new)
+        self.assertEqual(self.comparable(apply_patch(old, patch)), self.comparable(new))
+        return patch
+
+    def test_renames_and_parallel_edges(self):
+        patch = self.assertRoundTrip(
+            'flowchart TD\n'
+            '    A[Meet the stranger] -->|talk| B{Trust him?}\n'
+            '    A -->|ignore| B\n'
+            '    B -->|yes| C[Join the crew]\n'
+            '    B -->|no| D[Walk away]\n'
+            '    C --> E[Final heist]\n',
+            'flowchart LR\n'
+            '    A[Meet the stranger] -->|ignore| B{Trust him?}\n'
+            '    A -->|talk| B\n'
+            '    A -->|fight| B\n'
+            '    B -->|yes| X[Join the crew!]\n'
+            '    D[Walk away] --> B\n'
+            '    X -.-> E[Final heist]\n',
+        )
+        self.assertEqual(patch['direction'], 'LR')
+        self.assertEqual(patch['nodes']['changed'][0]['from_id'], 'C')
+
+    def test_swapped_ids(self):
+        self.assertRoundTrip(
+            'flowchart TD\n    A[Open the door] --> B[Find the key]\n    B --> C[Escape]\n',
+            'flowchart TD\n    B[Open the door] --> A[Find the key]\n    A --> C[Escape]\n',
+        )
+
+    def test_reused_id_and_dropped_parallel_edges(self):
+        self.assertRoundTrip(
+            'flowchart TD\n    A[Start] --> C[Old ending]\n    A -->|x| C\n    A -->|y| C\n',
+            'flowchart BT\n    A[Start] --> C[Completely new twist]\n    A --> D[Old ending]\n    D -->|y| A\n',
+        )
+
+    def test_many_removed_and_changed_edges(self):
+        lines = ['flowchart TD'] + [f'    N{i}[Step {i}]' for i in range(500)]
+        old = lines + [f'    N{i * 7 % 500} --> N{i * 11 % 500}' for i in range(2000)]
+        new = lines + [f'    N{i * 7 % 500} -->|again| N{i * 11 % 500}' for i in range(400)]
+        new += [f'    N{i * 13 % 500} --> N{i * 3 % 500}' for i in range(1600)]
+        patch = self.assertRoundTrip('\n'.join(old), '\n'.join(new))
+        self.assertGreater(patch['summary']['edges_removed'], 1000)
+        self.assertGreater(patch['summary']['edges_changed'], 100)
+
+    def test_unchanged(self):
+        code = 'flowchart TD\n    A[Start] -->|go| B[End]\n    A -->|go| B\n'
+        patch = self.assertRoundTrip(code, code)
+        self.assertTrue(patch['summary']['unchanged'])
+
+
+@mock.patch.dict('os.environ', {'GEMINI_API_KEY': 'test'})
+class MermaidParserTests(SimpleTestCase):
+    def prompt_examples(self):
+        """The example flowcharts of every Gemini prompt template, as sent"""
+        service = MermaidService()
+        with mock.patch.object(service, 'generate_mermaid', return_value='flowchart TD\n    A --> B') as generate:
+            service.generate_mermaid_from_story('A story.', 'Title')
+            for flowchart_type in ('main_story', 'alternative_1', 'alternative_2', 'alternative_3', 'other'):
+                service.generate_mermaid_from_description('A story.', flowchart_type)
+            service.generate_multiple_flowcharts('A story.', ['Mara'], mode='llm')
+        prompts = [call.args[0] for call in generate.call_args_list]
+        return [prompt.split('Example format:', 1)[1].strip() for prompt in prompts if 'Example format:' in prompt]
+
+    def test_prompt_examples_parse_completely(self):
+        examples = self.prompt_examples()
+        self.assertEqual(len(examples), 8)
+        for example in examples:
+            graph = parse_mermaid(example)
+            self.assertEqual(len(graph['edges']), example.count('-->'), example)
+            for node in graph['nodes']:
+                self.assertRegex(node['id'], r'^[A-Z]$', example)
+                self.assertNotEqual(node['text'], node['id'], example)
+
+    def test_shapes_labels_and_links(self):
+        graph = parse_mermaid(
+            'flowchart LR\n'
+            '    A((Start)) --> B{Choice?}\n'
+            '    B -->|Yes| C[Act 2: Go]\n'
+            '    B -- No --> D(Stay) & E{{Wait}}\n'
+            '    C -.-> F\n'
+            '    D ==> F\n'
+        )
+        self.assertEqual(graph['direction'], 'LR')
+        nodes = {node['id']: node for node in graph['nodes']}
+        self.assertEqual(
+            {node_id: node['shape'] for node_id, node in nodes.items()},
+            {'A': 'circle', 'B': 'rhombus', 'C': 'rect', 'D': 'round', 'E': 'hexagon', 'F': 'rect'}
+        )
+        self.assertEqual((nodes['C']['label'], nodes['C']['act']), ('Go', 2))
+        ids = [node['id'] for node in graph['nodes']]
+        edges = {(ids[e['source']], ids[e['target']]): e for e in graph['edges']}
+        self.assertEqual(edges[('B', 'C')]['label'], 'Yes')
+        self.assertEqual(edges[('B', 'E')]['label'], 'No')
+        self.assertEqual(edges[('C', 'F')]['style'], 'dotted')
+        self.assertEqual(edges[('D', 'F')]['style'], 'thick')
+
+    def test_partly_parseable_statements_add_nothing(self):
+        graph = parse_mermaid(
+            'flowchart TD\n    node-1[Start] --> node-2[End]\n    A[One] --> B[Two] -->\n    C --> D\n'
+        )
+        self.assertEqual([node['id'] for node in graph['nodes']], ['C', 'D'])
+        self.assertEqual(len(graph['edges']), 1)
+
+
+@mock.patch('generation.signals.publish')
+class VisualizationGraphFormatTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+        story = Story.objects.create(user=self.user, title='Story', content='...')
+        for visualization_type, data in (
+            ('flowchart', {'mermaid_code': 'flowchart TD\n    A[Start] --> B[End]'}),
+            ('character_map', {'characters': [{'name': 'Mara'}]}),
+        ):
+            request = VisualizationRequest.objects.create(
+                story=story, user=self.user, visualization_type=visualization_type, status='completed'
+            )
+            GeneratedVisualization.objects.create(request=request, title=visualization_type, data=data)
+
+    def test_only_flowcharts_swap_data_for_graph(self, publish):
+        response = self.client.get('/api/visualizations/?format=graph')
+        by_title = {item['title']: item for item in response.data['results']}
+        self.assertEqual(len(by_title['flowchart']['graph']['nodes']), 2)
+        self.assertNotIn('data', by_title['flowchart'])
+        self.assertEqual(by_title['character_map']['data'], {'characters': [{'name': 'Mara'}]})
+        self.assertNotIn('graph', by_title['character_map'])
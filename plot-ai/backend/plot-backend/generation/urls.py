@@ -7,12 +7,14 @@ from .views import (
 )
 from .views.mermaid_views import (
     generate_mermaid_from_story, generate_mermaid_from_description,
-    generate_mermaid_svg, mermaid_health_check, generate_four_flowcharts
+    generate_mermaid_svg, mermaid_health_check, generate_four_flowcharts,
+    layout_mermaid, diff_mermaid
 )
 from .views.test_views import (
     test_mermaid_generation, test_mermaid_svg, 
     #test_multiple_flowcharts, test_multi_svgs
 )
+from .views.event_views import event_stream
 from .views.demo_views import mermaid_demo
 from .views.simple_test_view import simple_test_view
 
@@ -24,11 +26,16 @@ router.register(r'processing-jobs', ProcessingJobViewSet, basename='processing-j
 urlpatterns = [
     path('', include(router.urls)),
 
+    # Live job and visualization updates (Server-Sent Events)
+    path('events/', event_stream, name='event-stream'),
+
     # Mermaid-specific endpoints
     path('mermaid/story/<uuid:story_id>/', generate_mermaid_from_story, name='mermaid-from-story'),
     path('mermaid/generate/', generate_mermaid_from_description, name='mermaid-from-description'),
     path('mermaid/generate-four/', generate_four_flowcharts, name='mermaid-generate-four'),
     path('mermaid/svg/', generate_mermaid_svg, name='mermaid-svg'),
+    path('mermaid/layout/', layout_mermaid, name='mermaid-layout'),
+    path('mermaid/diff/', diff_mermaid, name='mermaid-diff'),
     path('mermaid/health/', mermaid_health_check, name='mermaid-health'),
 
     # Test endpoints (no authentication required)
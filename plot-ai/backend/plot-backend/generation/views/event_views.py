@@ -0,0 +1,72 @@
+import json
+from django.http import StreamingHttpResponse
+from rest_framework import permissions
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from ..events import broker, encode_event
+from ..models import VisualizationRequest, ProcessingJob
+from ..signals import visualization_request_event, processing_job_event
+
+HEARTBEAT_SECONDS = 15
+
+
+class EventStreamRenderer(BaseRenderer):
+    """Lets EventSource clients (Accept: text/event-stream) pass content negotiation"""
+    media_type = 'text/event-stream'
+    format = 'event-stream'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only used for error bodies; the stream itself bypasses rendering
+        return json.dumps(data).encode('utf-8')
+
+
+def _last_event_id(request):
+    return request.META.get('HTTP_LAST_EVENT_ID') or request.query_params.get('last_event_id')
+
+
+def _snapshot(user):
+    """Current in-flight work, so a fresh client starts from a known state"""
+    requests = VisualizationRequest.objects.filter(
+        user=user, status__in=['pending', 'processing']
+    )
+    jobs = ProcessingJob.objects.filter(
+        user=user, status__in=['queued', 'processing']
+    )
+    return encode_event(None, 'snapshot', {
+        'visualization_requests': [visualization_request_event(r) for r in requests],
+        'processing_jobs': [processing_job_event(j) for j in jobs],
+    })
+
+
+def _stream(user, last_event_id):
+    # Subscribe before taking the snapshot so no transition falls in between
+    subscription = broker.subscribe(user.id, last_event_id=last_event_id)
+    try:
+        yield b'retry: 3000\n\n'
+        # Reconnecting clients get missed events replayed instead of a snapshot,
+        # unless they were missed by another process or fell out of history
+        if not subscription.resumed:
+            yield _snapshot(user)
+        while not subscription.overflowed:
+            message = subscription.get(timeout=HEARTBEAT_SECONDS)
+            yield message if message is not None else b': keep-alive\n\n'
+    finally:
+        subscription.close()
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+@renderer_classes([JSONRenderer, EventStreamRenderer])
+def event_stream(request):
+    """
+    Server-Sent Events stream of the user's ProcessingJob and VisualizationRequest
+    state transitions and finished visualizations
+    """
+    response = StreamingHttpResponse(
+        _stream(request.user, _last_event_id(request)),
+        content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
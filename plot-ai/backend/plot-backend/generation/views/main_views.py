@@ -2,110 +2,92 @@ from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
+from plot.caching import ConditionalGetMixin
 from ..models import VisualizationRequest, GeneratedVisualization, ProcessingJob
 from ..serializers import (
     VisualizationRequestSerializer, VisualizationRequestCreateSerializer,
     GeneratedVisualizationSerializer, ProcessingJobSerializer,
     ProcessingJobCreateSerializer
 )
-from ..services.mermaid_service import MermaidService
-import random
+from ..graph import graph_for, get_layout, stored_layout, parse_mermaid, to_reactflow, diff_graphs, analyze
+from ..tasks import enqueue_visualization
+import uuid
 
-class VisualizationRequestViewSet(viewsets.ModelViewSet):
+MAX_STATUS_IDS = 100
+
+class VisualizationRequestViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return VisualizationRequest.objects.filter(user=self.request.user)
+        requests = VisualizationRequest.objects.filter(user=self.request.user)
+        if self.action == 'visualization':
+            return requests.select_related('visualization', 'story')
+        return requests
 
     def get_serializer_class(self):
         if self.action == 'create':
             return VisualizationRequestCreateSerializer
         return VisualizationRequestSerializer
 
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+
+        # Generation runs in the background; clients poll the status endpoint
+        response_serializer = VisualizationRequestSerializer(serializer.instance)
+        return Response(response_serializer.data, status=status.HTTP_202_ACCEPTED)
+
     def perform_create(self, serializer):
-        # Save the request
+        # Save the request as pending and hand it to the background executor
         request_obj = serializer.save()
+        enqueue_visualization(request_obj.id)
 
-        # Auto-generate mock visualization
-        self.generate_mock_visualization(request_obj)
-
-    def generate_mock_visualization(self, request_obj):
-        """Generate a visualization based on the request type"""
-        viz_type = request_obj.visualization_type
-        story = request_obj.story
-
-        # Generate AI-powered Mermaid flowchart
-        if viz_type == 'flowchart':
-            try:
-                # Use Mermaid service to generate AI-powered flowchart
-                mermaid_service = MermaidService()
-                data = mermaid_service.generate_story_flowchart_data(story)
-            except Exception as e:
-                # Fallback to generic flowchart if AI generation fails
-                print(f"Mermaid generation failed: {e}")
-                data = {
-                    'type': 'flowchart',
-                    'title': f'Story Flow: {story.title}',
-                    'mermaid_code': f'''flowchart TD
-    A((Start)) --> B["{story.title}"]
-    B --> C[Character Introduction]
-    C --> D{{Conflict Arises?}}
-    D -->|Yes| E[Rising Action]
-    E --> F[Climax]
-    F --> G[Resolution]
-    G --> H((End))
-    D -->|No| I[Character Development]
-    I --> D''',
-                    'description': f'Basic flowchart structure for "{story.title}"',
-                    'metadata': {
-                        'generated_by': 'Fallback Template',
-                        'story_id': str(story.id),
-                        'story_title': story.title
-                    }
-                }
-        else:
-            # For any other type, default to flowchart
-            data = {
-                'type': 'flowchart',
-                'title': f'Story Flow: {story.title}',
-                'steps': [
-                    {
-                        'type': 'start',
-                        'title': 'Beginning',
-                        'description': 'Story setup and character introduction'
-                    },
-                    {
-                        'type': 'conflict',
-                        'title': 'Middle',
-                        'description': 'Conflict development and rising action'
-                    },
-                    {
-                        'type': 'end',
-                        'title': 'End',
-                        'description': 'Resolution and conclusion'
-                    }
-                ],
-                'themes': ['Narrative', 'Structure', 'Flow']
-            }
-
-        # Update request status
-        request_obj.status = 'completed'
-        request_obj.save()
+    @action(detail=False, methods=['get'], url_path='status')
+    def batch_status(self, request):
+        """Return the status of many requests in a single query: ?ids=<uuid>,<uuid>"""
+        raw_ids = [i for i in request.query_params.get('ids', '').split(',') if i]
+        if not raw_ids:
+            return Response(
+                {'error': 'ids query parameter is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        if len(raw_ids) > MAX_STATUS_IDS:
+            return Response(
+                {'error': f'At most {MAX_STATUS_IDS} ids may be requested at once'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            ids = [uuid.UUID(i) for i in raw_ids]
+        except ValueError:
+            return Response(
+                {'error': 'ids must be a comma-separated list of UUIDs'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
 
-        # Create the generated visualization
-        GeneratedVisualization.objects.create(
-            request=request_obj,
-            title=data['title'],
-            description=f'Auto-generated {viz_type} visualization',
-            data=data
+        rows = self.get_queryset().filter(id__in=ids).values(
+            'id', 'status', 'error_message', 'updated_at', 'visualization__id'
         )
+        results = [
+            {
+                'id': row['id'],
+                'status': row['status'],
+                'error_message': row['error_message'],
+                'updated_at': row['updated_at'],
+                'visualization_id': row['visualization__id'],
+            }
+            for row in rows
+        ]
+        return Response({'results': results})
 
     @action(detail=True, methods=['get'])
     def visualization(self, request, pk=None):
         visualization_request = self.get_object()
         try:
             visualization = visualization_request.visualization
-            serializer = GeneratedVisualizationSerializer(visualization)
+            serializer = GeneratedVisualizationSerializer(
+                visualization, context=self.get_serializer_context()
+            )
             return Response(serializer.data)
         except GeneratedVisualization.DoesNotExist:
             return Response(
@@ -113,20 +95,109 @@ class VisualizationRequestViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_404_NOT_FOUND
             )
 
-class GeneratedVisualizationViewSet(viewsets.ReadOnlyModelViewSet):
+class GeneratedVisualizationViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
     serializer_class = GeneratedVisualizationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    # Saving a visualization (e.g. a layout edit) touches its request
+    last_modified_fields = ('created_at', 'request__updated_at', 'request__story__updated_at')
 
     def get_queryset(self):
+        # request_info reads the request and its story for every row
         return GeneratedVisualization.objects.filter(
             request__user=self.request.user
-        )
+        ).select_related('request__story').order_by('-created_at')
+
+    @action(detail=True, methods=['get', 'post'])
+    def layout(self, request, pk=None):
+        """
+        Positioned ReactFlow nodes and edges for a flowchart visualization.
+        POST an edited ``mermaid_code`` to lay it out around the stored version
+        (unchanged nodes keep their positions); ``save: true`` stores the edit.
+        """
+        visualization = self.get_object()
+        graph = graph_for(visualization.data)
+        if graph is None:
+            return Response(
+                {'error': 'Visualization has no flowchart to lay out'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        # The layout it was last shown with, so edits keep those positions
+        shown = stored_layout(visualization.data, graph)
+        if request.method == 'GET':
+            return Response(to_reactflow(graph, shown))
+
+        mermaid_code = request.data.get('mermaid_code', '')
+        if not mermaid_code:
+            return Response(
+                {'error': 'mermaid_code is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        edited = parse_mermaid(mermaid_code)
+        layout = get_layout(edited, previous=graph, previous_layout=shown)
+        payload = to_reactflow(edited, layout)
+        if request.data.get('save'):
+            visualization.data = {
+                **visualization.data, 'mermaid_code': mermaid_code, 'graph': edited, 'layout': layout
+            }
+            visualization.save(update_fields=['data'])
+        return Response(payload)
+
+    @action(detail=True, methods=['get'])
+    def diff(self, request, pk=None):
+        """
+        Patch from another version of this flowchart (``?against=<id>``, e.g. an
+        earlier alternative) to this one, for applying changes without redrawing.
+        """
+        visualization = self.get_object()
+        against_id = request.query_params.get('against')
+        if not against_id:
+            return Response(
+                {'error': 'against is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            uuid.UUID(against_id)
+        except ValueError:
+            return Response(
+                {'error': 'against must be a visualization ID'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        against = get_object_or_404(self.get_queryset(), id=against_id)
+        old_graph, new_graph = graph_for(against.data), graph_for(visualization.data)
+        if old_graph is None or new_graph is None:
+            return Response(
+                {'error': 'Both visualizations must be flowcharts'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(diff_graphs(old_graph, new_graph))
+
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, pk=None):
+        """
+        Branching-narrative statistics of a flowchart: endings with playthrough
+        counts and shortest/longest routes, unreachable nodes and loops.
+        ``?start=<node id>`` overrides the detected start node.
+        """
+        visualization = self.get_object()
+        graph = graph_for(visualization.data)
+        if graph is None:
+            return Response(
+                {'error': 'Visualization has no flowchart to analyze'},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        start = request.query_params.get('start')
+        if start is not None and not any(node['id'] == start for node in graph['nodes']):
+            return Response(
+                {'error': 'start is not a node of this flowchart'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(analyze(graph, start=start))
 
 class ProcessingJobViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        return ProcessingJob.objects.filter(user=self.request.user)
+        return ProcessingJob.objects.filter(user=self.request.user).select_related('story')
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -4,7 +4,11 @@ from rest_framework.response import Response
 from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from story.models import Story
+from ..graph import parse_mermaid, get_layout, to_reactflow, diff_graphs
+from ..serializers import wants_graph
 from ..services.mermaid_service import MermaidService
+from ..services.resilience import get_gemini_guard
+from ..services.scheduler import get_scheduler
 import json
 import os
 
@@ -12,28 +16,37 @@ import os
 @permission_classes([permissions.IsAuthenticated])
 def generate_mermaid_from_story(request, story_id):
     """
-    Generate Mermaid flowchart from a specific story
+    Generate Mermaid flowchart from a specific story, chapter by chapter
+    (``mode='chapters'``) or from its whole content (``mode='story'``)
     """
     try:
+        mode = request.data.get('mode')
+        if mode not in (None, 'story', 'chapters'):
+            return Response(
+                {'success': False, 'error': "mode must be 'story' or 'chapters'"},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
         # Get the story
         story = get_object_or_404(Story, id=story_id, user=request.user)
 
         # Initialize Mermaid service
-        mermaid_service = MermaidService()
+        mermaid_service = MermaidService(user_key=request.user.id)
 
         # Generate Mermaid code
-        mermaid_code = mermaid_service.generate_mermaid_from_story(
-            story.content,
-            story.title
-        )
+        mermaid_code, generation = mermaid_service.generate_story_mermaid(story, mode=mode)
 
-        return Response({
+        data = {
             'success': True,
             'story_id': str(story.id),
             'story_title': story.title,
             'mermaid_code': mermaid_code,
-            'message': 'Mermaid flowchart generated successfully'
-        })
+            'message': 'Mermaid flowchart generated successfully',
+            **generation
+        }
+        if wants_graph(request):
+            data['graph'] = parse_mermaid(mermaid_code)
+        return Response(data)
 
     except Story.DoesNotExist:
         return Response(
@@ -71,18 +84,21 @@ def generate_mermaid_from_description(request):
             )
 
         # Initialize Mermaid service
-        mermaid_service = MermaidService()
+        mermaid_service = MermaidService(user_key=request.user.id)
 
         # Generate specific flowchart based on type
         mermaid_code = mermaid_service.generate_mermaid_from_description(description, flowchart_type)
 
-        return Response({
+        data = {
             'success': True,
             'description': description,
             'flowchart_type': flowchart_type,
             'mermaid_code': mermaid_code,
             'message': f'Mermaid flowchart generated successfully for {flowchart_type}'
-        })
+        }
+        if wants_graph(request):
+            data['graph'] = parse_mermaid(mermaid_code)
+        return Response(data)
 
     except Exception as e:
         return Response(
@@ -103,16 +119,13 @@ def generate_mermaid_svg(request):
         story_id = request.data.get('story_id', None)
 
         # Initialize Mermaid service
-        mermaid_service = MermaidService()
+        mermaid_service = MermaidService(user_key=request.user.id)
 
         # If no mermaid_code provided, generate from description or story
         if not mermaid_code:
             if story_id:
                 story = get_object_or_404(Story, id=story_id, user=request.user)
-                mermaid_code = mermaid_service.generate_mermaid_from_story(
-                    story.content,
-                    story.title
-                )
+                mermaid_code, _ = mermaid_service.generate_story_mermaid(story)
             elif description:
                 mermaid_code = mermaid_service.generate_mermaid_from_description(description)
             else:
@@ -233,6 +246,10 @@ def generate_four_flowcharts(request):
             }
         }
 
+        if wants_graph(request):
+            for flowchart in flowcharts.values():
+                flowchart['graph'] = parse_mermaid(flowchart['mermaid_code'])
+
         return Response({
             'success': True,
             'flowcharts': flowcharts,
@@ -246,6 +263,41 @@ def generate_four_flowcharts(request):
             status=status.HTTP_500_INTERNAL_SERVER_ERROR
         )
 
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def layout_mermaid(request):
+    """
+    Lay out Mermaid code and return positioned ReactFlow nodes and edges.
+    With ``previous_mermaid_code``, nodes it shares with that version keep
+    their positions.
+    """
+    mermaid_code = request.data.get('mermaid_code', '')
+    if not mermaid_code:
+        return Response(
+            {'success': False, 'error': 'mermaid_code is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    previous_code = request.data.get('previous_mermaid_code')
+    previous = parse_mermaid(previous_code) if previous_code else None
+    graph = parse_mermaid(mermaid_code)
+    return Response(to_reactflow(graph, get_layout(graph, previous=previous)))
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def diff_mermaid(request):
+    """
+    Structural diff between two versions of a flowchart: nodes and edges
+    added, removed and changed from ``old_mermaid_code`` to ``new_mermaid_code``.
+    """
+    old_code = request.data.get('old_mermaid_code', '')
+    new_code = request.data.get('new_mermaid_code', '')
+    if not old_code or not new_code:
+        return Response(
+            {'success': False, 'error': 'old_mermaid_code and new_mermaid_code are required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(diff_graphs(parse_mermaid(old_code), parse_mermaid(new_code)))
+
 @api_view(['GET'])
 @permission_classes([permissions.AllowAny])  # Allow anonymous access for health check
 def mermaid_health_check(request):
@@ -253,7 +305,7 @@ def mermaid_health_check(request):
     Check if Mermaid service is properly configured
     """
     try:
-        mermaid_service = MermaidService()
+        mermaid_service = MermaidService(user_key=request.user.id)
         models = mermaid_service.get_available_models()
         selected_model = mermaid_service.pick_text_model(models)
 
@@ -262,6 +314,8 @@ def mermaid_health_check(request):
             'gemini_api_configured': bool(mermaid_service.api_key),
             'available_models_count': len(models),
             'selected_model': selected_model,
+            'scheduler': get_scheduler().snapshot(),
+            'resilience': get_gemini_guard().snapshot(),
             'message': 'Mermaid service is healthy'
         })
 
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('interview', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='interview',
+            index=models.Index(fields=['-created_at', '-id'], name='interview_created_idx'),
+        ),
+    ]
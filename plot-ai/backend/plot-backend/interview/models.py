@@ -14,6 +14,7 @@ class Interview(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [models.Index(fields=['-created_at', '-id'], name='interview_created_idx')]
 
     def __str__(self):
         return f"Interview: {self.title} ({self.story.title})"
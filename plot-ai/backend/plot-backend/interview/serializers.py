@@ -26,9 +26,14 @@ class InterviewListSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
     def get_questions_count(self, obj):
+        # Annotated by InterviewViewSet.get_queryset for lists
+        if hasattr(obj, 'questions_count'):
+            return obj.questions_count
         return obj.questions.count()
 
     def get_responses_count(self, obj):
+        if hasattr(obj, 'responses_count'):
+            return obj.responses_count
         return Response.objects.filter(question__interview=obj).count()
 
 class InterviewDetailSerializer(serializers.ModelSerializer):
@@ -0,0 +1,38 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from plot.caching import invalidate_user, touch
+
+from .models import Interview, Question, Response
+
+
+def _owner(interview_id):
+    return Interview.objects.filter(pk=interview_id).values_list('story__user_id', flat=True).first()
+
+
+@receiver(post_save, sender=Interview)
+@receiver(post_delete, sender=Interview)
+def interview_changed(sender, instance, origin=None, **kwargs):
+    # Interviews deleted along with their story are covered by its own signal
+    if origin is not None and getattr(origin, 'model', type(origin)) is not Interview:
+        return
+    invalidate_user(instance.story.user_id)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, origin=None, **kwargs):
+    if origin is not None and getattr(origin, 'model', type(origin)) is not Question:
+        return
+    touch(Interview, instance.interview_id)
+    invalidate_user(_owner(instance.interview_id))
+
+
+@receiver(post_save, sender=Response)
+@receiver(post_delete, sender=Response)
+def response_changed(sender, instance, origin=None, **kwargs):
+    if origin is not None and getattr(origin, 'model', type(origin)) is not Response:
+        return
+    question = Question.objects.filter(pk=instance.question_id).values_list('interview_id', flat=True).first()
+    touch(Interview, question)
+    invalidate_user(_owner(question))
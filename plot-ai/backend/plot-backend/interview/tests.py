@@ -1,3 +1,42 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from rest_framework.test import APITestCase
 
-# Create your tests here.
+from plot.testing import QueryBudgetMixin
+from story.models import Story
+from .models import Interview, Question, Response
+
+
+class InterviewQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+        self.story = Story.objects.create(user=self.user, title='Story', content='...')
+
+    def add_interview(self, i):
+        interview = Interview.objects.create(story=self.story, title=f'Interview {i}')
+        for order in range(1, 3):
+            question = Question.objects.create(interview=interview, text='Why?', order=order)
+            Response.objects.create(question=question, user=self.user, answer='Because')
+
+    def test_interview_list(self):
+        # validators (with the row count) + interviews with annotated counts
+        self.assertQueryBudget('/api/interviews/', 2, self.add_interview)
+
+    def test_interview_detail(self):
+        interview = Interview.objects.create(story=self.story, title='Interview')
+
+        def add_question(i):
+            Question.objects.create(interview=interview, text=f'Question {i}', order=i)
+
+        # validators + interview + prefetched questions
+        self.assertQueryBudget(f'/api/interviews/{interview.id}/', 3, add_question)
+
+    def test_interview_responses(self):
+        interview = Interview.objects.create(story=self.story, title='Interview')
+
+        def add_response(i):
+            question = Question.objects.create(interview=interview, text=f'Question {i}', order=i)
+            Response.objects.create(question=question, user=self.user, answer='Because')
+
+        # interview + responses joined to their questions
+        self.assertQueryBudget(f'/api/interviews/{interview.id}/responses/', 2, add_response)
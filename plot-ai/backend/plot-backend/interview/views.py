@@ -1,19 +1,35 @@
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
 from rest_framework.response import Response
+from django.db.models import Count
 from django.shortcuts import get_object_or_404
+from plot.caching import ConditionalGetMixin
 from .models import Interview, Question, Response as InterviewResponse
 from .serializers import (
     InterviewListSerializer, InterviewDetailSerializer, InterviewCreateSerializer,
     QuestionSerializer, ResponseSerializer, ResponseCreateSerializer
 )
 
-class InterviewViewSet(viewsets.ModelViewSet):
+class InterviewViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
-    def get_queryset(self):
+    def get_validator_queryset(self):
+        # Question and answer changes touch the interview
         return Interview.objects.filter(story__user=self.request.user)
 
+    def get_queryset(self):
+        interviews = Interview.objects.filter(story__user=self.request.user)
+        if self.action == 'list':
+            # Counts in the list query itself instead of two COUNTs per row;
+            # aggregate queries ignore Meta.ordering, so order explicitly
+            return interviews.annotate(
+                questions_count=Count('questions', distinct=True),
+                responses_count=Count('questions__responses', distinct=True),
+            ).order_by('-created_at')
+        if self.action in ('retrieve', 'update', 'partial_update'):
+            return interviews.prefetch_related('questions')
+        return interviews
+
     def get_serializer_class(self):
         if self.action == 'list':
             return InterviewListSerializer
@@ -27,7 +43,7 @@ class InterviewViewSet(viewsets.ModelViewSet):
         responses = InterviewResponse.objects.filter(
             question__interview=interview,
             user=request.user
-        )
+        ).select_related('question')
         serializer = ResponseSerializer(responses, many=True)
         return Response(serializer.data)
 
@@ -56,6 +72,7 @@ class InterviewViewSet(viewsets.ModelViewSet):
 class QuestionViewSet(viewsets.ModelViewSet):
     serializer_class = QuestionSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('order', 'id')
 
     def get_queryset(self):
         return Question.objects.filter(interview__story__user=self.request.user)
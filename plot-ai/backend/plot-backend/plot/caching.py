@@ -0,0 +1,146 @@
+"""
+Conditional GETs and a per-user response cache for read endpoints.
+
+Viewsets using ``ConditionalGetMixin`` answer ``list`` and ``retrieve`` after
+one aggregate query over the rows the response is made of: the latest of their
+``last_modified_fields`` and (for lists) how many there are. Those values, the
+user, the full path and the negotiated media type make up the ETag, so:
+
+- a request whose ``If-None-Match`` matches (or, for a single object without
+  one, whose ``If-Modified-Since`` is no older than the object) gets a 304;
+- otherwise the serialized data is served from the cache under that ETag if it
+  is there, and serialized and stored if not.
+
+Models without a usable timestamp of their own count through a parent's:
+saving or deleting a chapter or character touches its story's ``updated_at``,
+a question or answer its interview's, a generated visualization its request's
+(see the apps' signals). Those signals also call ``invalidate_user``, which
+moves the user's cache entries to a new namespace so stale ones are never read
+again, even from a cache shared with processes that have not seen the change.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.db.models import Count, Max
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+from rest_framework import status
+from rest_framework.response import Response
+
+# Bump when the cached data's shape changes
+RESPONSE_CACHE_VERSION = 1
+
+
+def _namespace_key(user_id):
+    return f'response-cache-namespace:{user_id}'
+
+
+def user_namespace(user_id):
+    namespace = cache.get(_namespace_key(user_id))
+    if namespace is None:
+        namespace = uuid.uuid4().hex
+        # Another request may have created it first; use whichever won
+        if not cache.add(_namespace_key(user_id), namespace, None):
+            namespace = cache.get(_namespace_key(user_id), namespace)
+    return namespace
+
+
+def invalidate_user(user_id):
+    """Drop every cached response of ``user_id``"""
+    if user_id is not None:
+        cache.set(_namespace_key(user_id), uuid.uuid4().hex, None)
+
+
+def touch(model, pk):
+    """Mark a parent row as modified without sending its save signals"""
+    if pk is not None:
+        model.objects.filter(pk=pk).update(updated_at=timezone.now())
+
+
+class ConditionalGetMixin:
+    """
+    ETag/Last-Modified handling and response caching for ``list`` and
+    ``retrieve``. ``last_modified_fields`` name the timestamps (related ones
+    with ``__``) whose latest value dates a response. The validator queryset
+    must hold the same rows as the list: its count is also the one the
+    paginator reports.
+    """
+    last_modified_fields = ('updated_at',)
+    row_count = None
+
+    def get_validator_queryset(self):
+        """Rows whose timestamps date the response; by default the view's queryset"""
+        return self.filter_queryset(self.get_queryset())
+
+    def _validators(self, queryset):
+        aggregates = {f'last_{i}': Max(field) for i, field in enumerate(self.last_modified_fields)}
+        row = queryset.order_by().aggregate(count=Count('pk'), **aggregates)
+        stamps = [row[name] for name in aggregates if row[name] is not None]
+        return (max(stamps) if stamps else None), row['count']
+
+    def _etag(self, request, last_modified, count):
+        key = '|'.join([
+            str(RESPONSE_CACHE_VERSION), str(request.user.pk), request.get_full_path(),
+            request.accepted_media_type or '', last_modified.isoformat() if last_modified else '', str(count),
+        ])
+        return '"' + hashlib.sha256(key.encode('utf-8')).hexdigest()[:32] + '"'
+
+    def _conditional(self, request, respond, last_modified, count, detail):
+        etag = self._etag(request, last_modified, count)
+        headers = {'ETag': etag, 'Cache-Control': 'private, no-cache'}
+        # A Last-Modified in the current second could hide a later edit in the
+        # same second, so it is only sent once that second is over; lists
+        # don't send one at all, as deletions don't move it
+        if detail and last_modified and last_modified < timezone.now().replace(microsecond=0):
+            headers['Last-Modified'] = http_date(last_modified.timestamp())
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            not_modified = etag in [tag.strip() for tag in if_none_match.split(',')] or if_none_match.strip() == '*'
+        else:
+            since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+            not_modified = 'Last-Modified' in headers and since is not None and last_modified.timestamp() < since + 1
+        if not_modified:
+            response = Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        else:
+            key = f'response:{request.user.pk}:{user_namespace(request.user.pk)}:{etag}'
+            data = cache.get(key)
+            if data is None:
+                response = respond()
+                if response.status_code != status.HTTP_200_OK:
+                    return response
+                cache.set(key, response.data, getattr(settings, 'RESPONSE_CACHE_SECONDS', 5 * 60))
+            else:
+                response = Response(data)
+            for name, value in headers.items():
+                response[name] = value
+        patch_vary_headers(response, ('Accept', 'Authorization', 'Cookie'))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        def respond():
+            return super(ConditionalGetMixin, self).list(request, *args, **kwargs)
+
+        last_modified, count = self._validators(self.get_validator_queryset())
+        # The paginator reports this count instead of running its own COUNT
+        self.row_count = count
+        return self._conditional(request, respond, last_modified, count, detail=False)
+
+    def retrieve(self, request, *args, **kwargs):
+        def respond():
+            return super(ConditionalGetMixin, self).retrieve(request, *args, **kwargs)
+
+        lookup = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.get_validator_queryset().filter(**{self.lookup_field: kwargs[lookup]})
+            last_modified, count = self._validators(queryset)
+        except (TypeError, ValueError, ValidationError):
+            count = 0
+        if not count:
+            # Let the usual lookup produce the 404
+            return respond()
+        return self._conditional(request, respond, last_modified, count, detail=True)
@@ -0,0 +1,262 @@
+"""
+Export and import of a user's whole library as NDJSON.
+
+The export is one JSON object per line: a ``library`` header, then one
+``story`` line per story with its chapters, characters, visualizations
+(requests with their generated result) and interviews (questions with the
+user's own answers) nested inside. It is written by a generator, so only one
+chunk of ``EXPORT_CHUNK_SIZE`` stories and their related rows is in memory at
+a time whatever the size of the library: stories are read in keyset chunks
+and the rows of each related table are streamed with ``.iterator()``, in one
+query per table per chunk.
+
+The import reads the same format a line at a time and creates the rows for
+the requesting user under new IDs, with ``bulk_create`` every
+``IMPORT_CHUNK_SIZE`` stories. The whole import is one transaction, so a bad
+line leaves the library as it was. Creation times are those of the import, and
+each story's content and chapters start their revision history there.
+Visualization requests still pending or processing at export are imported as
+failed, as nothing would ever generate them.
+"""
+import json
+from collections import defaultdict
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from rest_framework.parsers import BaseParser
+from rest_framework.renderers import BaseRenderer
+
+from generation.models import VisualizationRequest, GeneratedVisualization
+from interview.models import Interview, Question, Response
+from story import search as search_index
+from story.models import Story, Chapter, Character
+from story.revisions import record_initial_revisions
+from story.screenplay import iter_lines
+
+LIBRARY_FORMAT_VERSION = 1
+EXPORT_CHUNK_SIZE = 50
+IMPORT_CHUNK_SIZE = 100
+
+STORY_FIELDS = ('title', 'description', 'content', 'is_public', 'created_at', 'updated_at')
+CHAPTER_FIELDS = ('title', 'content', 'order')
+CHARACTER_FIELDS = ('name', 'description', 'role')
+REQUEST_FIELDS = ('visualization_type', 'status', 'parameters', 'error_message', 'created_at')
+# Requests exported in these states are imported as failed
+IN_FLIGHT_STATUSES = ('pending', 'processing')
+VISUALIZATION_FIELDS = ('title', 'description', 'data', 'image_url')
+INTERVIEW_FIELDS = ('title', 'description', 'is_completed', 'created_at')
+QUESTION_FIELDS = ('text', 'question_type', 'options', 'order', 'is_required')
+TIMESTAMP_FIELDS = ('created_at', 'updated_at')
+# Bytes read from the request body at a time while importing
+READ_SIZE = 64 * 1024
+
+
+class LibraryImportError(Exception):
+    """A line of an import that isn't a valid library record"""
+
+    def __init__(self, line_number, message):
+        super().__init__(f'Line {line_number}: {message}')
+        self.line_number = line_number
+
+
+def _line(record):
+    return (json.dumps(record, cls=DjangoJSONEncoder, separators=(',', ':')) + '\n').encode('utf-8')
+
+
+def _grouped(queryset, key, fields):
+    """``{key value: [row dicts]}`` of a queryset, streamed rather than cached"""
+    groups = defaultdict(list)
+    for row in queryset.values(key, *fields).iterator():
+        groups[row.pop(key)].append(row)
+    return groups
+
+
+def _story_chunks(user):
+    last = None
+    while True:
+        stories = Story.objects.filter(user=user).order_by('id')
+        if last is not None:
+            stories = stories.filter(id__gt=last)
+        chunk = list(stories.values('id', *STORY_FIELDS)[:EXPORT_CHUNK_SIZE])
+        if not chunk:
+            return
+        last = chunk[-1]['id']
+        yield chunk
+
+
+def export_library(user):
+    """NDJSON lines (bytes) of ``user``'s library"""
+    yield _line({
+        'type': 'library',
+        'version': LIBRARY_FORMAT_VERSION,
+        'user': user.get_username(),
+        'exported_at': timezone.now(),
+    })
+    for chunk in _story_chunks(user):
+        ids = [story['id'] for story in chunk]
+        chapters = _grouped(Chapter.objects.filter(story_id__in=ids).order_by('order'), 'story_id', CHAPTER_FIELDS)
+        characters = _grouped(
+            Character.objects.filter(story_id__in=ids).order_by('name'), 'story_id', CHARACTER_FIELDS
+        )
+        requests = _grouped(
+            VisualizationRequest.objects.filter(story_id__in=ids).order_by('created_at'),
+            'story_id', ('id',) + REQUEST_FIELDS
+        )
+        visualizations = {
+            row.pop('request_id'): row
+            for row in GeneratedVisualization.objects.filter(request__story_id__in=ids)
+            .values('request_id', *VISUALIZATION_FIELDS).iterator()
+        }
+        interviews = _grouped(
+            Interview.objects.filter(story_id__in=ids).order_by('created_at'),
+            'story_id', ('id',) + INTERVIEW_FIELDS
+        )
+        questions = _grouped(
+            Question.objects.filter(interview__story_id__in=ids).order_by('order'),
+            'interview_id', ('id',) + QUESTION_FIELDS
+        )
+        answers = dict(
+            Response.objects.filter(question__interview__story_id__in=ids, user=user)
+            .values_list('question_id', 'answer').iterator()
+        )
+
+        for story in chunk:
+            story_id = story.pop('id')
+            for request in requests.get(story_id, ()):
+                request['visualization'] = visualizations.get(request.pop('id'))
+            for interview in interviews.get(story_id, ()):
+                interview['questions'] = questions.get(interview.pop('id'), [])
+                for question in interview['questions']:
+                    question['answer'] = answers.get(question.pop('id'))
+            yield _line({
+                'type': 'story',
+                **story,
+                'chapters': chapters.get(story_id, []),
+                'characters': characters.get(story_id, []),
+                'visualizations': requests.get(story_id, []),
+                'interviews': interviews.get(story_id, []),
+            })
+
+
+def _pick(record, fields, line_number):
+    """Field values of one exported object; timestamps are left to the database"""
+    if not isinstance(record, dict):
+        raise LibraryImportError(line_number, 'expected an object')
+    return {field: record[field] for field in fields if field in record and field not in TIMESTAMP_FIELDS}
+
+
+class LibraryImporter:
+    """Creates the stories of NDJSON library lines for ``user``; use ``run(lines)``"""
+
+    def __init__(self, user, chunk_size=None):
+        self.user = user
+        self.chunk_size = chunk_size or IMPORT_CHUNK_SIZE
+        self.counts = dict.fromkeys([
+            'stories', 'chapters', 'characters', 'visualization_requests',
+            'visualizations', 'interviews', 'questions', 'answers',
+        ], 0)
+        self._reset()
+
+    def _reset(self):
+        self.stories, self.chapters, self.characters = [], [], []
+        self.requests, self.visualizations = [], []
+        self.interviews, self.questions, self.answers = [], [], []
+
+    def run(self, lines):
+        with transaction.atomic():
+            for line_number, line in enumerate(lines, 1):
+                if not line.strip():
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError as e:
+                    raise LibraryImportError(line_number, f'invalid JSON ({e})')
+                if not isinstance(record, dict) or 'type' not in record:
+                    raise LibraryImportError(line_number, 'expected an object with a type')
+                if record['type'] == 'library':
+                    if record.get('version') != LIBRARY_FORMAT_VERSION:
+                        raise LibraryImportError(line_number, f"unsupported version {record.get('version')!r}")
+                elif record['type'] == 'story':
+                    self.add_story(record, line_number)
+                    if len(self.stories) >= self.chunk_size:
+                        self.flush()
+                else:
+                    raise LibraryImportError(line_number, f"unknown record type {record['type']!r}")
+            self.flush()
+        return self.counts
+
+    def add_story(self, record, line_number):
+        try:
+            story = Story(user=self.user, **_pick(record, STORY_FIELDS, line_number))
+            self.stories.append(story)
+            for chapter in record.get('chapters', []):
+                self.chapters.append(Chapter(story=story, **_pick(chapter, CHAPTER_FIELDS, line_number)))
+            for character in record.get('characters', []):
+                self.characters.append(Character(story=story, **_pick(character, CHARACTER_FIELDS, line_number)))
+            for request in record.get('visualizations', []):
+                request_obj = VisualizationRequest(
+                    story=story, user=self.user, **_pick(request, REQUEST_FIELDS, line_number)
+                )
+                if request_obj.status in IN_FLIGHT_STATUSES:
+                    # Nothing will generate it here, so don't show it as under way
+                    request_obj.status = 'failed'
+                    request_obj.error_message = 'Generation had not finished when the library was exported.'
+                self.requests.append(request_obj)
+                if request.get('visualization'):
+                    self.visualizations.append(GeneratedVisualization(
+                        request=request_obj, **_pick(request['visualization'], VISUALIZATION_FIELDS, line_number)
+                    ))
+            for interview in record.get('interviews', []):
+                interview_obj = Interview(story=story, **_pick(interview, INTERVIEW_FIELDS, line_number))
+                self.interviews.append(interview_obj)
+                for question in interview.get('questions', []):
+                    question_obj = Question(interview=interview_obj, **_pick(question, QUESTION_FIELDS, line_number))
+                    self.questions.append(question_obj)
+                    if question.get('answer') is not None:
+                        self.answers.append(Response(question=question_obj, user=self.user, answer=question['answer']))
+        except (TypeError, AttributeError) as e:
+            raise LibraryImportError(line_number, f'malformed story ({e})')
+
+    def flush(self):
+        if not self.stories:
+            return
+        # Parents before children, so every foreign key exists when it's inserted
+        for name, model, objects in (
+            ('stories', Story, self.stories),
+            ('chapters', Chapter, self.chapters),
+            ('characters', Character, self.characters),
+            ('visualization_requests', VisualizationRequest, self.requests),
+            ('visualizations', GeneratedVisualization, self.visualizations),
+            ('interviews', Interview, self.interviews),
+            ('questions', Question, self.questions),
+            ('answers', Response, self.answers),
+        ):
+            model.objects.bulk_create(objects, batch_size=500)
+            self.counts[name] += len(objects)
+        # bulk_create sends no signals, so index the searchable rows and
+        # record the texts' first revisions here
+        search_index.index_objects([*self.stories, *self.chapters, *self.characters])
+        record_initial_revisions(self.stories, self.chapters)
+        self._reset()
+
+
+class NDJSONParser(BaseParser):
+    """Hands the view the body's lines lazily instead of reading it all"""
+    media_type = 'application/x-ndjson'
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        if stream is None:
+            return iter(())
+        return iter_lines(iter(lambda: stream.read(READ_SIZE), b''))
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Lets clients asking for NDJSON pass content negotiation"""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Only used for error bodies; the export itself is streamed
+        return _line(data)
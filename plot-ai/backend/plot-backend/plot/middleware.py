@@ -1,4 +1,26 @@
+import json
+import time
+from django.conf import settings
+from django.db import connection
 from django.middleware.csrf import CsrfViewMiddleware
+from . import profiling, tracing
+from .metrics import counter, histogram
+
+HTTP_DURATION = histogram(
+    'plot_http_request_duration_seconds',
+    'Total time spent handling a request, per view',
+    ('view', 'method', 'status')
+)
+DB_DURATION = histogram(
+    'plot_db_duration_seconds',
+    'Time spent in database queries per request, per view',
+    ('view',)
+)
+DB_QUERIES = counter(
+    'plot_db_queries_total',
+    'Database queries executed, per view',
+    ('view',)
+)
 
 
 class CSRFExemptAPIMiddleware(CsrfViewMiddleware):
@@ -15,4 +37,107 @@ class CSRFExemptAPIMiddleware(CsrfViewMiddleware):
         # Skip CSRF for API endpoints
         if request.path.startswith('/api/'):
             return None
-        return super().process_view(request, callback, callback_args, callback_kwargs)
\ No newline at end of file
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return (match.view_name or match._func_path) if match else 'unresolved'
+
+
+class _QueryTimer:
+    """connection.execute_wrapper that totals query time for one request"""
+    __slots__ = ('count', 'seconds')
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.seconds += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    Records per-view request duration and database time for /metrics
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        queries = _QueryTimer()
+        started = time.perf_counter()
+        with connection.execute_wrapper(queries):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - started
+
+        view = _view_name(request)
+        HTTP_DURATION.observe(elapsed, (view, request.method, str(response.status_code)))
+        if queries.count:
+            DB_DURATION.observe(queries.seconds, (view,))
+            DB_QUERIES.inc(queries.count, (view,))
+        return response
+
+
+class TracingMiddleware:
+    """
+    Opens the root span for each request. Sending the debug header
+    (``X-Debug-Trace``; any value under DEBUG, otherwise TRACE_DEBUG_TOKEN) traces
+    the request even when tracing is off and returns the span timings in
+    ``Server-Timing`` and ``X-Trace-Breakdown`` response headers.
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def _debug_requested(self, request):
+        value = request.headers.get('X-Debug-Trace')
+        if not value:
+            return False
+        token = getattr(settings, 'TRACE_DEBUG_TOKEN', None)
+        return settings.DEBUG or (token and value == token)
+
+    def __call__(self, request):
+        debug = self._debug_requested(request)
+        parent = None
+        if debug or tracing.tracing_enabled():
+            parent = tracing.TraceContext.from_traceparent(request.headers.get('traceparent'))
+
+        with tracing.span(f'{request.method} {request.path}', parent=parent, force=debug,
+                          **{'http.method': request.method, 'http.target': request.path}) as root:
+            response = self.get_response(request)
+            if root is not None:
+                match = getattr(request, 'resolver_match', None)
+                if match is not None and match.view_name:
+                    root.name = f'{request.method} {match.view_name}'
+                root.set_attribute('http.status_code', response.status_code)
+
+        if root is not None and debug:
+            response['X-Trace-Id'] = root.trace_id
+            response['Server-Timing'] = tracing.server_timing(root)
+            response['X-Trace-Breakdown'] = json.dumps(root.breakdown(), separators=(',', ':'))
+        return response
+
+
+class ProfilingMiddleware:
+    """
+    Profiles sampled requests (PROFILING_SAMPLE_RATE, or ``X-Profile`` carrying
+    PROFILING_TOKEN) into per-endpoint aggregates served at /api/profiling/
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not profiling.should_profile(request):
+            return self.get_response(request)
+
+        response, mode = profiling.profile_call(
+            lambda: self.get_response(request),
+            lambda response: _view_name(request)
+        )
+        response['X-Profiled'] = mode
+        return response
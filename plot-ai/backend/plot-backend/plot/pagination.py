@@ -0,0 +1,147 @@
+"""
+Keyset (cursor) pagination for the API's list endpoints.
+
+Pages are cut with ``WHERE (created_at, id) < (last row)`` instead of
+``OFFSET``, so deep pages cost the same as the first one and stay stable while
+rows are added. Responses keep the page-number shape: ``next`` and
+``previous`` links carry an opaque ``?cursor=``, and ``count`` is included
+unless the client sends ``?count=false`` (the COUNT(*) is then skipped). Views
+using ``plot.caching.ConditionalGetMixin`` hand over the count their ETag
+validators took, so no second COUNT runs.
+Requests with ``?page=N`` are still served by page number for older clients.
+
+Views order by ``keyset_ordering`` (default newest first); the last field must
+be unique.
+"""
+import base64
+import json
+from functools import reduce
+from operator import or_
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+DEFAULT_KEYSET_ORDERING = ('-created_at', '-id')
+MAX_PAGE_SIZE = 100
+
+
+def _encode(values, reverse):
+    payload = json.dumps({'v': values, 'r': reverse}, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def _decode(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return list(payload['v']), bool(payload['r'])
+    except (ValueError, KeyError, TypeError):
+        raise NotFound('Invalid cursor')
+
+
+def _after(ordering, values):
+    """Rows strictly after ``values`` in ``ordering``: a row-value comparison spelled out with Q"""
+    clauses = []
+    for i, field in enumerate(ordering):
+        name = field.lstrip('-')
+        lookup = 'lt' if field.startswith('-') else 'gt'
+        equal = {ordering[j].lstrip('-'): values[j] for j in range(i)}
+        clauses.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+    return reduce(or_, clauses)
+
+
+def _flip(ordering):
+    return tuple(field[1:] if field.startswith('-') else '-' + field for field in ordering)
+
+
+class KeysetPagination(BasePagination):
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    count_query_param = 'count'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.legacy = None
+        if 'page' in request.query_params:
+            self.legacy = PageNumberPagination()
+            return self.legacy.paginate_queryset(queryset, request, view)
+
+        self.ordering = tuple(getattr(view, 'keyset_ordering', DEFAULT_KEYSET_ORDERING))
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param, 'true').lower() not in ('false', '0', 'no'):
+            # Views using ConditionalGetMixin have counted the rows already
+            self.count = getattr(view, 'row_count', None)
+            if self.count is None:
+                self.count = queryset.count()
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        values, reverse = _decode(cursor) if cursor else (None, False)
+        if values is not None and len(values) != len(self.ordering):
+            raise NotFound('Invalid cursor')
+        ordering = _flip(self.ordering) if reverse else self.ordering
+        queryset = queryset.order_by(*ordering)
+        if values is not None:
+            queryset = queryset.filter(_after(ordering, values))
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, values is not None
+        self.page = rows
+        return rows
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return api_settings.PAGE_SIZE
+        return min(max(size, 1), MAX_PAGE_SIZE)
+
+    def _position(self, row):
+        return [getattr(row, field.lstrip('-')) for field in self.ordering]
+
+    def _link(self, row, reverse):
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, _encode(self._position(row), reverse))
+
+    def get_next_link(self):
+        if not (self.has_next and self.page):
+            return None
+        return self._link(self.page[-1], False)
+
+    def get_previous_link(self):
+        if not (self.has_previous and self.page):
+            return None
+        return self._link(self.page[0], True)
+
+    def get_paginated_response(self, data):
+        if self.legacy is not None:
+            return self.legacy.get_paginated_response(data)
+        payload = {}
+        if self.count is not None:
+            payload['count'] = self.count
+        payload.update({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+        return Response(payload)
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'count': {'type': 'integer'},
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
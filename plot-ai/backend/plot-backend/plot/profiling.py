@@ -0,0 +1,229 @@
+"""
+Opt-in profiling of live requests.
+
+``ProfilingMiddleware`` profiles a random ``PROFILING_SAMPLE_RATE`` fraction of
+requests, plus any request sending ``X-Profile: <PROFILING_TOKEN>``. Profiles are
+aggregated per endpoint in this process:
+
+- ``sample`` mode (default): one shared thread snapshots the stacks of the
+  profiled request threads every ``PROFILING_INTERVAL_MS`` and counts collapsed
+  stacks, ready for flamegraph.pl, speedscope or inferno;
+- ``cprofile`` mode: deterministic cProfile stats merged per endpoint and
+  downloadable as a pstats file (``python -m pstats``, snakeviz).
+
+With the sample rate at 0 and no header, the middleware costs a settings lookup.
+"""
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import sys
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+SAMPLE = 'sample'
+CPROFILE = 'cprofile'
+
+# Distinct stacks kept per endpoint; rarer ones beyond this are folded together
+MAX_STACKS_PER_ENDPOINT = 10000
+MAX_STACK_DEPTH = 200
+
+_BASE_PATHS = sorted({os.path.abspath(p) + os.sep for p in sys.path if p}, key=len, reverse=True)
+_frame_names = {}
+
+
+def _frame_name(code):
+    name = _frame_names.get(code)
+    if name is None:
+        filename = code.co_filename
+        for base in _BASE_PATHS:
+            if filename.startswith(base):
+                filename = filename[len(base):]
+                break
+        name = _frame_names[code] = f'{code.co_name} ({filename}:{code.co_firstlineno})'
+    return name
+
+
+def collapse_stack(frame):
+    """``root;...;leaf`` for a frame, in the collapsed-stack format"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+
+class StackSampler:
+    """Periodically samples the stacks of registered threads from one background thread"""
+
+    def __init__(self):
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self, thread_id):
+        """Start sampling a thread; returns the Counter its stacks are added to"""
+        counts = Counter()
+        with self._lock:
+            self._targets[thread_id] = counts
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return counts
+
+    def stop(self, thread_id):
+        with self._lock:
+            self._targets.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            with self._lock:
+                if not self._targets:
+                    self._wake.clear()
+                    continue
+                frames = sys._current_frames()
+                for thread_id, counts in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        counts[collapse_stack(frame)] += 1
+            time.sleep(getattr(settings, 'PROFILING_INTERVAL_MS', 5) / 1000)
+
+
+class EndpointProfile:
+    __slots__ = ('requests', 'seconds', 'samples', 'stacks', 'stats')
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.samples = 0
+        self.stacks = Counter()
+        self.stats = None
+
+
+class ProfileStore:
+    """Per-endpoint aggregates of everything profiled in this process"""
+
+    def __init__(self):
+        self._profiles = {}
+        self._lock = threading.Lock()
+
+    def _get(self, endpoint):
+        profile = self._profiles.get(endpoint)
+        if profile is None:
+            profile = self._profiles[endpoint] = EndpointProfile()
+        return profile
+
+    def add_samples(self, endpoint, counts, seconds):
+        with self._lock:
+            profile = self._get(endpoint)
+            profile.requests += 1
+            profile.seconds += seconds
+            for stack, count in counts.items():
+                if stack not in profile.stacks and len(profile.stacks) >= MAX_STACKS_PER_ENDPOINT:
+                    stack = '[other stacks]'
+                profile.stacks[stack] += count
+                profile.samples += count
+
+    def add_cprofile(self, endpoint, profiler, seconds):
+        stats = pstats.Stats(profiler)
+        with self._lock:
+            profile = self._get(endpoint)
+            profile.requests += 1
+            profile.seconds += seconds
+            if profile.stats is None:
+                profile.stats = stats
+            else:
+                profile.stats.add(stats)
+
+    def summary(self):
+        with self._lock:
+            return [
+                {
+                    'endpoint': endpoint,
+                    'requests': profile.requests,
+                    'mean_ms': round(profile.seconds / profile.requests * 1000, 2),
+                    'samples': profile.samples,
+                    'has_pstats': profile.stats is not None,
+                }
+                for endpoint, profile in sorted(self._profiles.items())
+            ]
+
+    def collapsed(self, endpoint=None):
+        """Collapsed stacks for one endpoint, or for all with the endpoint as the root frame"""
+        lines = []
+        with self._lock:
+            for name, profile in self._profiles.items():
+                if endpoint is not None and name != endpoint:
+                    continue
+                prefix = '' if endpoint is not None else f'{name};'
+                lines.extend(f'{prefix}{stack} {count}' for stack, count in profile.stacks.items())
+        return '\n'.join(lines) + '\n' if lines else ''
+
+    def pstats_dump(self, endpoint):
+        """Marshalled stats in the format written by ``pstats.Stats.dump_stats``"""
+        with self._lock:
+            profile = self._profiles.get(endpoint)
+            if profile is None or profile.stats is None:
+                return None
+            return marshal.dumps(profile.stats.stats)
+
+    def reset(self):
+        with self._lock:
+            self._profiles.clear()
+
+
+sampler = StackSampler()
+profiles = ProfileStore()
+_cprofile_lock = threading.Lock()
+
+
+def profiling_mode():
+    return getattr(settings, 'PROFILING_MODE', SAMPLE)
+
+
+def should_profile(request):
+    token = getattr(settings, 'PROFILING_TOKEN', None)
+    if token and request.headers.get('X-Profile') == token:
+        return True
+    rate = getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0)
+    return rate > 0 and random.random() < rate
+
+
+def profile_call(func, endpoint_of):
+    """
+    Run ``func()`` under the configured profiler and file the result under
+    ``endpoint_of(result)``. Returns ``(result, mode)``.
+    """
+    # cProfile allows a single active profiler per process on Python 3.12+,
+    # so concurrent profiled requests fall back to the sampler
+    if profiling_mode() == CPROFILE and _cprofile_lock.acquire(blocking=False):
+        profiler = cProfile.Profile()
+        started = time.perf_counter()
+        try:
+            profiler.enable()
+            try:
+                result = func()
+            finally:
+                profiler.disable()
+        finally:
+            _cprofile_lock.release()
+        profiles.add_cprofile(endpoint_of(result), profiler, time.perf_counter() - started)
+        return result, CPROFILE
+
+    thread_id = threading.get_ident()
+    counts = sampler.start(thread_id)
+    started = time.perf_counter()
+    try:
+        result = func()
+    finally:
+        sampler.stop(thread_id)
+    profiles.add_samples(endpoint_of(result), counts, time.perf_counter() - started)
+    return result, SAMPLE
@@ -57,6 +57,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'plot.middleware.TracingMiddleware',
+    'plot.middleware.MetricsMiddleware',
+    'plot.middleware.ProfilingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -160,8 +163,11 @@ REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
         'rest_framework.renderers.JSONRenderer',
     ],
-    'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
-    'PAGE_SIZE': 20
+    # Keyset pages on (created_at, id); ?count=false skips the total, ?page=N still works
+    'DEFAULT_PAGINATION_CLASS': 'plot.pagination.KeysetPagination',
+    'PAGE_SIZE': 20,
+    # ?format= selects payload shapes (e.g. format=graph), not renderers
+    'URL_FORMAT_OVERRIDE': None,
 }
 
 
@@ -188,3 +194,82 @@ CORS_ALLOWED_ORIGINS = [
 ]
 
 CORS_ALLOW_CREDENTIALS = True
+
+# Background generation
+GENERATION_WORKERS = int(os.environ.get('GENERATION_WORKERS', 4))
+# Processing requests not updated for this long count as interrupted (see
+# the recover_visualizations command)
+GENERATION_STALE_SECONDS = int(os.environ.get('GENERATION_STALE_SECONDS', 30 * 60))
+
+# Gemini admission control: concurrent upstream calls allowed, and how long a
+# call may wait in line (for a slot and its rate-limit token) before failing
+GEMINI_MAX_CONCURRENCY = int(os.environ.get('GEMINI_MAX_CONCURRENCY', 4))
+GEMINI_QUEUE_TIMEOUT = float(os.environ.get('GEMINI_QUEUE_TIMEOUT', 60))
+
+# Gemini client-side protection: token bucket sized to the API quota, retries
+# with jittered exponential backoff, and a circuit breaker
+GEMINI_REQUESTS_PER_MINUTE = int(os.environ.get('GEMINI_REQUESTS_PER_MINUTE', 60))
+GEMINI_BURST = int(os.environ.get('GEMINI_BURST', 10))
+GEMINI_MAX_RETRIES = int(os.environ.get('GEMINI_MAX_RETRIES', 3))
+GEMINI_BACKOFF_BASE = float(os.environ.get('GEMINI_BACKOFF_BASE', 0.5))
+GEMINI_BACKOFF_MAX = float(os.environ.get('GEMINI_BACKOFF_MAX', 20))
+GEMINI_BREAKER_THRESHOLD = int(os.environ.get('GEMINI_BREAKER_THRESHOLD', 5))
+GEMINI_BREAKER_RESET = float(os.environ.get('GEMINI_BREAKER_RESET', 30))
+GEMINI_MODELS_CACHE_SECONDS = int(os.environ.get('GEMINI_MODELS_CACHE_SECONDS', 300))
+
+# Character journeys in multi-flowchart generation: 'llm' (one Gemini call per
+# character) or 'local' (projected from the ensemble flowchart)
+CHARACTER_FLOWCHART_MODE = os.environ.get('CHARACTER_FLOWCHART_MODE', 'llm')
+
+# Story flowcharts: 'chapters' (one cached fragment per chapter, generated in
+# parallel and merged) or 'story' (the whole text in one prompt). Stories
+# without chapters always use the whole text.
+STORY_FLOWCHART_MODE = os.environ.get('STORY_FLOWCHART_MODE', 'chapters')
+CHAPTER_FLOWCHART_WORKERS = int(os.environ.get('CHAPTER_FLOWCHART_WORKERS', 4))
+# How long chapter fragments stay cached (keyed by a hash of the chapter's text)
+CHAPTER_FLOWCHART_CACHE_SECONDS = int(os.environ.get('CHAPTER_FLOWCHART_CACHE_SECONDS', 7 * 24 * 60 * 60))
+
+# Estimated tokens of story text allowed into a prompt, and the compaction
+# strategies applied in order to longer text (see generation/services/prompting.py)
+PROMPT_CONTENT_TOKEN_BUDGET = int(os.environ.get('PROMPT_CONTENT_TOKEN_BUDGET', 8000))
+PROMPT_COMPACTION_STRATEGIES = os.environ.get(
+    'PROMPT_COMPACTION_STRATEGIES', 'whitespace,dialogue,summarize,truncate'
+).split(',')
+PROMPT_COMPACTION_CACHE_SECONDS = int(os.environ.get('PROMPT_COMPACTION_CACHE_SECONDS', 24 * 60 * 60))
+
+# Gemini endpoint; point at `python manage.py run_fake_gemini` for offline runs
+GEMINI_API_BASE = os.environ.get('GEMINI_API_BASE', 'https://generativelanguage.googleapis.com')
+
+# How long computed flowchart layouts stay in the cache (keyed by graph structure)
+LAYOUT_CACHE_SECONDS = int(os.environ.get('LAYOUT_CACHE_SECONDS', 24 * 60 * 60))
+# Share of nodes and edges an edit may add, remove or rewire before the whole
+# flowchart is laid out again instead of placing only the new nodes
+LAYOUT_DISRUPTION_THRESHOLD = float(os.environ.get('LAYOUT_DISRUPTION_THRESHOLD', 0.25))
+
+# Full-text search backend class (dotted path); by default chosen from the
+# database: SQLite FTS5, PostgreSQL tsvector, or substring matching elsewhere
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND')
+
+# How long serialized read responses stay in the per-user cache (plot.caching);
+# entries are also dropped as soon as the user's data changes
+RESPONSE_CACHE_SECONDS = int(os.environ.get('RESPONSE_CACHE_SECONDS', 5 * 60))
+
+# Optional bearer token required to scrape /metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Request tracing: record span trees for every request, and where to export them
+# (JSON lines file and/or OTLP/HTTP JSON collector, e.g. http://localhost:4318/v1/traces)
+TRACING_ENABLED = os.environ.get('TRACING_ENABLED', 'false').lower() == 'true'
+TRACE_EXPORT_PATH = os.environ.get('TRACE_EXPORT_PATH')
+TRACE_OTLP_ENDPOINT = os.environ.get('TRACE_OTLP_ENDPOINT')
+TRACE_SERVICE_NAME = os.environ.get('TRACE_SERVICE_NAME', 'plot-backend')
+# Value of X-Debug-Trace that returns span timings in the response outside DEBUG
+TRACE_DEBUG_TOKEN = os.environ.get('TRACE_DEBUG_TOKEN')
+
+# Profiling of live requests: fraction of requests to profile, a token that
+# profiles any request sending it as X-Profile, and 'sample' (stack sampler,
+# collapsed stacks) or 'cprofile' (pstats) mode
+PROFILING_SAMPLE_RATE = float(os.environ.get('PROFILING_SAMPLE_RATE', '0'))
+PROFILING_TOKEN = os.environ.get('PROFILING_TOKEN')
+PROFILING_MODE = os.environ.get('PROFILING_MODE', 'sample')
+PROFILING_INTERVAL_MS = float(os.environ.get('PROFILING_INTERVAL_MS', '5'))
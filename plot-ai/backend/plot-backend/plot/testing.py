@@ -0,0 +1,39 @@
+"""
+Test helpers shared by the apps' test suites.
+"""
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+class QueryBudgetMixin:
+    """
+    Asserts that an endpoint runs a fixed number of queries however many rows
+    it returns, so N+1 regressions (a query per serialized row) fail the build.
+    Use with an APITestCase whose client is already authenticated.
+    """
+
+    def assertQueryBudget(self, url, budget, add_row, sizes=(1, 5, 20)):
+        """
+        GET ``url`` after growing the data set to each of ``sizes`` rows with
+        ``add_row(i)``; every request must use at most ``budget`` queries and
+        the same number as the others.
+        """
+        created = 0
+        counts = {}
+        for size in sizes:
+            while created < size:
+                add_row(created)
+                created += 1
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200, response.content[:500])
+            counts[size] = len(queries)
+            self.assertLessEqual(
+                len(queries), budget,
+                f"{url} ran {len(queries)} queries for {size} rows (budget {budget}):\n"
+                + '\n'.join(query['sql'] for query in queries.captured_queries)
+            )
+        self.assertEqual(
+            len(set(counts.values())), 1,
+            f"{url} query count grows with rows: {counts}"
+        )
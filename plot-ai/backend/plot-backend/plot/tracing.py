@@ -0,0 +1,250 @@
+"""
+Lightweight request-scoped tracing.
+
+``TracingMiddleware`` opens a root span per request; ``span(name)`` opens a child
+of whatever span is current (tracked in a context variable, so it follows the
+request through middleware, views, services and upstream calls). Work handed to
+background threads carries ``current_context()`` along and continues the same
+trace via ``span(name, parent=context)``.
+
+When a locally-rooted span finishes, its whole subtree is exported to a JSON
+lines file (``TRACE_EXPORT_PATH``) and/or an OTLP/HTTP JSON collector
+(``TRACE_OTLP_ENDPOINT``) on a background thread. With tracing disabled and no
+debug header on the request, ``span()`` is a context-variable lookup and nothing
+else.
+"""
+import contextvars
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_current_span = contextvars.ContextVar('plot_current_span', default=None)
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$')
+
+
+def _new_id(nbytes):
+    return os.urandom(nbytes).hex()
+
+
+class Span:
+    __slots__ = ('trace_id', 'span_id', 'parent_id', 'name', 'attributes', 'children',
+                 'start_time', '_start', 'duration', 'error', 'local_root')
+
+    def __init__(self, name, trace_id, parent_id=None, attributes=None, local_root=False):
+        self.trace_id = trace_id
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = dict(attributes or {})
+        self.children = []
+        self.start_time = time.time()
+        self._start = time.perf_counter()
+        self.duration = None
+        self.error = None
+        self.local_root = local_root
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+
+    def walk(self):
+        """This span and all its descendants, depth first"""
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'name': self.name,
+            'start_time': self.start_time,
+            'duration_ms': round(self.duration * 1000, 3) if self.duration is not None else None,
+            'attributes': self.attributes,
+            'error': self.error,
+        }
+
+    def breakdown(self):
+        """Nested ``{name, ms, children}`` timing tree for debug responses"""
+        return {
+            'name': self.name,
+            'ms': round((self.duration or 0) * 1000, 2),
+            'children': [child.breakdown() for child in self.children],
+        }
+
+
+class TraceContext:
+    """The part of a span that crosses thread or process boundaries"""
+    __slots__ = ('trace_id', 'span_id')
+
+    def __init__(self, trace_id, span_id):
+        self.trace_id = trace_id
+        self.span_id = span_id
+
+    @classmethod
+    def from_traceparent(cls, header):
+        match = TRACEPARENT_RE.match(header or '')
+        return cls(match.group(1), match.group(2)) if match else None
+
+    def traceparent(self):
+        return f'00-{self.trace_id}-{self.span_id}-01'
+
+
+def tracing_enabled():
+    return getattr(settings, 'TRACING_ENABLED', False)
+
+
+def current_span():
+    return _current_span.get()
+
+
+def current_context():
+    """Context to hand to background work so it joins the current trace"""
+    active = _current_span.get()
+    return TraceContext(active.trace_id, active.span_id) if active is not None else None
+
+
+@contextmanager
+def span(name, parent=None, force=False, **attributes):
+    """
+    Time a block as a span. Nests under the current span; with no current span
+    it starts a new local root (continuing ``parent`` if given) when tracing is
+    enabled or ``force`` is set, and is a no-op otherwise.
+    """
+    active = _current_span.get()
+    if active is not None:
+        node = Span(name, active.trace_id, active.span_id, attributes)
+        active.children.append(node)
+    elif parent is not None or force or tracing_enabled():
+        node = Span(
+            name,
+            parent.trace_id if parent is not None else _new_id(16),
+            parent.span_id if parent is not None else None,
+            attributes,
+            local_root=True,
+        )
+    else:
+        yield None
+        return
+
+    token = _current_span.set(node)
+    try:
+        yield node
+    except BaseException as e:
+        node.error = f'{type(e).__name__}: {e}'
+        raise
+    finally:
+        node.finish()
+        _current_span.reset(token)
+        if node.local_root:
+            exporter.export(node)
+
+
+def server_timing(root, limit=20):
+    """Server-Timing header value: total plus time per span name below the root"""
+    totals = {}
+    for node in root.walk():
+        if node is not root:
+            totals[node.name] = totals.get(node.name, 0.0) + (node.duration or 0.0)
+    entries = [f'total;dur={(root.duration or 0) * 1000:.1f}']
+    for name, seconds in sorted(totals.items(), key=lambda item: -item[1])[:limit]:
+        token = re.sub(r'[^A-Za-z0-9_.-]', '_', name)
+        entries.append(f'{token};dur={seconds * 1000:.1f}')
+    return ', '.join(entries)
+
+
+def to_otlp(root):
+    """Encode a span tree as an OTLP/HTTP JSON ExportTraceServiceRequest"""
+    def attribute(key, value):
+        if isinstance(value, bool):
+            return {'key': key, 'value': {'boolValue': value}}
+        if isinstance(value, int):
+            return {'key': key, 'value': {'intValue': str(value)}}
+        if isinstance(value, float):
+            return {'key': key, 'value': {'doubleValue': value}}
+        return {'key': key, 'value': {'stringValue': str(value)}}
+
+    spans = []
+    for node in root.walk():
+        start_ns = int(node.start_time * 1e9)
+        encoded = {
+            'traceId': node.trace_id,
+            'spanId': node.span_id,
+            'name': node.name,
+            'kind': 2 if node.local_root else 1,
+            'startTimeUnixNano': str(start_ns),
+            'endTimeUnixNano': str(start_ns + int((node.duration or 0) * 1e9)),
+            'attributes': [attribute(k, v) for k, v in node.attributes.items()],
+            'status': {'code': 2, 'message': node.error} if node.error else {'code': 1},
+        }
+        if node.parent_id:
+            encoded['parentSpanId'] = node.parent_id
+        spans.append(encoded)
+
+    return {'resourceSpans': [{
+        'resource': {'attributes': [attribute('service.name', getattr(settings, 'TRACE_SERVICE_NAME', 'plot-backend'))]},
+        'scopeSpans': [{'scope': {'name': 'plot.tracing'}, 'spans': spans}],
+    }]}
+
+
+class Exporter:
+    """Ships finished span trees off the request thread"""
+
+    def __init__(self, max_queue=1000):
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._lock = threading.Lock()
+        self.dropped = 0
+
+    def _targets(self):
+        return getattr(settings, 'TRACE_EXPORT_PATH', None), getattr(settings, 'TRACE_OTLP_ENDPOINT', None)
+
+    def export(self, root):
+        path, endpoint = self._targets()
+        if not path and not endpoint:
+            return
+        self._ensure_worker()
+        try:
+            self._queue.put_nowait(root)
+        except queue.Full:
+            self.dropped += 1
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='trace-exporter', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            root = self._queue.get()
+            path, endpoint = self._targets()
+            try:
+                if path:
+                    with open(path, 'a') as f:
+                        for node in root.walk():
+                            f.write(json.dumps(node.to_dict(), default=str) + '\n')
+                if endpoint:
+                    requests.post(endpoint, json=to_otlp(root), timeout=5)
+            except Exception as e:
+                logger.warning(f"Failed to export trace {root.trace_id}: {e}")
+
+
+exporter = Exporter()
@@ -20,10 +20,14 @@ from . import views
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', views.metrics_view, name='metrics'),
+    path('api/profiling/', views.profiling_view, name='profiling'),
     path('api/auth/', include('rest_framework.urls')),
     path('api/auth/login/', views.LoginAPIView.as_view(), name='api_login'),
     path('api/auth/logout/', views.LogoutAPIView.as_view(), name='api_logout'),
     path('api/auth/user/', views.UserAPIView.as_view(), name='api_user'),
+    path('api/library/export/', views.library_export_view, name='library_export'),
+    path('api/library/import/', views.library_import_view, name='library_import'),
     path('api/audio/transcribe/', views.AudioTranscriptionView.as_view(), name='audio_transcribe'),
     path('api/', include('story.urls')),
     path('api/', include('interview.urls')),
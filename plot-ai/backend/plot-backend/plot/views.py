@@ -8,6 +8,9 @@ from typing import Optional, Tuple
 from django.conf import settings
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
+from django.db import DataError, IntegrityError
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils import timezone
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
 
@@ -17,12 +20,19 @@ from google.generativeai import types as genai_types
 from pydub import AudioSegment
 from rest_framework import status
 from rest_framework.authtoken.models import Token
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import api_view, parser_classes, permission_classes, renderer_classes
 from rest_framework.parsers import FormParser, MultiPartParser
-from rest_framework.permissions import AllowAny, IsAuthenticated
+from rest_framework.permissions import AllowAny, IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from story.screenplay import iter_lines
+
+from .library import LibraryImporter, LibraryImportError, NDJSONParser, NDJSONRenderer, export_library
+from .metrics import registry
+from .profiling import profiles, profiling_mode
+
 logger = logging.getLogger(__name__)
 
 load_dotenv()
@@ -250,3 +260,94 @@ class UserAPIView(APIView):
             'username': request.user.username,
             'email': request.user.email,
         })
+
+
+def metrics_view(request):
+    """Prometheus scrape endpoint"""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=401)
+    return HttpResponse(
+        registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def profiling_view(request):
+    """
+    Staff-only access to request profiles. GET lists profiled endpoints;
+    ``?download=collapsed`` (optionally with ``&endpoint=``) returns collapsed
+    stacks for flame graphs, ``?download=pstats&endpoint=`` a pstats file.
+    DELETE discards everything collected so far.
+    """
+    if request.method == 'DELETE':
+        profiles.reset()
+        return Response({'success': True})
+
+    download = request.query_params.get('download')
+    endpoint = request.query_params.get('endpoint')
+    if not download:
+        return Response({
+            'mode': profiling_mode(),
+            'sample_rate': getattr(settings, 'PROFILING_SAMPLE_RATE', 0.0),
+            'endpoints': profiles.summary(),
+        })
+
+    filename = (endpoint or 'all').replace(':', '_')
+    if download == 'collapsed':
+        response = HttpResponse(profiles.collapsed(endpoint), content_type='text/plain; charset=utf-8')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.collapsed.txt"'
+        return response
+    if download == 'pstats':
+        if not endpoint:
+            return Response({'success': False, 'error': 'endpoint is required for pstats downloads'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        data = profiles.pstats_dump(endpoint)
+        if data is None:
+            return Response({'success': False, 'error': 'No pstats collected for this endpoint'},
+                            status=status.HTTP_404_NOT_FOUND)
+        response = HttpResponse(data, content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="{filename}.pstats"'
+        return response
+    return Response({'success': False, 'error': 'download must be collapsed or pstats'},
+                    status=status.HTTP_400_BAD_REQUEST)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+@renderer_classes([JSONRenderer, NDJSONRenderer])
+def library_export_view(request):
+    """The user's stories and everything attached to them, streamed as NDJSON"""
+    response = StreamingHttpResponse(export_library(request.user), content_type='application/x-ndjson')
+    filename = f"library-{timezone.now():%Y-%m-%d}.ndjson"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
+
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+@parser_classes([NDJSONParser, MultiPartParser])
+def library_import_view(request):
+    """Create stories from a library export (NDJSON body, or multipart ``file``)"""
+    if request.content_type.startswith('multipart/'):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'A library file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        lines = iter_lines(upload.chunks())
+    else:
+        lines = request.data
+
+    try:
+        counts = LibraryImporter(request.user).run(lines)
+    except LibraryImportError as exc:
+        return Response({'error': str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+    except UnicodeDecodeError:
+        return Response({'error': 'Library must be UTF-8 NDJSON'}, status=status.HTTP_400_BAD_REQUEST)
+    except (IntegrityError, DataError) as exc:
+        return Response(
+            {'error': f'Library has missing or conflicting values: {exc}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response(counts, status=status.HTTP_201_CREATED)
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from story.models import Story
+from story.search import reindex_story
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search documents of every story, chapter and character'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--story', action='append', default=[],
+                            help='Only rebuild this story (may be repeated)')
+
+    def handle(self, *args, **options):
+        stories = Story.objects.all()
+        if options['story']:
+            stories = stories.filter(id__in=options['story'])
+        count = 0
+        for story in stories.iterator():
+            with transaction.atomic():
+                reindex_story(story)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Reindexed {count} stories'))
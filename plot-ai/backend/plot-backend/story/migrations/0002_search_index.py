@@ -0,0 +1,98 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# The full-text index depends on the database; see story/search.py
+SQLITE_INDEX = [
+    "CREATE VIRTUAL TABLE story_search USING fts5("
+    "title, body, content='story_searchdocument', content_rowid='id', tokenize='porter unicode61')",
+    "CREATE TRIGGER story_search_insert AFTER INSERT ON story_searchdocument BEGIN "
+    "INSERT INTO story_search(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+    "CREATE TRIGGER story_search_delete AFTER DELETE ON story_searchdocument BEGIN "
+    "INSERT INTO story_search(story_search, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); END",
+    "CREATE TRIGGER story_search_update AFTER UPDATE ON story_searchdocument BEGIN "
+    "INSERT INTO story_search(story_search, rowid, title, body) VALUES ('delete', old.id, old.title, old.body); "
+    "INSERT INTO story_search(rowid, title, body) VALUES (new.id, new.title, new.body); END",
+]
+SQLITE_DROP = [
+    "DROP TRIGGER IF EXISTS story_search_update",
+    "DROP TRIGGER IF EXISTS story_search_delete",
+    "DROP TRIGGER IF EXISTS story_search_insert",
+    "DROP TABLE IF EXISTS story_search",
+]
+POSTGRES_INDEX = [
+    "ALTER TABLE story_searchdocument ADD COLUMN document tsvector GENERATED ALWAYS AS ("
+    "setweight(to_tsvector('english', coalesce(title, '')), 'A') || "
+    "setweight(to_tsvector('english', coalesce(body, '')), 'B')) STORED",
+    "CREATE INDEX story_searchdocument_document ON story_searchdocument USING GIN (document)",
+]
+POSTGRES_DROP = [
+    "DROP INDEX IF EXISTS story_searchdocument_document",
+    "ALTER TABLE story_searchdocument DROP COLUMN IF EXISTS document",
+]
+
+
+def create_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_INDEX, 'postgresql': POSTGRES_INDEX}
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    statements = {'sqlite': SQLITE_DROP, 'postgresql': POSTGRES_DROP}
+    for sql in statements.get(schema_editor.connection.vendor, []):
+        schema_editor.execute(sql)
+
+
+def index_existing(apps, schema_editor):
+    Story = apps.get_model('story', 'Story')
+    Chapter = apps.get_model('story', 'Chapter')
+    Character = apps.get_model('story', 'Character')
+    SearchDocument = apps.get_model('story', 'SearchDocument')
+    owners = dict(Story.objects.values_list('id', 'user_id'))
+    documents = [
+        SearchDocument(kind='story', object_id=story.id, story_id=story.id, user_id=story.user_id,
+                       title=story.title, body='\n\n'.join(filter(None, [story.description, story.content])))
+        for story in Story.objects.iterator()
+    ]
+    documents += [
+        SearchDocument(kind='chapter', object_id=chapter.id, story_id=chapter.story_id,
+                       user_id=owners[chapter.story_id], title=chapter.title, body=chapter.content)
+        for chapter in Chapter.objects.iterator()
+    ]
+    documents += [
+        SearchDocument(kind='character', object_id=character.id, story_id=character.story_id,
+                       user_id=owners[character.story_id], title=character.name, body=character.description)
+        for character in Character.objects.iterator()
+    ]
+    SearchDocument.objects.bulk_create(documents, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('story', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('story', 'Story'), ('chapter', 'Chapter'), ('character', 'Character')], max_length=20)),
+                ('object_id', models.UUIDField()),
+                ('title', models.TextField(blank=True)),
+                ('body', models.TextField(blank=True)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='story.story')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('kind', 'object_id')},
+            },
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(index_existing, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0002_search_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='story',
+            index=models.Index(fields=['user', '-created_at', '-id'], name='story_user_created_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-19 01:46
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('story', '0003_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Revision',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('chapter_id', models.UUIDField(blank=True, null=True)),
+                ('number', models.PositiveIntegerField()),
+                ('sequence', models.PositiveIntegerField()),
+                ('is_snapshot', models.BooleanField(default=True)),
+                ('deleted', models.BooleanField(default=False)),
+                ('data', models.BinaryField()),
+                ('checksum', models.CharField(max_length=64)),
+                ('length', models.PositiveIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='revisions', to='story.story')),
+            ],
+            options={
+                'ordering': ['number'],
+                'indexes': [models.Index(fields=['story', 'chapter_id', '-number'], name='revision_text_idx')],
+                'unique_together': {('story', 'number')},
+            },
+        ),
+    ]
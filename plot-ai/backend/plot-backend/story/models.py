@@ -14,6 +14,8 @@ class Story(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        # Keyset pagination of a user's stories (see plot/pagination.py)
+        indexes = [models.Index(fields=['user', '-created_at', '-id'], name='story_user_created_idx')]
 
     def __str__(self):
         return self.title
@@ -52,3 +54,58 @@ class Character(models.Model):
 
     def __str__(self):
         return f"{self.name} ({self.story.title})"
+
+class SearchDocument(models.Model):
+    """
+    Searchable text of one story, chapter or character, kept in sync by
+    story.signals. The full-text index itself is database specific (an FTS5
+    table on SQLite, a tsvector column on PostgreSQL; see story/search.py).
+    """
+    KINDS = [
+        ('story', 'Story'),
+        ('chapter', 'Chapter'),
+        ('character', 'Character'),
+    ]
+
+    kind = models.CharField(max_length=20, choices=KINDS)
+    object_id = models.UUIDField()
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='+')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    title = models.TextField(blank=True)
+    body = models.TextField(blank=True)
+
+    class Meta:
+        unique_together = ['kind', 'object_id']
+
+    def __str__(self):
+        return f"{self.kind} {self.object_id}"
+
+class Revision(models.Model):
+    """
+    One saved version of a story's content or of a chapter's text. The newest
+    revision of each text holds it in full; older ones hold a compressed
+    reverse delta from the next revision, except every few, which stay full to
+    bound how many deltas a lookup applies (see story/revisions.py).
+    """
+    story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='revisions')
+    # Not a foreign key, so a chapter's history outlives the chapter
+    chapter_id = models.UUIDField(null=True, blank=True)
+    # Numbered across the whole story, so one number dates every text in it
+    number = models.PositiveIntegerField()
+    # Position in this text's own history, from 1
+    sequence = models.PositiveIntegerField()
+    is_snapshot = models.BooleanField(default=True)
+    deleted = models.BooleanField(default=False)
+    data = models.BinaryField()
+    checksum = models.CharField(max_length=64)
+    length = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['number']
+        unique_together = ['story', 'number']
+        indexes = [models.Index(fields=['story', 'chapter_id', '-number'], name='revision_text_idx')]
+
+    def __str__(self):
+        target = f"chapter {self.chapter_id}" if self.chapter_id else 'story'
+        return f"Revision {self.number} of {target} ({self.story_id})"
@@ -0,0 +1,254 @@
+"""
+Revision history of story content and chapter text, stored as deltas.
+
+Each save that changes a text adds a ``Revision`` holding the new text in full
+(zlib-compressed). The revision it replaces as the newest is rewritten as a
+reverse delta (how to get from the new text back to it) unless its place in
+the history is a multiple of ``SNAPSHOT_INTERVAL``, in which case it stays
+full. Recording a revision therefore only needs the newest text, which is
+always stored whole, and reading an old one applies fewer than
+``SNAPSHOT_INTERVAL`` deltas backwards from the nearest full copy after it.
+
+Deltas work on lines: ``[[start, end, replacement], ...]`` replaces lines
+``start:end`` of the newer text with the ``replacement`` string, ranges in
+ascending order.
+
+Revision numbers count across the whole story, so ``changes_since(story, n)``
+can tell, for the story's content and every chapter, what differs from the
+text as it was at revision ``n`` as character spans of the current text.
+Texts with no revision at ``n`` (e.g. created later) count as changed
+throughout. Bulk imports, which send no save signals, record their texts' first
+revisions with ``record_initial_revisions``.
+"""
+import difflib
+import hashlib
+import json
+import zlib
+
+from django.db import transaction
+from django.db.models import Max
+
+from .models import Story, Chapter, Revision
+
+SNAPSHOT_INTERVAL = 16
+
+
+def _compress(value):
+    return zlib.compress(value.encode('utf-8'))
+
+
+def _decompress(data):
+    return zlib.decompress(bytes(data)).decode('utf-8')
+
+
+def checksum(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def line_opcodes(a, b):
+    """``(tag, i1, i2, j1, j2)`` changes between two lists of lines, common ends trimmed first"""
+    prefix = 0
+    limit = min(len(a), len(b))
+    while prefix < limit and a[prefix] == b[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and a[-1 - suffix] == b[-1 - suffix]:
+        suffix += 1
+    matcher = difflib.SequenceMatcher(None, a[prefix:len(a) - suffix], b[prefix:len(b) - suffix])
+    return [
+        (tag, i1 + prefix, i2 + prefix, j1 + prefix, j2 + prefix)
+        for tag, i1, i2, j1, j2 in matcher.get_opcodes() if tag != 'equal'
+    ]
+
+
+def make_delta(source, target):
+    """Delta turning ``source`` into ``target``"""
+    a = source.splitlines(keepends=True)
+    b = target.splitlines(keepends=True)
+    return [[i1, i2, ''.join(b[j1:j2])] for _, i1, i2, j1, j2 in line_opcodes(a, b)]
+
+
+def apply_delta(source, delta):
+    lines = source.splitlines(keepends=True)
+    parts = []
+    position = 0
+    for start, end, replacement in delta:
+        parts.extend(lines[position:start])
+        parts.append(replacement)
+        position = end
+    parts.extend(lines[position:])
+    return ''.join(parts)
+
+
+def changed_spans(old, new):
+    """``[start, end)`` character spans of ``new`` that differ from ``old``; deletions are empty spans"""
+    a = old.splitlines(keepends=True)
+    b = new.splitlines(keepends=True)
+    offsets = [0]
+    for line in b:
+        offsets.append(offsets[-1] + len(line))
+    spans = []
+    for _, _, _, j1, j2 in line_opcodes(a, b):
+        start, end = offsets[j1], offsets[j2]
+        if spans and spans[-1][1] >= start:
+            spans[-1][1] = max(spans[-1][1], end)
+        else:
+            spans.append([start, end])
+    return spans
+
+
+def _history(story, chapter_id):
+    return Revision.objects.filter(story=story, chapter_id=chapter_id)
+
+
+def record_revision(story, chapter=None, deleted=False):
+    """
+    Add a revision if the text (story content, or ``chapter``'s) changed since
+    the last one; returns it, or None if nothing changed
+    """
+    chapter_id = chapter.id if chapter is not None else None
+    text = '' if deleted else (chapter.content if chapter is not None else story.content) or ''
+    digest = checksum(text)
+    with transaction.atomic():
+        # Serialises revision numbering per story where the database supports it
+        Story.objects.select_for_update().filter(pk=story.pk).exists()
+        head = _history(story, chapter_id).order_by('-number').first()
+        if head is not None and head.checksum == digest and head.deleted == deleted:
+            return None
+        number = (story.revisions.aggregate(last=Max('number'))['last'] or 0) + 1
+        if head is not None and head.sequence % SNAPSHOT_INTERVAL:
+            previous = _decompress(head.data)
+            head.data = _compress(json.dumps(make_delta(text, previous), separators=(',', ':')))
+            head.is_snapshot = False
+            head.save(update_fields=['data', 'is_snapshot'])
+        return Revision.objects.create(
+            story=story, chapter_id=chapter_id, number=number,
+            sequence=head.sequence + 1 if head else 1, deleted=deleted,
+            data=_compress(text), checksum=digest, length=len(text),
+        )
+
+
+def record_initial_revisions(stories=(), chapters=()):
+    """
+    First revisions of new stories' content and new chapters' text, for rows
+    saved with ``bulk_create`` (which sends no signals). Each story's
+    revisions are numbered on from its last one.
+    """
+    texts = [(story.pk, None, story.content) for story in stories]
+    texts += [(chapter.story_id, chapter.id, chapter.content) for chapter in chapters]
+    if not texts:
+        return []
+    story_ids = {story_id for story_id, _, _ in texts}
+    with transaction.atomic():
+        Story.objects.select_for_update().filter(pk__in=story_ids).exists()
+        last = dict(
+            Revision.objects.filter(story_id__in=story_ids)
+            .values('story_id').annotate(last=Max('number')).values_list('story_id', 'last')
+        )
+        revisions = []
+        for story_id, chapter_id, text in texts:
+            text = text or ''
+            last[story_id] = last.get(story_id, 0) + 1
+            revisions.append(Revision(
+                story_id=story_id, chapter_id=chapter_id, number=last[story_id], sequence=1,
+                data=_compress(text), checksum=checksum(text), length=len(text),
+            ))
+        return Revision.objects.bulk_create(revisions, batch_size=500)
+
+
+def text_at(story, number, chapter_id=None):
+    """
+    ``(text, revision)`` of the story's content (or a chapter's text) as of
+    story revision ``number``; ``(None, None)`` if it had no revision yet
+    """
+    history = _history(story, chapter_id)
+    revision = history.filter(number__lte=number).order_by('-number').first()
+    if revision is None:
+        return None, None
+    if revision.is_snapshot:
+        return _decompress(revision.data), revision
+    # Walk back from the nearest full copy after it
+    snapshot = history.filter(number__gt=revision.number, is_snapshot=True).order_by('number').first()
+    text = _decompress(snapshot.data)
+    deltas = history.filter(number__gte=revision.number, number__lt=snapshot.number).order_by('-number')
+    for delta in deltas.values_list('data', flat=True):
+        text = apply_delta(text, json.loads(_decompress(delta)))
+    return text, revision
+
+
+def current_number(story):
+    return story.revisions.aggregate(last=Max('number'))['last'] or 0
+
+
+def changes_since(story, number):
+    """What changed in the story's content and chapters since story revision ``number``"""
+    def change(old, new):
+        if old is None:
+            return {'status': 'created', 'spans': [[0, len(new)]] if new else []}
+        spans = changed_spans(old, new)
+        return {'status': 'modified' if spans or old != new else 'unchanged', 'spans': spans}
+
+    changed_ids = set(
+        story.revisions.filter(number__gt=number).values_list('chapter_id', flat=True).distinct()
+    )
+    result = {'revision': current_number(story), 'since': number, 'story': None, 'chapters': []}
+
+    old, old_revision = text_at(story, number)
+    if None in changed_ids or old_revision is None:
+        result['story'] = change(old, story.content or '')
+    else:
+        result['story'] = {'status': 'unchanged', 'spans': []}
+
+    # A text without revisions since ``number`` had its newest one by then, so
+    # whether it existed at ``number`` takes one query for all of them
+    newest = story.revisions.filter(number__lte=number).values('chapter_id').annotate(last=Max('number'))
+    existed = {
+        chapter_id for chapter_id, deleted in
+        story.revisions.filter(number__in=newest.values('last')).values_list('chapter_id', 'deleted')
+        if not deleted
+    }
+
+    chapters = {chapter.id: chapter for chapter in story.chapters.all()}
+    for chapter_id in set(chapters) | (changed_ids - {None}):
+        chapter = chapters.get(chapter_id)
+        if chapter_id not in changed_ids:
+            if chapter_id not in existed:
+                result['chapters'].append({'id': str(chapter_id), 'title': chapter.title,
+                                           **change(None, chapter.content or '')})
+            continue
+        old, old_revision = text_at(story, number, chapter_id)
+        if chapter is None:
+            # Deleted since; only worth reporting if it existed at ``number``
+            if old_revision is not None and not old_revision.deleted:
+                result['chapters'].append({'id': str(chapter_id), 'status': 'deleted', 'spans': []})
+            continue
+        entry = change(None if old_revision is None or old_revision.deleted else old, chapter.content or '')
+        if entry['status'] != 'unchanged':
+            result['chapters'].append({'id': str(chapter_id), 'title': chapter.title, **entry})
+    return result
+
+
+def rollback(story, number):
+    """
+    Restore the story's content and its chapters' text to how they were at
+    revision ``number`` (recording new revisions). Chapters that did not exist
+    then, or have been deleted since, are left as they are. Returns the IDs of
+    the chapters restored.
+    """
+    if number < 1 or number > current_number(story):
+        raise ValueError(f"Story has no revision {number}")
+    restored = []
+    with transaction.atomic():
+        content, revision = text_at(story, number)
+        if revision is not None and content != story.content:
+            story.content = content
+            story.save(update_fields=['content', 'updated_at'])
+        for chapter in Chapter.objects.filter(story=story):
+            text, revision = text_at(story, number, chapter.id)
+            if revision is None or revision.deleted or text == chapter.content:
+                continue
+            chapter.story = story
+            chapter.content = text
+            chapter.save(update_fields=['content', 'updated_at'])
+            restored.append(str(chapter.id))
+    return restored
@@ -0,0 +1,259 @@
+"""
+Streaming import of screenplays (Fountain, or plain text laid out like a
+screenplay) into a story's chapters and characters.
+
+The upload is decoded and parsed a line at a time, so only the current scene
+and one batch of chapters are held in memory. Every scene heading starts a
+chapter whose content is the scene's text as written, and every speaker cue
+counts towards a character. Chapters are inserted ``IMPORT_BATCH_SIZE`` at a
+time, each batch in its own transaction together with its search documents
+and first revisions (``bulk_create`` sends no signals). The story's own content is the title page
+and the list of scenes.
+
+Fountain syntax handled: title page, scene headings (``INT.``/``EXT.``... or
+forced with ``.``), character cues (upper-case line after a blank line and
+followed by dialogue, or forced with ``@``; extensions like ``(V.O.)`` and the
+dual-dialogue ``^`` are dropped), boneyard ``/* */`` and notes ``[[ ]]``
+(removed), sections ``#``, synopses ``=`` and page breaks ``===`` (skipped).
+"""
+import codecs
+import re
+from collections import Counter
+
+from django.db import transaction
+
+from . import search as search_index
+from .models import Story, Chapter, Character
+from .revisions import record_initial_revisions
+
+IMPORT_BATCH_SIZE = 500
+# Chapter for text before the first scene heading (cold opens)
+OPENING_TITLE = 'Opening'
+
+SCENE_RE = re.compile(r'^(?:INT\.?/EXT|INT/EXT|I/E|INT|EXT|EST)[.\s]', re.IGNORECASE)
+SCENE_NUMBER_RE = re.compile(r'\s*#[\w.-]+#\s*$')
+TITLE_KEY_RE = re.compile(r'^([A-Za-z][\w ]*):\s*(.*)$')
+NOTE_RE = re.compile(r'\[\[.*?\]\]')
+EXTENSION_RE = re.compile(r'\([^)]*\)')
+MAX_CUE_LENGTH = 50
+
+
+def iter_lines(chunks, encoding='utf-8-sig'):
+    """Decoded lines (without line endings) from an iterable of byte chunks"""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    pending = ''
+    for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.splitlines(keepends=True)
+        # Hold back the last piece unless it ends in \n: it may be the start of
+        # a line still to come, or end in a \r whose \n is in the next chunk
+        pending = lines.pop() if lines and not lines[-1].endswith('\n') else ''
+        for line in lines:
+            yield line.splitlines()[0]
+    pending += decoder.decode(b'', final=True)
+    if pending:
+        yield from pending.splitlines()
+
+
+def cue_name(line):
+    """Character name of a speaker cue (``MARA (V.O.)`` -> ``Mara``), or None if not a cue"""
+    forced = line.startswith('@')
+    name = EXTENSION_RE.sub('', line.lstrip('@').rstrip().rstrip('^')).strip()
+    if not name or len(name) > MAX_CUE_LENGTH or not any(c.isalpha() for c in name):
+        return None
+    if not forced and (name != name.upper() or name.endswith(':')):
+        return None
+    name = ' '.join(name.split())
+    # Forced cues are written the way the name is spelled
+    return name if forced else name.title()
+
+
+def parse_screenplay(lines):
+    """
+    Events of a screenplay, in order: ``('meta', (key, value))`` for the title
+    page, ``('scene', heading)``, ``('cue', name)`` and ``('text', line)``.
+    Every line of a scene, cues included, is also given as text.
+    """
+    lines = iter(lines)
+    previous_blank = True
+    in_boneyard = False
+    candidate = None  # a possible cue, confirmed by the line after it
+
+    # Title page: ``Key: value`` lines (indented lines continue a value) up to a blank line
+    key = None
+    for line in lines:
+        match = TITLE_KEY_RE.match(line)
+        if match and not SCENE_RE.match(line):
+            if key:
+                yield 'meta', (key, value)
+            key, value = match.group(1).strip().lower(), match.group(2).strip()
+            continue
+        if key and line.strip() and line[:1].isspace():
+            value = ' '.join(filter(None, [value, line.strip()]))
+            continue
+        if key:
+            yield 'meta', (key, value)
+        if line.strip():
+            lines = _prepend(line, lines)
+        break
+
+    for line in lines:
+        if in_boneyard:
+            if '*/' not in line:
+                continue
+            line = line.split('*/', 1)[1]
+            in_boneyard = False
+        while '/*' in line:
+            before, rest = line.split('/*', 1)
+            if '*/' in rest:
+                line = before + rest.split('*/', 1)[1]
+            else:
+                line, in_boneyard = before, True
+        stripped = NOTE_RE.sub('', line).strip()
+
+        if candidate is not None:
+            # A cue is followed by dialogue; before a blank line it was action
+            name, cue_line = candidate
+            candidate = None
+            if stripped:
+                yield 'cue', name
+            yield 'text', cue_line
+
+        after_blank, previous_blank = previous_blank, not stripped
+        if not stripped:
+            yield 'text', ''
+            continue
+        # Sections, synopses and page breaks aren't part of the script's text
+        if stripped.startswith(('#', '=')):
+            continue
+
+        if after_blank:
+            if stripped.startswith('.') and not stripped.startswith('..'):
+                yield 'scene', SCENE_NUMBER_RE.sub('', stripped[1:]).strip()
+                continue
+            if SCENE_RE.match(stripped):
+                yield 'scene', SCENE_NUMBER_RE.sub('', stripped).strip()
+                continue
+            if not stripped.startswith(('!', '>', '~')):
+                name = cue_name(stripped)
+                if name:
+                    candidate = (name, stripped)
+                    continue
+        yield 'text', stripped[1:] if stripped.startswith('!') else stripped
+
+    if candidate is not None:
+        yield 'text', candidate[1]
+
+
+def _prepend(first, rest):
+    yield first
+    yield from rest
+
+
+def character_roles(cues):
+    """Role by share of dialogue: the lead is the protagonist, speakers with a tenth of their cues supporting"""
+    if not cues:
+        return {}
+    (lead, most), = cues.most_common(1)
+    return {
+        name: 'protagonist' if name == lead else 'supporting' if count * 10 >= most else 'minor'
+        for name, count in cues.items()
+    }
+
+
+class ScreenplayImporter:
+    """Builds one story from a screenplay's events; use ``run(lines)``"""
+
+    def __init__(self, user, title=None, description='', batch_size=None):
+        self.user = user
+        self.title = title
+        self.description = description
+        self.batch_size = batch_size or IMPORT_BATCH_SIZE
+        self.story = None
+        self.meta = {}
+        self.batch = []
+        self.headings = []
+        self.cues = Counter()
+        self.chapter_count = 0
+        self.character_count = 0
+
+    def run(self, lines):
+        scene_title = OPENING_TITLE
+        scene_lines = []
+        try:
+            for kind, value in parse_screenplay(lines):
+                if kind == 'text':
+                    if value or (scene_lines and scene_lines[-1]):
+                        scene_lines.append(value)
+                elif kind == 'cue':
+                    self.cues[value] += 1
+                elif kind == 'scene':
+                    self.add_chapter(scene_title, scene_lines)
+                    scene_title, scene_lines = value, []
+                    self.headings.append(value)
+                else:
+                    self.meta.setdefault(*value)
+            self.add_chapter(scene_title, scene_lines)
+            self.flush()
+            self.finish()
+        except Exception:
+            if self.story is not None:
+                self.story.delete()
+            raise
+        return self.story
+
+    def get_story(self):
+        """The story, created once the title page has been read"""
+        if self.story is None:
+            title = self.title or self.meta.get('title') or 'Untitled screenplay'
+            author = self.meta.get('author') or self.meta.get('authors')
+            description = self.description or (f'Written by {author}' if author else '')
+            self.story = Story.objects.create(
+                user=self.user, title=title[:200], description=description, content=''
+            )
+        return self.story
+
+    def add_chapter(self, title, lines):
+        content = '\n'.join(lines).strip()
+        # An empty opening is just the gap before the first scene
+        if not content and title == OPENING_TITLE and not self.chapter_count:
+            return
+        self.chapter_count += 1
+        self.batch.append(Chapter(
+            story=self.get_story(), title=title[:200], content=content, order=self.chapter_count
+        ))
+        if len(self.batch) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self.batch:
+            return
+        with transaction.atomic():
+            Chapter.objects.bulk_create(self.batch)
+            search_index.index_objects(self.batch)
+            record_initial_revisions(chapters=self.batch)
+        self.batch = []
+
+    def finish(self):
+        story = self.get_story()
+        roles = character_roles(self.cues)
+        characters = [
+            Character(story=story, name=name[:100], role=roles[name],
+                      description=f'{count} line{"s" if count != 1 else ""} of dialogue')
+            for name, count in self.cues.most_common()
+        ]
+        with transaction.atomic():
+            Character.objects.bulk_create(characters, batch_size=self.batch_size)
+            search_index.index_objects(characters)
+            title_page = '\n'.join(f'{key.title()}: {value}' for key, value in self.meta.items())
+            story.content = '\n\n'.join(filter(None, [title_page, '\n'.join(self.headings)]))
+            # Saving also reindexes the story through its post_save signal
+            story.save(update_fields=['content', 'updated_at'])
+        self.character_count = len(characters)
+
+
+def import_screenplay(chunks, user, title=None, description=''):
+    """Import a screenplay given as byte chunks (e.g. ``UploadedFile.chunks()``); returns the importer"""
+    importer = ScreenplayImporter(user, title=title, description=description)
+    importer.run(iter_lines(chunks))
+    return importer
@@ -0,0 +1,201 @@
+"""
+Full-text search over stories, chapters and characters.
+
+Every indexed object has a ``SearchDocument`` row (title and body text plus the
+owning story and user) maintained by ``story.signals``. The index over those
+rows depends on the database, and is created by migration 0002:
+
+- SQLite: an external-content FTS5 table ``story_search`` kept in step with
+  ``story_searchdocument`` by triggers; ranked with bm25.
+- PostgreSQL: a generated, GIN-indexed ``tsvector`` column on
+  ``story_searchdocument``; ranked with ts_rank.
+
+Other databases fall back to ``icontains`` matching. ``SEARCH_BACKEND`` can name
+a backend class (dotted path) to use instead of the one chosen by vendor.
+
+Snippets are HTML-escaped with matches wrapped in ``<mark>``.
+"""
+import html
+import re
+import uuid
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Story, Chapter, Character, SearchDocument
+
+KINDS = ('story', 'chapter', 'character')
+# Title matches count this many times more than body matches
+TITLE_WEIGHT = 5.0
+MAX_QUERY_TERMS = 16
+SNIPPET_WORDS = 24
+
+# Highlight delimiters the database puts around matches; replaced after escaping
+_START, _STOP = '\x02', '\x03'
+_TERM_RE = re.compile(r'\w+')
+
+
+def document_fields(obj):
+    """``SearchDocument`` values for a story, chapter or character"""
+    if isinstance(obj, Story):
+        return {
+            'kind': 'story', 'object_id': obj.id, 'story_id': obj.id, 'user_id': obj.user_id,
+            'title': obj.title, 'body': '\n\n'.join(filter(None, [obj.description, obj.content])),
+        }
+    if isinstance(obj, Chapter):
+        return {
+            'kind': 'chapter', 'object_id': obj.id, 'story_id': obj.story_id, 'user_id': obj.story.user_id,
+            'title': obj.title, 'body': obj.content,
+        }
+    if isinstance(obj, Character):
+        return {
+            'kind': 'character', 'object_id': obj.id, 'story_id': obj.story_id, 'user_id': obj.story.user_id,
+            'title': obj.name, 'body': obj.description,
+        }
+    raise TypeError(f"Cannot index {type(obj).__name__}")
+
+
+def index_object(obj):
+    fields = document_fields(obj)
+    SearchDocument.objects.update_or_create(
+        kind=fields.pop('kind'), object_id=fields.pop('object_id'), defaults=fields
+    )
+
+
+def unindex_object(obj):
+    # Only the kind and ID: a cascaded chapter's story may already be gone
+    kind = {Story: 'story', Chapter: 'chapter', Character: 'character'}[type(obj)]
+    SearchDocument.objects.filter(kind=kind, object_id=obj.id).delete()
+
+
+def index_objects(objects):
+    """Documents for newly created objects in one insert (``bulk_create`` sends no signals)"""
+    SearchDocument.objects.bulk_create(SearchDocument(**document_fields(obj)) for obj in objects)
+
+
+def reindex_story(story):
+    """Rebuild the documents of a story and all its chapters and characters (e.g. after bulk_create)"""
+    SearchDocument.objects.filter(story=story).delete()
+    objects = [story, *story.chapters.all(), *story.characters.all()]
+    for obj in objects[1:]:
+        obj.story = story
+    index_objects(objects)
+
+
+def highlight(snippet):
+    """HTML-escape a database snippet and turn its match delimiters into <mark> tags"""
+    escaped = html.escape(snippet or '')
+    return escaped.replace(_START, '<mark>').replace(_STOP, '</mark>')
+
+
+def query_terms(text):
+    return _TERM_RE.findall(text or '')[:MAX_QUERY_TERMS]
+
+
+class SQLiteSearchBackend:
+    def search(self, user_id, text, kinds=KINDS, limit=20, offset=0):
+        terms = query_terms(text)
+        if not terms:
+            return []
+        # Every term must match; the last one may be a prefix of the word being typed
+        match = ' '.join(f'"{term}"' for term in terms) + '*'
+        placeholders = ', '.join(['%s'] * len(kinds))
+        sql = f"""
+            SELECT d.kind, d.object_id, d.story_id, d.title,
+                   snippet(story_search, -1, %s, %s, '…', %s),
+                   bm25(story_search, %s, 1.0) AS score
+            FROM story_search
+            JOIN story_searchdocument d ON d.id = story_search.rowid
+            WHERE story_search MATCH %s AND d.user_id = %s AND d.kind IN ({placeholders})
+            ORDER BY score
+            LIMIT %s OFFSET %s
+        """
+        params = [_START, _STOP, SNIPPET_WORDS, TITLE_WEIGHT, match, user_id, *kinds, limit, offset]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            # bm25 is lower for better matches
+            return [
+                _result(kind, object_id, story_id, title, snippet, -score)
+                for kind, object_id, story_id, title, snippet, score in cursor.fetchall()
+            ]
+
+
+class PostgresSearchBackend:
+    def search(self, user_id, text, kinds=KINDS, limit=20, offset=0):
+        terms = query_terms(text)
+        if not terms:
+            return []
+        # Headlines are expensive, so only the page of ranked rows gets one
+        sql = """
+            WITH query AS (SELECT websearch_to_tsquery('english', %s) AS q),
+            ranked AS (
+                SELECT d.kind, d.object_id, d.story_id, d.title, d.body,
+                       ts_rank(d.document, query.q) AS score
+                FROM story_searchdocument d, query
+                WHERE d.document @@ query.q AND d.user_id = %s AND d.kind = ANY(%s)
+                ORDER BY score DESC
+                LIMIT %s OFFSET %s
+            )
+            SELECT ranked.kind, ranked.object_id, ranked.story_id, ranked.title,
+                   ts_headline('english', ranked.body, query.q, %s), ranked.score
+            FROM ranked, query
+            ORDER BY ranked.score DESC
+        """
+        options = f'StartSel={_START}, StopSel={_STOP}, MaxWords={SNIPPET_WORDS}, MinWords=8'
+        params = [' '.join(terms), user_id, list(kinds), limit, offset, options]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+            return [_result(*row) for row in cursor.fetchall()]
+
+
+class BasicSearchBackend:
+    """Substring matching for databases without a full-text index"""
+
+    def search(self, user_id, text, kinds=KINDS, limit=20, offset=0):
+        terms = query_terms(text)
+        if not terms:
+            return []
+        documents = SearchDocument.objects.filter(user_id=user_id, kind__in=kinds)
+        for term in terms:
+            documents = documents.filter(Q(title__icontains=term) | Q(body__icontains=term))
+        results = []
+        for document in documents.order_by('kind', 'title')[offset:offset + limit]:
+            position = document.body.lower().find(terms[0].lower())
+            start = max(0, position - 80)
+            results.append(_result(
+                document.kind, document.object_id, document.story_id, document.title,
+                document.body[start:start + 200], 0.0
+            ))
+        return results
+
+
+BACKENDS = {
+    'sqlite': SQLiteSearchBackend,
+    'postgresql': PostgresSearchBackend,
+}
+
+
+def _result(kind, object_id, story_id, title, snippet, score):
+    # Raw SQLite rows hold UUIDs as bare hex
+    return {
+        'type': kind,
+        'id': str(uuid.UUID(str(object_id))),
+        'story_id': str(uuid.UUID(str(story_id))),
+        'title': title,
+        'snippet': highlight(snippet),
+        'score': round(float(score), 4),
+    }
+
+
+def get_backend():
+    path = getattr(settings, 'SEARCH_BACKEND', None)
+    if path:
+        return import_string(path)()
+    return BACKENDS.get(connection.vendor, BasicSearchBackend)()
+
+
+def search(user, text, kinds=KINDS, limit=20, offset=0):
+    """Ranked matches for ``text`` among ``user``'s stories, chapters and characters"""
+    return get_backend().search(user.id, text, kinds=tuple(kinds), limit=limit, offset=offset)
@@ -1,19 +1,98 @@
 from rest_framework import serializers
-from .models import Story, Chapter, Character
+from .models import Story, Chapter, Character, Revision
 
-class CharacterSerializer(serializers.ModelSerializer):
+
+def requested_fieldset(request):
+    """
+    ``(fields, omit)`` from ``?fields=a,b`` and ``?omit=c,chapters.content``;
+    each is a list of names, or None when the parameter is absent
+    """
+    if request is None:
+        return None, None
+
+    def names(param):
+        value = request.query_params.get(param)
+        if value is None:
+            return None
+        return [name.strip() for name in value.split(',') if name.strip()]
+
+    return names('fields'), names('omit')
+
+
+def nested_names(names, prefix):
+    """Names under ``prefix.`` with the prefix removed (``chapters.title`` -> ``title``)"""
+    if names is None:
+        return None
+    return [name[len(prefix) + 1:] for name in names if name.startswith(prefix + '.')]
+
+
+def field_requested(fieldset, path):
+    """Whether ``path`` (``content``, ``chapters.content``) survives a ``(fields, omit)`` fieldset"""
+    include, omit = fieldset
+    head, _, rest = path.partition('.')
+    if omit is not None and head in omit:
+        return False
+    if include is not None and head not in {name.split('.', 1)[0] for name in include}:
+        return False
+    if not rest:
+        return True
+    return field_requested((nested_names(include, head) or None, nested_names(omit, head)), rest)
+
+
+class SparseFieldsetMixin:
+    """
+    Lets clients pick the fields of a response with ``?fields=`` or drop some
+    with ``?omit=``. Dotted names reach into nested serializers:
+    ``?omit=content,chapters.content`` returns a story and its chapters
+    without any manuscript text. Nested serializers can also be given
+    ``fields``/``omit`` directly.
+    """
+
+    def __init__(self, *args, fields=None, omit=None, **kwargs):
+        self._sparse_fields = fields
+        self._sparse_omit = omit
+        super().__init__(*args, **kwargs)
+
+    def get_fields(self):
+        fields = super().get_fields()
+        include, omit = self._sparse_fields, self._sparse_omit
+        parent = self.parent.parent if isinstance(self.parent, serializers.ListSerializer) else self.parent
+        if include is None and omit is None and parent is None:
+            include, omit = requested_fieldset(self.context.get('request'))
+
+        if include is not None:
+            wanted = {name.split('.', 1)[0] for name in include}
+            for name in list(fields):
+                if name not in wanted:
+                    fields.pop(name)
+        if omit is not None:
+            for name in omit:
+                if '.' not in name:
+                    fields.pop(name, None)
+
+        for name, field in fields.items():
+            child = field.child if isinstance(field, serializers.ListSerializer) else field
+            if isinstance(child, SparseFieldsetMixin):
+                child_fields = nested_names(include, name)
+                # ``?fields=chapters`` keeps every chapter field
+                child._sparse_fields = child_fields or None
+                child._sparse_omit = nested_names(omit, name)
+        return fields
+
+
+class CharacterSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Character
         fields = ['id', 'name', 'description', 'role', 'created_at']
         read_only_fields = ['id', 'created_at']
 
-class ChapterSerializer(serializers.ModelSerializer):
+class ChapterSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     class Meta:
         model = Chapter
         fields = ['id', 'title', 'content', 'order', 'created_at', 'updated_at']
         read_only_fields = ['id', 'created_at', 'updated_at']
 
-class StoryListSerializer(serializers.ModelSerializer):
+class StoryListSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     characters_count = serializers.SerializerMethodField()
     chapters_count = serializers.SerializerMethodField()
 
@@ -24,12 +103,17 @@ class StoryListSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at', 'updated_at']
 
     def get_characters_count(self, obj):
+        # Annotated by StoryViewSet.get_queryset for lists
+        if hasattr(obj, 'characters_count'):
+            return obj.characters_count
         return obj.characters.count()
 
     def get_chapters_count(self, obj):
+        if hasattr(obj, 'chapters_count'):
+            return obj.chapters_count
         return obj.chapters.count()
 
-class StoryDetailSerializer(serializers.ModelSerializer):
+class StoryDetailSerializer(SparseFieldsetMixin, serializers.ModelSerializer):
     characters = CharacterSerializer(many=True, read_only=True)
     chapters = ChapterSerializer(many=True, read_only=True)
 
@@ -46,4 +130,10 @@ class StoryCreateSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         validated_data['user'] = self.context['request'].user
-        return super().create(validated_data)
\ No newline at end of file
+        return super().create(validated_data)
+
+class RevisionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Revision
+        fields = ['number', 'chapter_id', 'sequence', 'is_snapshot', 'deleted', 'length', 'created_at']
+        read_only_fields = fields
@@ -0,0 +1,62 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from plot.caching import invalidate_user, touch
+
+from .models import Story, Chapter, Character
+from .revisions import record_revision
+from .search import index_object, unindex_object
+
+
+@receiver(post_save, sender=Story)
+@receiver(post_save, sender=Chapter)
+@receiver(post_save, sender=Character)
+def searchable_saved(sender, instance, **kwargs):
+    index_object(instance)
+
+
+@receiver(post_delete, sender=Story)
+@receiver(post_delete, sender=Chapter)
+@receiver(post_delete, sender=Character)
+def searchable_deleted(sender, instance, **kwargs):
+    unindex_object(instance)
+
+
+@receiver(post_save, sender=Story)
+def story_revised(sender, instance, update_fields=None, **kwargs):
+    # Saves of other fields (or of an instance with content deferred) leave the text alone
+    if update_fields is None or 'content' in update_fields:
+        record_revision(instance)
+
+
+@receiver(post_save, sender=Chapter)
+def chapter_revised(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'content' in update_fields:
+        record_revision(instance.story, instance)
+
+
+@receiver(post_delete, sender=Chapter)
+def chapter_deleted(sender, instance, origin=None, **kwargs):
+    # Only for chapters deleted themselves: in a cascade from the story (or its
+    # user) the history is being deleted too
+    if getattr(origin, 'model', type(origin)) is Chapter:
+        record_revision(instance.story, instance, deleted=True)
+
+
+@receiver(post_save, sender=Story)
+@receiver(post_delete, sender=Story)
+def story_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_save, sender=Character)
+@receiver(post_delete, sender=Chapter)
+@receiver(post_delete, sender=Character)
+def story_part_changed(sender, instance, origin=None, **kwargs):
+    # Parts deleted along with their story are covered by story_changed
+    if origin is not None and getattr(origin, 'model', type(origin)) is not sender:
+        return
+    # Chapters and characters date their story's responses (plot.caching)
+    touch(Story, instance.story_id)
+    invalidate_user(instance.story.user_id)
@@ -1,3 +1,424 @@
-from django.test import TestCase
+import json
+import re
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APITestCase
+
+from generation.models import VisualizationRequest, GeneratedVisualization
+from interview.models import Interview, Question, Response as InterviewResponse
+from plot.testing import QueryBudgetMixin
+from . import revisions
+from .models import Story, Chapter, Character, SearchDocument, Revision
+from .screenplay import ScreenplayImporter, iter_lines
+
+
+class StoryQueryBudgetTests(QueryBudgetMixin, APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def add_story(self, i):
+        story = Story.objects.create(user=self.user, title=f'Story {i}', content='...')
+        Character.objects.create(story=story, name='Hero', role='protagonist')
+        Character.objects.create(story=story, name='Villain', role='antagonist')
+        Chapter.objects.create(story=story, title='One', content='...', order=1)
+
+    def test_story_list(self):
+        # validators (with the row count) + stories with annotated counts
+        self.assertQueryBudget('/api/stories/', 2, self.add_story)
+
+    def test_story_list_count(self):
+        for i in range(3):
+            self.add_story(i)
+        response = self.client.get('/api/stories/', {'page_size': 2})
+        self.assertEqual(response.data['count'], 3)
+        self.assertNotIn('count', self.client.get('/api/stories/', {'count': 'false'}).data)
+
+    def test_story_detail(self):
+        story = Story.objects.create(user=self.user, title='Story', content='...')
+
+        def add_row(i):
+            Character.objects.create(story=story, name=f'Character {i}', role='minor')
+            Chapter.objects.create(story=story, title=f'Chapter {i}', content='...', order=i)
+
+        # validators + story + prefetched characters + prefetched chapters
+        self.assertQueryBudget(f'/api/stories/{story.id}/', 4, add_row)
+
+
+class StorySparseFieldsetTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+        self.story = Story.objects.create(user=self.user, title='Story', content='x' * 1000)
+        Character.objects.create(story=self.story, name='Hero', role='protagonist')
+        for order in range(1, 4):
+            Chapter.objects.create(story=self.story, title=f'Chapter {order}', content='y' * 500, order=order)
+
+    def test_omit_nested_content(self):
+        response = self.client.get(f'/api/stories/{self.story.id}/?omit=content,chapters.content')
+        self.assertNotIn('content', response.data)
+        self.assertEqual(len(response.data['chapters']), 3)
+        self.assertNotIn('content', response.data['chapters'][0])
+        self.assertIn('characters', response.data)
+
+    def test_fields_selects_nested_fields(self):
+        response = self.client.get(f'/api/stories/{self.story.id}/?fields=id,title,chapters.title')
+        self.assertEqual(set(response.data), {'id', 'title', 'chapters'})
+        self.assertEqual(set(response.data['chapters'][0]), {'title'})
+
+    def test_default_response_is_unchanged(self):
+        response = self.client.get(f'/api/stories/{self.story.id}/')
+        self.assertEqual(len(response.data['content']), 1000)
+        self.assertEqual(len(response.data['chapters'][0]['content']), 500)
+
+    def test_content_pages(self):
+        url = f'/api/stories/{self.story.id}/content/'
+        first = self.client.get(url, {'limit': 600}).data
+        self.assertEqual((first['length'], len(first['content']), first['next_offset']), (1000, 600, 600))
+        rest = self.client.get(url, {'offset': first['next_offset'], 'limit': 600}).data
+        self.assertEqual((len(rest['content']), rest['next_offset']), (400, None))
+
+    def test_chapter_list_by_story_without_content(self):
+        response = self.client.get('/api/chapters/', {'story': str(self.story.id), 'omit': 'content'})
+        self.assertEqual(response.data['count'], 3)
+        self.assertNotIn('content', response.data['results'][0])
+        chapter_id = response.data['results'][0]['id']
+        page = self.client.get(f'/api/chapters/{chapter_id}/content/', {'limit': 100}).data
+        self.assertEqual((len(page['content']), page['next_offset']), (100, 100))
+
+
+class StorySearchTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+        self.story = Story.objects.create(
+            user=self.user, title='The Lighthouse', description='A keeper alone',
+            content='Storms batter the island every winter.'
+        )
+        self.chapter = Chapter.objects.create(
+            story=self.story, title='Arrival', content='The keeper finds a <b>stranger</b> on the rocks.', order=1
+        )
+        Character.objects.create(story=self.story, name='Mara', role='protagonist', description='The lighthouse keeper')
+        other = User.objects.create_user('other', password='pw')
+        Story.objects.create(user=other, title='Another keeper', content='keeper keeper keeper')
+
+    def search(self, **params):
+        response = self.client.get('/api/search/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def test_results_are_ranked_and_scoped_to_user(self):
+        results = self.search(q='keeper')
+        self.assertEqual({result['type'] for result in results}, {'story', 'chapter', 'character'})
+        self.assertTrue(all(result['story_id'] == str(self.story.id) for result in results))
+        self.assertEqual(results[0]['story_title'], 'The Lighthouse')
+
+    def test_snippets_escape_text_and_mark_matches(self):
+        [result] = self.search(q='stranger')
+        self.assertEqual(result['id'], str(self.chapter.id))
+        self.assertIn('&lt;b&gt;<mark>stranger</mark>&lt;/b&gt;', result['snippet'])
+
+    def test_index_follows_edits_and_deletes(self):
+        self.chapter.content = 'A ship runs aground.'
+        self.chapter.save()
+        self.assertEqual(self.search(q='stranger'), [])
+        self.assertEqual(len(self.search(q='aground')), 1)
+        self.story.delete()
+        self.assertEqual(self.search(q='keeper'), [])
+
+    def test_prefix_and_type_filter(self):
+        results = self.search(q='lightho', type='character')
+        self.assertEqual([result['title'] for result in results], ['Mara'])
+
+
+SCREENPLAY = b"""Title: The Salt Road
+Author: J. Doe
+
+FADE IN:
+
+INT. CARAVAN - NIGHT #1#
+
+Mara counts the water barrels.
+
+MARA (V.O.)
+Two left.
+
+GUIDE
+We turn back.
+
+/* GUIDE
+Cut line.
+*/
+
+BOOM.
+
+EXT. SALT FLATS - DAY
+
+@McCoy
+Keep moving.
+
+MARA ^
+Fine.
+"""
+
+
+class ScreenplayImportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+
+    def upload(self, data, **fields):
+        return self.client.post(
+            '/api/stories/import/',
+            {'file': SimpleUploadedFile('script.fountain', data), **fields},
+            format='multipart'
+        )
+
+    def test_scenes_become_chapters_and_speakers_characters(self):
+        # Split mid-line and mid-character to exercise the incremental decoder
+        chunks = [SCREENPLAY[:7], SCREENPLAY[7:100], SCREENPLAY[100:]]
+        importer = ScreenplayImporter(self.user, batch_size=2)
+        story = importer.run(iter_lines(chunks))
+        self.assertEqual(story.title, 'The Salt Road')
+        self.assertEqual(
+            list(story.chapters.values_list('title', flat=True)),
+            ['Opening', 'INT. CARAVAN - NIGHT', 'EXT. SALT FLATS - DAY']
+        )
+        self.assertNotIn('Cut line', story.chapters.get(order=2).content)
+        self.assertEqual(
+            dict(story.characters.values_list('name', 'role')),
+            {'Mara': 'protagonist', 'Guide': 'supporting', 'McCoy': 'supporting'}
+        )
+        # BOOM. is followed by a blank line, so it is action rather than a cue
+        self.assertEqual(story.characters.count(), 3)
+        self.assertEqual(SearchDocument.objects.filter(story=story).count(), 7)
+
+    def test_crlf_split_between_chunks(self):
+        self.assertEqual(
+            list(iter_lines([b'INT. ROOM\r\n\r\nMARA\r', b'\nTwo left.\r\n'])),
+            ['INT. ROOM', '', 'MARA', 'Two left.']
+        )
+        data = SCREENPLAY.replace(b'\n', b'\r\n')
+        # Every chunk ends between a \r and its \n
+        chunks = re.split(rb'(?<=\r)(?=\n)', data)
+        story = ScreenplayImporter(self.user).run(iter_lines(chunks))
+        self.assertEqual(story.characters.count(), 3)
+        self.assertEqual(story.chapters.count(), 3)
+
+    def test_imported_scenes_start_their_history(self):
+        scenes = b''.join(b'INT. ROOM %d - NIGHT\n\nMara waits.\n\n' % n for n in range(1, 41))
+        story = ScreenplayImporter(self.user, batch_size=7).run(iter_lines([scenes]))
+        since = revisions.current_number(story)
+        with CaptureQueriesContext(connection) as queries:
+            changes = revisions.changes_since(story, since)
+        self.assertEqual(changes['story']['status'], 'unchanged')
+        self.assertEqual(changes['chapters'], [])
+        # Nothing changed, so no text is rebuilt, however many scenes there are
+        self.assertLessEqual(len(queries), 5)
+
+        chapter = story.chapters.get(order=3)
+        chapter.content = 'Mara leaves.'
+        chapter.save()
+        changes = revisions.changes_since(story, since)
+        self.assertEqual([(c['id'], c['status']) for c in changes['chapters']], [(str(chapter.id), 'modified')])
+
+    def test_import_endpoint(self):
+        response = self.upload(SCREENPLAY, title='Renamed')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['title'], 'Renamed')
+        self.assertEqual(response.data['chapters_count'], 3)
+        self.assertEqual(response.data['characters_count'], 3)
+
+    def test_rejects_binary_upload(self):
+        self.assertEqual(self.upload(b'\xff\xfe\x00garbage').status_code, 400)
+        self.assertFalse(Story.objects.exists())
+
+
+@mock.patch('generation.signals.publish')
+class LibraryExportImportTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+        for i in range(3):
+            story = Story.objects.create(user=self.user, title=f'Story {i}', content='Once upon a time')
+            Chapter.objects.create(story=story, title='One', content='Beginning', order=1)
+            Character.objects.create(story=story, name='Mara', role='protagonist')
+            request = VisualizationRequest.objects.create(
+                story=story, user=self.user, visualization_type='flowchart', status='completed'
+            )
+            GeneratedVisualization.objects.create(request=request, title='Flow', data={'mermaid_code': 'flowchart TD'})
+            interview = Interview.objects.create(story=story, title='Feedback')
+            question = Question.objects.create(interview=interview, text='Liked it?', order=1)
+            InterviewResponse.objects.create(question=question, user=self.user, answer='Yes')
+
+    def export(self):
+        response = self.client.get('/api/library/export/')
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        return b''.join(response.streaming_content)
+
+    def test_export_queries_do_not_grow_with_stories(self, publish):
+        # One query per table per chunk of stories, plus the empty chunk ending the walk
+        with self.assertNumQueries(9):
+            lines = self.export().splitlines()
+        self.assertEqual(len(lines), 4)
+        story = json.loads(lines[1])
+        self.assertEqual(story['chapters'], [{'title': 'One', 'content': 'Beginning', 'order': 1}])
+        self.assertEqual(story['visualizations'][0]['visualization']['title'], 'Flow')
+        self.assertEqual(story['interviews'][0]['questions'][0]['answer'], 'Yes')
+
+    def test_round_trip_into_another_account(self, publish):
+        body = self.export()
+        other = User.objects.create_user('reader', password='pw')
+        self.client.force_authenticate(other)
+        response = self.client.post('/api/library/import/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(response.data['stories'], 3)
+        self.assertEqual(response.data['answers'], 3)
+        imported = Story.objects.filter(user=other)
+        self.assertEqual(imported.count(), 3)
+        self.assertEqual(Chapter.objects.filter(story__user=other).count(), 3)
+        self.assertEqual(InterviewResponse.objects.filter(user=other).count(), 3)
+        self.assertEqual(self.client.get('/api/search/', {'q': 'beginning'}).data['results'][0]['type'], 'chapter')
+        for story in imported:
+            changes = revisions.changes_since(story, revisions.current_number(story))
+            self.assertEqual((changes['story']['status'], changes['chapters']), ('unchanged', []))
+
+    def test_in_flight_requests_import_as_failed(self, publish):
+        VisualizationRequest.objects.filter(user=self.user).update(status='processing')
+        body = self.export()
+        other = User.objects.create_user('reader', password='pw')
+        self.client.force_authenticate(other)
+        self.client.post('/api/library/import/', body, content_type='application/x-ndjson')
+        imported = VisualizationRequest.objects.filter(user=other)
+        self.assertEqual(set(imported.values_list('status', flat=True)), {'failed'})
+        self.assertTrue(all(request.error_message for request in imported))
+
+    def test_bad_line_imports_nothing(self, publish):
+        lines = self.export().splitlines()
+        body = b'\n'.join(lines[:2] + [b'{"type": "story", "chapters": 7}'])
+        response = self.client.post('/api/library/import/', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Line 3', response.data['error'])
+        self.assertEqual(Story.objects.count(), 3)
+
+
+class RevisionTests(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+        self.story = Story.objects.create(user=self.user, title='Story', content='Line 1\nLine 2\nLine 3\n')
+        self.chapter = Chapter.objects.create(story=self.story, title='One', content='Opening\n', order=1)
+
+    def edit(self, content):
+        self.story.content = content
+        self.story.save()
+        return revisions.current_number(self.story)
+
+    def test_old_text_is_rebuilt_from_deltas(self):
+        texts = {}
+        content = self.story.content
+        for i in range(revisions.SNAPSHOT_INTERVAL * 2 + 3):
+            content = content.replace(f'Line {i % 3 + 1}', f'Line {i % 3 + 1}.{i}', 1)
+            texts[self.edit(content)] = content
+        for number, text in texts.items():
+            self.assertEqual(revisions.text_at(self.story, number)[0], text)
+        # Only the newest and every SNAPSHOT_INTERVAL-th revision are stored whole
+        history = Revision.objects.filter(story=self.story, chapter_id=None)
+        self.assertEqual(history.filter(is_snapshot=True).count(), 3)
+
+    def test_title_only_saves_add_no_revision(self):
+        before = revisions.current_number(self.story)
+        self.story.title = 'Renamed'
+        self.story.save(update_fields=['title'])
+        self.story.save()
+        self.assertEqual(revisions.current_number(self.story), before)
+
+    def test_changes_since(self):
+        since = revisions.current_number(self.story)
+        self.edit('Line 1\nLine two\nLine 3\n')
+        added = Chapter.objects.create(story=self.story, title='Two', content='Later\n', order=2)
+        response = self.client.get(f'/api/stories/{self.story.id}/changes/', {'since': since})
+        self.assertEqual(response.data['story'], {'status': 'modified', 'spans': [[7, 16]]})
+        self.assertEqual(
+            [(c['id'], c['status']) for c in response.data['chapters']],
+            [(str(added.id), 'created')]
+        )
+        deleted_id = str(self.chapter.id)
+        self.chapter.delete()
+        response = self.client.get(f'/api/stories/{self.story.id}/changes/', {'since': since})
+        self.assertIn((deleted_id, 'deleted'), [(c['id'], c['status']) for c in response.data['chapters']])
+
+    def test_rollback(self):
+        original = revisions.current_number(self.story)
+        self.edit('Rewritten\n')
+        self.chapter.content = 'Changed\n'
+        self.chapter.save()
+        response = self.client.post(f'/api/stories/{self.story.id}/rollback/', {'revision': original})
+        self.assertEqual(response.status_code, 200)
+        self.story.refresh_from_db()
+        self.chapter.refresh_from_db()
+        self.assertEqual(self.story.content, 'Line 1\nLine 2\nLine 3\n')
+        self.assertEqual(self.chapter.content, 'Opening\n')
+        self.assertEqual(response.data['chapters'], [str(self.chapter.id)])
+        changes = revisions.changes_since(self.story, original)
+        self.assertEqual(changes['story']['status'], 'unchanged')
+        self.assertEqual(changes['chapters'], [])
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('writer', password='pw')
+        self.client.force_authenticate(self.user)
+        self.story = Story.objects.create(user=self.user, title='Story', content='...')
+        self.character = Character.objects.create(story=self.story, name='Hero', role='protagonist')
+        self.url = f'/api/stories/{self.story.id}/'
+
+    def get(self, url, **headers):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url, **headers)
+        return response, len(queries)
+
+    def test_matching_etag_is_not_modified(self):
+        response, _ = self.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('Accept', response['Vary'])
+        response, queries = self.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(queries, 1)
+
+    def test_cached_response_costs_only_the_validator_query(self):
+        first, _ = self.get('/api/stories/')
+        second, queries = self.get('/api/stories/')
+        self.assertEqual(queries, 1)
+        self.assertEqual(second.data, first.data)
+        self.assertEqual(second['ETag'], first['ETag'])
+
+    def test_child_edit_changes_the_story_etag(self):
+        before, _ = self.get(self.url)
+        self.character.description = 'Brave'
+        self.character.save()
+        after, _ = self.get(self.url, HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+        self.assertEqual(after.data['characters'][0]['description'], 'Brave')
+
+    def test_deletion_changes_the_list_etag(self):
+        other = Story.objects.create(user=self.user, title='Other', content='...')
+        before, _ = self.get('/api/stories/')
+        other.delete()
+        after, _ = self.get('/api/stories/', HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(after.data['count'], 1)
+
+    def test_other_users_do_not_share_entries(self):
+        response, _ = self.get(self.url)
+        other = User.objects.create_user('reader', password='pw')
+        self.client.force_authenticate(other)
+        response, _ = self.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 404)
@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import StoryViewSet, CharacterViewSet, ChapterViewSet
+from .views import StoryViewSet, CharacterViewSet, ChapterViewSet, search
 
 router = DefaultRouter()
 router.register(r'stories', StoryViewSet, basename='story')
@@ -9,4 +9,5 @@ router.register(r'chapters', ChapterViewSet, basename='chapter')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('search/', search, name='search'),
 ]
\ No newline at end of file
@@ -1,20 +1,94 @@
 from rest_framework import viewsets, status, permissions
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
+from rest_framework.parsers import MultiPartParser
 from rest_framework.response import Response
+from django.db.models import Count, Prefetch
+from django.db.models.functions import Length, Substr
 from django.shortcuts import get_object_or_404
+from plot.caching import ConditionalGetMixin
 from .models import Story, Chapter, Character
+from . import revisions, search as search_index
+from .screenplay import import_screenplay
 from .serializers import (
     StoryListSerializer, StoryDetailSerializer, StoryCreateSerializer,
-    ChapterSerializer, CharacterSerializer
+    ChapterSerializer, CharacterSerializer, RevisionSerializer, requested_fieldset, field_requested
 )
+import uuid
 
-class StoryViewSet(viewsets.ModelViewSet):
+MAX_SEARCH_RESULTS = 100
+
+# Characters of manuscript text returned per content page, by default and at most
+CONTENT_PAGE_SIZE = 50000
+MAX_CONTENT_PAGE_SIZE = 500000
+
+
+def content_page(request, queryset, pk):
+    """
+    One slice of a large ``content`` column (``?offset=&limit=`` in characters),
+    cut by the database so the rest of the text is never loaded
+    """
+    try:
+        offset = max(0, int(request.query_params.get('offset', 0)))
+        limit = min(MAX_CONTENT_PAGE_SIZE, max(1, int(request.query_params.get('limit', CONTENT_PAGE_SIZE))))
+    except ValueError:
+        return Response(
+            {'error': 'offset and limit must be integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    row = get_object_or_404(
+        queryset.annotate(length=Length('content'), chunk=Substr('content', offset + 1, limit))
+        .values('id', 'length', 'chunk'),
+        pk=pk
+    )
+    chunk = row['chunk'] or ''
+    end = offset + len(chunk)
+    return Response({
+        'id': row['id'],
+        'offset': offset,
+        'length': row['length'],
+        'content': chunk,
+        'next_offset': end if end < row['length'] else None,
+    })
+
+
+class StoryViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_validator_queryset(self):
+        # Chapter and character changes touch the story, so its own row dates it
+        return Story.objects.filter(user=self.request.user)
+
     def get_queryset(self):
+        stories = Story.objects.filter(user=self.request.user)
         if self.action == 'list':
-            return Story.objects.filter(user=self.request.user)
-        return Story.objects.filter(user=self.request.user)
+            # Counts in the list query itself instead of two COUNTs per row;
+            # aggregate queries ignore Meta.ordering, so order explicitly
+            return stories.defer('content').annotate(
+                characters_count=Count('characters', distinct=True),
+                chapters_count=Count('chapters', distinct=True),
+            ).order_by('-created_at')
+        if self.action == 'retrieve':
+            return self._sparse_story(stories, requested_fieldset(self.request))
+        if self.action in ('update', 'partial_update'):
+            return stories.prefetch_related('characters', 'chapters')
+        if self.action == 'content':
+            return stories.defer('content')
+        return stories
+
+    def _sparse_story(self, stories, fieldset):
+        """Load only the text columns and related rows the requested fields need"""
+        if not field_requested(fieldset, 'content'):
+            stories = stories.defer('content')
+        prefetches = []
+        if field_requested(fieldset, 'characters'):
+            prefetches.append('characters')
+        if field_requested(fieldset, 'chapters'):
+            chapters = Chapter.objects.all()
+            if not field_requested(fieldset, 'chapters.content'):
+                chapters = chapters.defer('content')
+            prefetches.append(Prefetch('chapters', queryset=chapters))
+        return stories.prefetch_related(*prefetches)
 
     def get_serializer_class(self):
         if self.action == 'list':
@@ -27,18 +101,109 @@ class StoryViewSet(viewsets.ModelViewSet):
     def characters(self, request, pk=None):
         story = self.get_object()
         characters = story.characters.all()
-        serializer = CharacterSerializer(characters, many=True)
+        serializer = CharacterSerializer(characters, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
     @action(detail=True, methods=['get'])
     def chapters(self, request, pk=None):
         story = self.get_object()
         chapters = story.chapters.all()
-        serializer = ChapterSerializer(chapters, many=True)
+        if not field_requested(requested_fieldset(request), 'content'):
+            chapters = chapters.defer('content')
+        serializer = ChapterSerializer(chapters, many=True, context=self.get_serializer_context())
         return Response(serializer.data)
 
-class CharacterViewSet(viewsets.ModelViewSet):
+    @action(detail=True, methods=['get'])
+    def content(self, request, pk=None):
+        """The story's manuscript a page at a time: ?offset=&limit="""
+        return content_page(request, self.get_queryset(), pk)
+
+    @action(detail=True, methods=['get'], url_path='revisions')
+    def revision_history(self, request, pk=None):
+        """Revisions of the story's content and chapters, newest first (?chapter= for one chapter)"""
+        story = self.get_object()
+        history = story.revisions.defer('data')
+        chapter_id = request.query_params.get('chapter')
+        if chapter_id:
+            try:
+                history = history.filter(chapter_id=uuid.UUID(chapter_id))
+            except ValueError:
+                raise ValidationError({'chapter': 'Must be a chapter ID'})
+        page = self.paginate_queryset(history)
+        serializer = RevisionSerializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def changes(self, request, pk=None):
+        """
+        What changed since revision ?since=N: status and changed character
+        spans of the story's content and of each chapter
+        """
+        story = self.get_object()
+        try:
+            since = int(request.query_params['since'])
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'since must be a revision number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(revisions.changes_since(story, since))
+
+    @action(detail=True, methods=['post'])
+    def rollback(self, request, pk=None):
+        """Restore the story's content and chapters to revision ``revision``"""
+        story = self.get_object()
+        try:
+            number = int(request.data.get('revision'))
+        except (TypeError, ValueError):
+            return Response(
+                {'error': 'revision must be a revision number'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            restored = revisions.rollback(story, number)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({
+            'revision': revisions.current_number(story),
+            'restored_from': number,
+            'chapters': restored,
+        })
+
+    @action(detail=False, methods=['post'], url_path='import', parser_classes=[MultiPartParser])
+    def import_screenplay(self, request):
+        """
+        New story from an uploaded screenplay (Fountain or plain text): a
+        chapter per scene and a character per speaker
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response(
+                {'error': 'A screenplay file is required'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            importer = import_screenplay(
+                upload.chunks(), request.user,
+                title=request.data.get('title'),
+                description=request.data.get('description', '')
+            )
+        except UnicodeDecodeError:
+            return Response(
+                {'error': 'Screenplay must be UTF-8 text'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        story = importer.story
+        # Counts are known from the import; don't query them back
+        story.chapters_count = importer.chapter_count
+        story.characters_count = importer.character_count
+        serializer = StoryListSerializer(story, context=self.get_serializer_context())
+        return Response(serializer.data, status=status.HTTP_201_CREATED)
+
+class CharacterViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = CharacterSerializer
+    # Characters have no updated_at; editing one touches its story
+    last_modified_fields = ('created_at', 'story__updated_at')
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
@@ -49,14 +214,69 @@ class CharacterViewSet(viewsets.ModelViewSet):
         story = get_object_or_404(Story, id=story_id, user=self.request.user)
         serializer.save(story=story)
 
-class ChapterViewSet(viewsets.ModelViewSet):
+class ChapterViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = ChapterSerializer
     permission_classes = [permissions.IsAuthenticated]
+    keyset_ordering = ('order', 'id')
 
     def get_queryset(self):
-        return Chapter.objects.filter(story__user=self.request.user)
+        chapters = Chapter.objects.filter(story__user=self.request.user)
+        story_id = self.request.query_params.get('story')
+        if story_id:
+            try:
+                chapters = chapters.filter(story_id=uuid.UUID(story_id))
+            except ValueError:
+                raise ValidationError({'story': 'Must be a story ID'})
+        if self.request.method == 'GET' and (
+            self.action == 'content'
+            or not field_requested(requested_fieldset(self.request), 'content')
+        ):
+            chapters = chapters.defer('content')
+        return chapters
+
+    @action(detail=True, methods=['get'])
+    def content(self, request, pk=None):
+        """The chapter's text a page at a time: ?offset=&limit="""
+        return content_page(request, self.get_queryset(), pk)
 
     def perform_create(self, serializer):
         story_id = self.request.data.get('story')
         story = get_object_or_404(Story, id=story_id, user=self.request.user)
         serializer.save(story=story)
+
+
+@api_view(['GET'])
+@permission_classes([permissions.IsAuthenticated])
+def search(request):
+    """
+    Ranked full-text search over the user's stories, chapters and characters:
+    ?q=<text>&type=story,chapter,character&limit=&offset=
+    """
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response(
+            {'error': 'q is required'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    kinds = [kind for kind in request.query_params.get('type', '').split(',') if kind] or search_index.KINDS
+    if any(kind not in search_index.KINDS for kind in kinds):
+        return Response(
+            {'error': f"type must be one or more of {', '.join(search_index.KINDS)}"},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        limit = min(MAX_SEARCH_RESULTS, max(1, int(request.query_params.get('limit', 20))))
+        offset = max(0, int(request.query_params.get('offset', 0)))
+    except ValueError:
+        return Response(
+            {'error': 'limit and offset must be integers'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+
+    results = search_index.search(request.user, query, kinds=kinds, limit=limit, offset=offset)
+    titles = dict(Story.objects.filter(
+        id__in={result['story_id'] for result in results}
+    ).values_list('id', 'title'))
+    for result in results:
+        result['story_title'] = titles.get(uuid.UUID(result['story_id']))
+    return Response({'query': query, 'results': results})